@@ -0,0 +1,302 @@
+"""Benchmarks for the start-up, tokenization, conversion and analysis paths.
+
+    python benchmarks/run.py                       # run and compare with baseline.json
+    python benchmarks/run.py --save-baseline       # store the results as the new baseline
+    python benchmarks/run.py --only convert_word --output results.json
+
+Results are written as JSON. Every result that is worse than the baseline
+by more than ``--threshold`` is reported as a regression and the exit
+status is 1. Per-item timings under ``FAST_RESULT_US`` only regress when
+they also move by more than ``--noise-floor`` microseconds.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+sys.path.insert(0, SRC)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Per-item timings below this many microseconds are compared with an
+# absolute noise floor as well as the relative threshold.
+FAST_RESULT_US = 10.0
+# Groups timed in several fresh interpreters (see ``run_in_processes``).
+PROCESS_GROUPS = ('tokenize', 'convert', 'analysis')
+
+# English, Spanish, German, Korean, Italian.
+LANGUAGE_PAIRS = [
+    ('stan1293', 'stan1288'),
+    ('kore1280', 'stan1293'),
+    ('stan1295', 'ital1282'),
+    ('stan1288', 'kore1280'),
+]
+
+COLD_START = r"""
+import json, sys, time, tracemalloc
+trace = '--trace' in sys.argv
+if trace:
+    tracemalloc.start()
+start = time.perf_counter()
+from core import PhonemeTokenizer, PhonemeConverter
+imported = time.perf_counter()
+tokens = PhonemeTokenizer(sys.argv[1]).tokenize(sys.argv[3])
+PhonemeConverter(table_cache_dir=None).convert_word_with_prosody(tokens, sys.argv[1], sys.argv[2])
+converted = time.perf_counter()
+result = {'import': imported - start, 'first_conversion': converted - imported}
+if trace:
+    result['peak'] = tracemalloc.get_traced_memory()[1]
+print(json.dumps(result))
+"""
+
+
+def sample_corpus(language_code: str, size: int, seed: int = 0) -> Tuple[List[List[str]], List[str]]:
+    """Words built from a language's inventory, as segment lists and strings.
+
+    Half of the words are random segment strings (synthetic); the other half
+    follow (C)V(C) syllable templates drawn from the inventory's consonants
+    and vowels, which is closer to real text.
+    """
+    from core import get_phoneme_inventory, get_data_store
+    features = get_data_store().phoneme_features
+    inventory = sorted(get_phoneme_inventory(language_code))
+    vowels = [p for p in inventory if features.get(p, {}).get('syllabic') == '+'] or inventory
+    consonants = [p for p in inventory if p not in vowels] or inventory
+    rng = random.Random(f'{language_code}:{seed}')
+    words = []
+    for i in range(size):
+        if i % 2:
+            word = [rng.choice(inventory) for _ in range(rng.randint(2, 8))]
+        else:
+            word = []
+            for _ in range(rng.randint(1, 3)):
+                if rng.random() < 0.8:
+                    word.append(rng.choice(consonants))
+                word.append(rng.choice(vowels))
+                if rng.random() < 0.3:
+                    word.append(rng.choice(consonants))
+        words.append(word)
+    return words, [''.join(word) for word in words]
+
+def time_per_call(function: Callable[[], Any], repeat: int, min_time: float) -> float:
+    """Best-of-``repeat`` seconds per call, each round lasting at least ``min_time``."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+def result(value: float, unit: str, better: str = 'lower', noise: float = 0.0) -> Dict[str, Any]:
+    entry = {'value': value, 'unit': unit, 'better': better}
+    if noise:
+        entry['noise'] = noise
+    return entry
+
+def per_item_result(function: Callable[[], Any], items: int, unit: str, args) -> Dict[str, Any]:
+    """Microseconds per item; fast results carry the absolute noise floor."""
+    value = time_per_call(function, args.repeat, args.min_time) / items * 1e6
+    return result(value, unit, noise=args.noise_floor if value < FAST_RESULT_US else 0.0)
+
+
+def bench_cold_start(args) -> Dict[str, Dict[str, Any]]:
+    source, target = LANGUAGE_PAIRS[0]
+    env = dict(os.environ, PYTHONPATH=SRC + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    runs = []
+    for _ in range(args.cold_runs):
+        output = subprocess.run([sys.executable, '-c', COLD_START, source, target, 'θɪŋk'],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {
+        'cold_start.import': result(statistics.median(r['import'] for r in runs), 's'),
+        'cold_start.first_conversion': result(statistics.median(r['first_conversion'] for r in runs), 's'),
+    }
+
+def bench_memory(args) -> Dict[str, Dict[str, Any]]:
+    source, target = LANGUAGE_PAIRS[0]
+    env = dict(os.environ, PYTHONPATH=SRC + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    output = subprocess.run([sys.executable, '-c', COLD_START, source, target, 'θɪŋk', '--trace'],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    peak = json.loads(output.splitlines()[-1])['peak']
+    return {'memory.peak_first_conversion': result(peak / 2 ** 20, 'MiB')}
+
+def bench_tokenize(args) -> Dict[str, Dict[str, Any]]:
+    from core import PhonemeTokenizer
+    results = {}
+    for source, _ in LANGUAGE_PAIRS[:2]:
+        _, texts = sample_corpus(source, args.corpus_size)
+        tokenizer = PhonemeTokenizer(source)
+        tokenizer.tokenize_many(texts)
+        seconds = time_per_call(lambda: [tokenizer.tokenize(text) for text in texts], args.repeat, args.min_time)
+        results[f'tokenize.{source}'] = result(len(texts) / seconds, 'words/s', 'higher')
+        seconds = time_per_call(lambda: tokenizer.tokenize_many(texts), args.repeat, args.min_time)
+        results[f'tokenize_many.{source}'] = result(len(texts) / seconds, 'words/s', 'higher')
+    return results
+
+def bench_convert(args) -> Dict[str, Dict[str, Any]]:
+    from core import PhonemeConverter, get_phoneme_inventory
+    converter = PhonemeConverter(table_cache_dir=None)
+    results = {}
+    for source, target in LANGUAGE_PAIRS:
+        words, _ = sample_corpus(source, args.corpus_size)
+        phonemes = sorted(get_phoneme_inventory(source))
+        converter.convert_word(phonemes, source, target)
+        results[f'convert_phoneme.{source}-{target}'] = per_item_result(
+            lambda: [converter.convert_phoneme(p, source, target) for p in phonemes], len(phonemes), 'us/phoneme', args)
+        results[f'convert_word.{source}-{target}'] = per_item_result(
+            lambda: [converter.convert_word(word, source, target) for word in words], len(words), 'us/word', args)
+    # A conversion table built from scratch, as on the first request for a pair.
+    source, target = LANGUAGE_PAIRS[0]
+    seconds = time_per_call(lambda: converter.conversion_tables.build(source, target), args.repeat, args.min_time)
+    results['conversion_table.build'] = result(seconds * 1e3, 'ms')
+    return results
+
+def bench_analysis(args) -> Dict[str, Dict[str, Any]]:
+    from core import FeatureAnalyzer, get_phoneme_inventory
+    analyzer = FeatureAnalyzer()
+    results = {}
+    for source, target in LANGUAGE_PAIRS[:2]:
+        phonemes = sorted(get_phoneme_inventory(source))
+        analyzer.find_similar_phonemes(phonemes[0], source, target)
+        results[f'find_similar_phonemes.{source}-{target}'] = per_item_result(
+            lambda: [analyzer.find_similar_phonemes(p, source, target) for p in phonemes], len(phonemes), 'us/phoneme', args)
+    languages = [source for source, _ in LANGUAGE_PAIRS]
+    results['analyze_language_inventory'] = per_item_result(
+        lambda: [analyzer.analyze_language_inventory(code) for code in languages], len(languages), 'us/language', args)
+    from core.inventory_statistics import InventoryStatistics
+    seconds = time_per_call(InventoryStatistics.build, args.repeat, args.min_time)
+    results['inventory_statistics.build'] = result(seconds * 1e3, 'ms')
+    return results
+
+BENCHMARKS = {
+    'cold_start': bench_cold_start,
+    'memory': bench_memory,
+    'tokenize': bench_tokenize,
+    'convert': bench_convert,
+    'analysis': bench_analysis,
+}
+
+def run_in_processes(name: str, args) -> Dict[str, Dict[str, Any]]:
+    """Runs a group in ``--processes`` fresh interpreters and keeps the best of each result.
+
+    The same code can time up to twice as slow in one interpreter launch as
+    in the next while staying steady within each, so more rounds in a single
+    process do not make short timings reproducible. The ``--repeat`` rounds
+    are spread over the processes.
+    """
+    repeat = max(1, -(-args.repeat // args.processes))
+    best: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = os.path.join(tmp_dir, 'results.json')
+        for _ in range(args.processes):
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--only', name, '--processes', '1',
+                            '--repeat', str(repeat), '--min-time', str(args.min_time),
+                            '--corpus-size', str(args.corpus_size), '--noise-floor', str(args.noise_floor),
+                            '--baseline', os.path.join(tmp_dir, 'none.json'), '--output', output],
+                           check=True, capture_output=True)
+            with open(output, encoding='utf-8') as f:
+                for key, current in json.load(f)['results'].items():
+                    previous = best.get(key)
+                    if (previous is None or current['value'] > previous['value'] if current['better'] == 'higher'
+                            else previous is None or current['value'] < previous['value']):
+                        best[key] = current
+    return best
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Prints a comparison table and returns the names of regressed results."""
+    regressions = []
+    print(f"{'benchmark':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<48} {'-':>12} {current['value']:>12.4g} {'new':>8}  {current['unit']}")
+            continue
+        ratio = current['value'] / previous['value'] if previous['value'] else float('inf')
+        # A positive change is always an improvement.
+        change = ratio - 1 if current['better'] == 'higher' else 1 - ratio
+        flag = ''
+        if change < -threshold and abs(current['value'] - previous['value']) > current.get('noise', 0.0):
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<48} {previous['value']:>12.4g} {current['value']:>12.4g} {change:>+8.1%}  {current['unit']}{flag}")
+    return regressions
+
+def metadata() -> Dict[str, Any]:
+    import numpy
+    from core.utils import DATASET_FILES, data_version
+    from core.binary_data import default_binary_path
+    files = [f for f in DATASET_FILES.values() if os.path.exists(os.path.join(ROOT, 'data', f))]
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'data_version': data_version(files),
+        'compiled_data': os.path.exists(default_binary_path()),
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="Benchmark groups to run")
+    parser.add_argument('--output', help="Write results as JSON to this path")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store the results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown before flagging (default: 0.25)")
+    parser.add_argument('--corpus-size', type=int, default=1000, help="Words per sampled corpus")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Minimum seconds per timing round")
+    parser.add_argument('--cold-runs', type=int, default=3, help="Interpreter launches for cold-start timing")
+    parser.add_argument('--noise-floor', type=float, default=2.0,
+                        help=f"Microseconds a result under {FAST_RESULT_US:g} us may move without regressing (default: 2.0)")
+    parser.add_argument('--processes', type=int, default=5,
+                        help=f"Fresh interpreters to time {', '.join(PROCESS_GROUPS)} in (default: 5)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        if name in PROCESS_GROUPS and args.processes > 1:
+            results.update(run_in_processes(name, args))
+        else:
+            results.update(BENCHMARKS[name](args))
+    report = {'meta': metadata(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
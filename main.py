@@ -1,9 +1,48 @@
+import argparse
+import fileinput
 import sys
 from core import PhonemeTokenizer, PhonemeConverter
 
+def batch_main(argv):
+    from core.batch import convert_stream
+
+    parser = argparse.ArgumentParser(prog='main.py --batch', description="Convert a corpus line by line.")
+    parser.add_argument('source_language')
+    parser.add_argument('target_language')
+    parser.add_argument('files', nargs='*', help="Input files (default: stdin)")
+    parser.add_argument('--input-format', choices=['text', 'jsonl'], default=None,
+                        help="Input format (default: jsonl for *.jsonl files, text otherwise)")
+    parser.add_argument('--output-format', choices=['text', 'jsonl'], default=None,
+                        help="Output format (default: same as the input format)")
+    parser.add_argument('--workers', type=int, default=0, help="Number of worker processes (default: 0, convert in-process)")
+    parser.add_argument('--chunk-size', type=int, default=512, help="Lines per worker task")
+    parser.add_argument('--shared-data', action='store_true',
+                        help="Publish the datasets once in shared memory instead of loading them in every worker")
+    args = parser.parse_args(argv)
+
+    input_format = args.input_format
+    if input_format is None:
+        input_format = 'jsonl' if args.files and all(f.endswith('.jsonl') for f in args.files) else 'text'
+    output_format = args.output_format or input_format
+
+    with fileinput.input(args.files or ['-'], openhook=fileinput.hook_encoded('utf-8')) as lines:
+        for output in convert_stream(lines, args.source_language, args.target_language, input_format,
+                                     output_format, args.workers, args.chunk_size, args.shared_data):
+            sys.stdout.write(output + '\n')
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        batch_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        from core.service import main as serve_main
+        serve_main(sys.argv[2:])
+        return
+
     if len(sys.argv) != 4:
         print("Usage: python main.py <source_text> <source_language> <target_language>")
+        print("       python main.py --batch <source_language> <target_language> [FILE ...] [--workers N]")
+        print("       python main.py --serve [--host HOST] [--port PORT] [--warm SOURCE:TARGET]")
         sys.exit(1)
 
     source_text = sys.argv[1]
@@ -7,7 +7,7 @@ setup(
     packages=find_packages(where='src'),
     include_package_data=True,
     install_requires=[
-        # Add any dependencies here
+        'numpy',
     ],
     extras_require={
         'dev': [
@@ -1,11 +1,17 @@
-from .utils import PhonemeTokenizer, get_phoneme_inventory, get_phoneme_features
+from .utils import PhonemeTokenizer, DataStore, get_data_store, get_phoneme_inventory, get_phoneme_features
 from .feature_analyzer import FeatureAnalyzer
 from .phoneme_converter import PhonemeConverter
+from .instrumentation import get_metrics
+from .alignment import Aligner
 
 __all__ = [
     'PhonemeTokenizer',
     'FeatureAnalyzer',
     'PhonemeConverter',
+    'Aligner',
+    'DataStore',
+    'get_data_store',
     'get_phoneme_inventory',
-    'get_phoneme_features'
+    'get_phoneme_features',
+    'get_metrics'
 ]
\ No newline at end of file
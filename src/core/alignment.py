@@ -0,0 +1,235 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+from .utils import get_data_store, get_phoneme_inventory, register_derived
+from .feature_matrix import get_feature_matrix
+from .segment_index import get_segment_index
+
+DEFAULT_GAP_COST = 0.5
+DEFAULT_BATCH_SIZE = 4096
+
+Alignment = List[Tuple[Optional[str], Optional[str]]]
+
+# Traceback moves.
+_DIAGONAL, _UP, _LEFT = 0, 1, 2
+
+
+class _Alphabet:
+    """Segments numbered in order of first use, with their feature vectors."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.segments: List[str] = []
+
+    def add(self, segments: Sequence[str]) -> List[str]:
+        new = [segment for segment in dict.fromkeys(segments) if segment not in self.ids]
+        for segment in new:
+            self.ids[segment] = len(self.segments)
+            self.segments.append(segment)
+        return new
+
+
+class Aligner:
+    """Weighted edit distance and alignment between segment sequences.
+
+    Substituting one segment for another costs the weighted fraction of
+    features on which they differ (0 to 1); inserting or deleting costs
+    ``gap_cost``. Costs are held in one matrix over the source and target
+    alphabets, seeded with the two inventories when languages are given
+    and extended as other segments turn up.
+
+    Word pairs are aligned in batches of similar length. Each batch is one
+    dynamic program vectorized across the pairs and along each row: with a
+    constant gap cost, the left-to-right insertion recurrence is a running
+    minimum, so a row costs a handful of array operations.
+    """
+
+    def __init__(self, source_language: Optional[str] = None, target_language: Optional[str] = None,
+                 weights: Optional[Dict[str, float]] = None, gap_cost: float = DEFAULT_GAP_COST,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        self.matrix = get_feature_matrix()
+        self.segment_index = get_segment_index()
+        self.gap_cost = gap_cost
+        self.batch_size = batch_size
+
+        self.weights = np.ones(len(self.matrix.features), dtype=np.float32)
+        for feature, weight in (weights or {}).items():
+            if feature not in self.matrix.feature_index:
+                raise ValueError(f"Unknown feature '{feature}'")
+            self.weights[self.matrix.feature_index[feature]] = weight
+        total = self.weights.sum()
+        self.weights /= total if total > 0 else 1
+
+        self.source = _Alphabet()
+        self.target = _Alphabet()
+        self.costs = np.zeros((0, 0), dtype=np.float32)
+        self._source_vectors = np.zeros((0, len(self.matrix.features)), dtype=self.matrix.codes.dtype)
+        self._target_vectors = self._source_vectors
+        self._extend(get_phoneme_inventory(source_language) if source_language else [],
+                     get_phoneme_inventory(target_language) if target_language else [])
+
+    def _weighted_distances(self, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+        costs = np.empty((len(left), len(right)), dtype=np.float32)
+        # Chunked so the (rows, columns, features) comparison stays small.
+        step = max(1, (1 << 22) // max(1, len(right) * left.shape[1]))
+        for start in range(0, len(left), step):
+            costs[start:start + step] = (left[start:start + step, None, :] != right[None, :, :]) @ self.weights
+        return costs
+
+    def _extend(self, source_segments: Sequence[str], target_segments: Sequence[str]):
+        new_sources = self.source.add(source_segments)
+        new_targets = self.target.add(target_segments)
+        if not new_sources and not new_targets:
+            return
+        if new_sources:
+            self._source_vectors = np.concatenate([self._source_vectors, self.segment_index.vectors(new_sources)])
+        if new_targets:
+            self._target_vectors = np.concatenate([self._target_vectors, self.segment_index.vectors(new_targets)])
+        old_rows, old_cols = self.costs.shape
+        costs = np.empty((len(self.source.segments), len(self.target.segments)), dtype=np.float32)
+        costs[:old_rows, :old_cols] = self.costs
+        costs[old_rows:, :] = self._weighted_distances(self._source_vectors[old_rows:], self._target_vectors)
+        costs[:old_rows, old_cols:] = self._weighted_distances(self._source_vectors[:old_rows], self._target_vectors[old_cols:])
+        self.costs = costs
+
+    def substitution_cost(self, source_segment: str, target_segment: str) -> float:
+        self._extend([source_segment], [target_segment])
+        return float(self.costs[self.source.ids[source_segment], self.target.ids[target_segment]])
+
+    def _encode(self, pairs: Sequence[Tuple[Sequence[str], Sequence[str]]]):
+        self._extend([s for source, _ in pairs for s in source], [t for _, target in pairs for t in target])
+        source_ids, target_ids = self.source.ids, self.target.ids
+        source_lengths = np.array([len(source) for source, _ in pairs], dtype=np.intp)
+        target_lengths = np.array([len(target) for _, target in pairs], dtype=np.intp)
+        sources = np.zeros((len(pairs), max(source_lengths.max(initial=0), 1)), dtype=np.intp)
+        targets = np.zeros((len(pairs), max(target_lengths.max(initial=0), 1)), dtype=np.intp)
+        for k, (source, target) in enumerate(pairs):
+            sources[k, :len(source)] = [source_ids[s] for s in source]
+            targets[k, :len(target)] = [target_ids[t] for t in target]
+        return sources, source_lengths, targets, target_lengths
+
+    def _run(self, sources: np.ndarray, source_lengths: np.ndarray, targets: np.ndarray,
+             target_lengths: np.ndarray, keep_table: bool):
+        batch, rows = len(sources), source_lengths.max(initial=0)
+        columns = targets.shape[1]
+        gap = np.float32(self.gap_cost)
+        ramp = gap * np.arange(columns + 1, dtype=np.float32)
+        row = np.broadcast_to(ramp, (batch, columns + 1)).copy()
+        table = np.empty((batch, rows + 1, columns + 1), dtype=np.float32) if keep_table else None
+        if keep_table:
+            table[:, 0] = row
+        distances = np.empty(batch, dtype=np.float32)
+        at_row = np.arange(batch)
+        done = source_lengths == 0
+        distances[done] = row[done, target_lengths[done]]
+
+        for i in range(1, rows + 1):
+            substitution = self.costs[sources[:, i - 1][:, None], targets]
+            best = np.empty_like(row)
+            best[:, 0] = row[:, 0] + gap
+            np.minimum(row[:, :-1] + substitution, row[:, 1:] + gap, out=best[:, 1:])
+            # D[j] = min over k <= j of best[k] + gap * (j - k)
+            row = np.minimum.accumulate(best - ramp, axis=1) + ramp
+            if keep_table:
+                table[:, i] = row
+            finished = source_lengths == i
+            distances[finished] = row[at_row[finished], target_lengths[finished]]
+        return distances, table
+
+    def _batches(self, pairs: Sequence[Tuple[Sequence[str], Sequence[str]]]):
+        # Pairs of similar length share a batch, which keeps padding low.
+        order = sorted(range(len(pairs)), key=lambda k: (len(pairs[k][0]), len(pairs[k][1])))
+        for start in range(0, len(order), self.batch_size):
+            indexes = order[start:start + self.batch_size]
+            yield indexes, [pairs[k] for k in indexes]
+
+    def distances(self, pairs: Sequence[Tuple[Sequence[str], Sequence[str]]], normalize: bool = False) -> np.ndarray:
+        """Edit distances for many (source, target) segment sequences.
+
+        With ``normalize`` each distance is divided by the longer sequence's
+        length.
+        """
+        pairs = list(pairs)
+        result = np.zeros(len(pairs), dtype=np.float32)
+        for indexes, batch in self._batches(pairs):
+            encoded = self._encode(batch)
+            result[indexes] = self._run(*encoded, keep_table=False)[0]
+        if normalize:
+            lengths = np.array([max(len(source), len(target), 1) for source, target in pairs], dtype=np.float32)
+            result /= lengths
+        return result
+
+    def distance(self, source: Sequence[str], target: Sequence[str], normalize: bool = False) -> float:
+        return float(self.distances([(source, target)], normalize)[0])
+
+    def align_many(self, pairs: Sequence[Tuple[Sequence[str], Sequence[str]]]) -> List[Tuple[float, Alignment]]:
+        """Distances and optimal alignments; a gap is ``None`` on its side."""
+        pairs = list(pairs)
+        result: List[Tuple[float, Alignment]] = [None] * len(pairs)
+        for indexes, batch in self._batches(pairs):
+            sources, source_lengths, targets, target_lengths = self._encode(batch)
+            distances, table = self._run(sources, source_lengths, targets, target_lengths, keep_table=True)
+            moves = self._traceback(table, sources, source_lengths, targets, target_lengths)
+            for k, (index, (source, target)) in enumerate(zip(indexes, batch)):
+                i, j = 0, 0
+                alignment = []
+                for move in reversed(moves[k]):
+                    if move == _DIAGONAL:
+                        alignment.append((source[i], target[j]))
+                        i += 1
+                        j += 1
+                    elif move == _UP:
+                        alignment.append((source[i], None))
+                        i += 1
+                    else:
+                        alignment.append((None, target[j]))
+                        j += 1
+                result[index] = (float(distances[k]), alignment)
+        return result
+
+    def align(self, source: Sequence[str], target: Sequence[str]) -> Tuple[float, Alignment]:
+        return self.align_many([(source, target)])[0]
+
+    def _traceback(self, table: np.ndarray, sources: np.ndarray, source_lengths: np.ndarray,
+                   targets: np.ndarray, target_lengths: np.ndarray) -> List[List[int]]:
+        # All pairs step back from their final cell together; a pair drops
+        # out once it reaches (0, 0). Ties prefer substitution, then deletion.
+        batch = len(table)
+        i, j = source_lengths.copy(), target_lengths.copy()
+        at = np.arange(batch)
+        gap = np.float32(self.gap_cost)
+        steps = []
+        active = (i > 0) | (j > 0)
+        while active.any():
+            k = at[active]
+            ik, jk = i[k], j[k]
+            here = table[k, ik, jk]
+            move = np.full(len(k), _LEFT, dtype=np.int8)
+            can_up = ik > 0
+            up = np.where(can_up, table[k, np.maximum(ik - 1, 0), jk] + gap, np.inf)
+            move[can_up & np.isclose(here, up)] = _UP
+            can_diagonal = (ik > 0) & (jk > 0)
+            substitution = self.costs[sources[k, np.maximum(ik - 1, 0)], targets[k, np.maximum(jk - 1, 0)]]
+            diagonal = np.where(can_diagonal, table[k, np.maximum(ik - 1, 0), np.maximum(jk - 1, 0)] + substitution, np.inf)
+            move[can_diagonal & np.isclose(here, diagonal)] = _DIAGONAL
+            move[jk == 0] = _UP
+            step = np.full(batch, -1, dtype=np.int8)
+            step[k] = move
+            steps.append(step)
+            i[k] -= (move != _LEFT)
+            j[k] -= (move != _UP)
+            active = (i > 0) | (j > 0)
+
+        moves = np.array(steps, dtype=np.int8).T if steps else np.empty((batch, 0), dtype=np.int8)
+        return [[m for m in pair if m >= 0] for pair in moves.tolist()]
+
+
+register_derived('aligners', ('language_phonemes', 'phoneme_features'), per_language=True)
+
+def get_aligner(source_language: str, target_language: str) -> Aligner:
+    """Aligner with default weights for a language pair, cached per pair."""
+    aligners = get_data_store().derived('aligners', lambda store: {})
+    key = (source_language, target_language)
+    aligner = aligners.get(key)
+    if aligner is None:
+        aligner = aligners[key] = Aligner(source_language, target_language)
+    return aligner
@@ -0,0 +1,79 @@
+import numpy as np
+from typing import Dict, List, Tuple
+from .utils import LRUCache, get_data_store, get_phoneme_inventory, register_derived
+from .segment_index import SegmentIndex, get_segment_index
+from .glottolog import resolve_language_code
+
+# (phoneme, source surface) pairs whose realization is remembered.
+MAX_REALIZATIONS = 4096
+
+class AllophoneIndex:
+    """Inverted index from surface segments to the phonemes they realize.
+
+    Every phoneme resolves to itself. A segment listed as an allophone of
+    several phonemes resolves to the one whose features are closest to it,
+    so resolution is a single dictionary lookup.
+    """
+
+    def __init__(self, phonemes: List[str], allophones: Dict[str, List[str]], segment_index: SegmentIndex):
+        self.segment_index = segment_index
+        self.phonemes = list(phonemes)
+        self.allophones: Dict[str, Tuple[str, ...]] = {
+            phoneme: tuple(dict.fromkeys([phoneme] + list(allophones.get(phoneme, []))))
+            for phoneme in self.phonemes
+        }
+        for phoneme, surface_forms in allophones.items():
+            if phoneme not in self.allophones:
+                self.allophones[phoneme] = tuple(dict.fromkeys([phoneme] + list(surface_forms)))
+
+        candidates: Dict[str, List[str]] = {}
+        for phoneme, surface_forms in self.allophones.items():
+            for surface in surface_forms:
+                candidates.setdefault(surface, []).append(phoneme)
+
+        self.phonemes_by_allophone: Dict[str, Tuple[str, ...]] = {s: tuple(p) for s, p in candidates.items()}
+        self.underlying: Dict[str, str] = {}
+        for surface, phonemes_for_surface in candidates.items():
+            if surface in self.allophones and surface in phonemes_for_surface:
+                self.underlying[surface] = surface
+            else:
+                self.underlying[surface] = self._closest(surface, phonemes_for_surface)
+        self._realizations = LRUCache(MAX_REALIZATIONS)
+
+    def _closest(self, segment: str, options: List[str]) -> str:
+        if len(options) == 1:
+            return options[0]
+        distances = (self.segment_index.vectors(options) != self.segment_index.vector(segment)).sum(axis=1)
+        return options[int(np.argmin(distances))]
+
+    @property
+    def segments(self) -> List[str]:
+        return list(self.underlying)
+
+    def resolve(self, segment: str) -> str:
+        return self.underlying.get(segment, segment)
+
+    def resolve_word(self, word: List[str]) -> List[str]:
+        underlying = self.underlying
+        return [underlying.get(segment, segment) for segment in word]
+
+    def realize(self, phoneme: str, source_surface: str) -> str:
+        """Picks the allophone of ``phoneme`` that best fits a source surface form."""
+        key = (phoneme, source_surface)
+        realization = self._realizations.get(key)
+        if realization is None:
+            # The phoneme itself is listed first, so it wins ties.
+            realization = self._realizations.put(key, self._closest(source_surface, list(self.allophones.get(phoneme, (phoneme,)))))
+        return realization
+
+
+register_derived('allophone_indexes', ('language_phonemes', 'language_allophones', 'phoneme_features'), per_language=True)
+
+def get_allophone_index(language_code: str) -> AllophoneIndex:
+    store = get_data_store()
+    indexes = store.derived('allophone_indexes', lambda store: {})
+    index = indexes.get(language_code)
+    if index is None:
+        allophones = store.language_allophones.get(resolve_language_code(language_code) or language_code, {})
+        index = indexes[language_code] = AllophoneIndex(get_phoneme_inventory(language_code), allophones, get_segment_index())
+    return index
@@ -0,0 +1,125 @@
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .utils import PhonemeTokenizer
+from .phoneme_converter import PhonemeConverter
+from .word_cache import WordCache
+
+DEFAULT_CHUNK_SIZE = 512
+
+class BatchConverter:
+    """Tokenizes and converts lines of text, one record per line.
+
+    Each whitespace-separated word of a line is tokenized and converted on
+    its own so that prosody is assigned per word. Unless a converter is
+    given, results are memoized per word type in a ``WordCache``.
+    """
+
+    def __init__(self, source_language: str, target_language: str, converter: Optional[PhonemeConverter] = None):
+        self.source_language = source_language
+        self.target_language = target_language
+        self.tokenizer = PhonemeTokenizer(source_language)
+        self.converter = converter or PhonemeConverter(word_cache=WordCache())
+
+    def convert_line(self, line: str) -> Dict[str, Any]:
+        words = self.tokenizer.tokenize_many(line.split())
+        converted = self.converter.convert_words_with_prosody(words, self.source_language, self.target_language)
+        return {
+            'text': line,
+            'words': [
+                {'source': source, 'converted': phonemes, 'prosody': prosody}
+                for source, (phonemes, prosody) in zip(words, converted)
+            ],
+        }
+
+    def convert_lines(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        for line in lines:
+            yield self.convert_line(line)
+
+
+_worker: Optional[BatchConverter] = None
+
+def _init_worker(source_language: str, target_language: str, shared_name: Optional[str] = None):
+    global _worker
+    if shared_name is not None:
+        from .shared_data import attach_shared_datasets
+        attach_shared_datasets(shared_name)
+    _worker = BatchConverter(source_language, target_language)
+
+def _convert_chunk(lines: List[str]) -> List[Dict[str, Any]]:
+    return [_worker.convert_line(line) for line in lines]
+
+def _chunks(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def convert_lines(lines: Iterable[str], source_language: str, target_language: str,
+                  workers: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  shared_data: bool = False) -> Iterator[Dict[str, Any]]:
+    """Converts a stream of lines, yielding one record per line in input order.
+
+    With ``workers`` > 0 chunks of lines are spread over a process pool.
+    At most ``2 * workers`` chunks are in flight at any time, so memory use
+    does not grow with the size of the input. With ``shared_data`` the
+    datasets and the pair's conversion table are published once in shared
+    memory and the workers read them from there instead of loading their
+    own copies.
+    """
+    if workers <= 0:
+        yield from BatchConverter(source_language, target_language).convert_lines(lines)
+        return
+
+    shared = None
+    if shared_data:
+        from .shared_data import publish_shared_datasets
+        shared = publish_shared_datasets([(source_language, target_language)])
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(source_language, target_language, shared and shared.name)) as pool:
+            pending = deque()
+            for chunk in _chunks(lines, chunk_size):
+                pending.append(pool.submit(_convert_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+    finally:
+        if shared is not None:
+            shared.unlink()
+
+def read_records(lines: Iterable[str], input_format: str = 'text') -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for line in lines:
+        line = line.rstrip('\n')
+        if input_format == 'jsonl':
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record.get('text', ''), record
+        else:
+            yield line, {}
+
+def format_record(result: Dict[str, Any], extra: Dict[str, Any], output_format: str = 'text') -> str:
+    if output_format == 'jsonl':
+        return json.dumps(dict(extra, **result), ensure_ascii=False)
+    return ' '.join(''.join(word['converted']) for word in result['words'])
+
+def convert_stream(lines: Iterable[str], source_language: str, target_language: str,
+                   input_format: str = 'text', output_format: str = 'text',
+                   workers: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE, shared_data: bool = False) -> Iterator[str]:
+    # Extra JSONL fields are held back in a queue that only spans the
+    # chunks currently in flight, and are merged back in input order.
+    extras = deque()
+
+    def texts():
+        for text, extra in read_records(lines, input_format):
+            extras.append(extra)
+            yield text
+
+    for result in convert_lines(texts(), source_language, target_language, workers, chunk_size, shared_data):
+        yield format_record(result, extras.popleft(), output_format)
@@ -0,0 +1,398 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import numpy as np
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+from .utils import DataStore, DATASET_FILES, DEFAULT_BINARY_FILE, atomic_write, file_digest, get_data_file_path
+from .feature_matrix import FeatureMatrix
+
+# Layout (little-endian):
+#   header   MAGIC, uint32 format version, uint32 section count
+#   table    per section: 24-byte name, uint64 offset, uint64 length
+#   sections 8-byte aligned blobs; string tables are a uint32 offset array
+#            ("<name>.off") over a UTF-8 blob ("<name>.str")
+MAGIC = b'KUNAIBIN'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<8sII')
+SECTION = struct.Struct('<24sQQ')
+ALIGNMENT = 8
+
+BINARY_DATASETS = ('language_phonemes', 'language_allophones', 'phoneme_features')
+
+def default_binary_path() -> str:
+    return get_data_file_path(DEFAULT_BINARY_FILE)
+
+def _source_info(file_name: str) -> Dict[str, object]:
+    path = get_data_file_path(file_name)
+    stat = os.stat(path)
+    return {'file': file_name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_digest(path)}
+
+def _string_table(strings: List[str]) -> Tuple[np.ndarray, bytes]:
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+def build_sections(store: Optional[DataStore] = None,
+                   conversion_tables: Optional[Mapping] = None) -> Dict[str, bytes]:
+    """Encodes the datasets (and optionally conversion tables) as named sections.
+
+    ``conversion_tables`` maps (source, target) language pairs to
+    source -> target segment tables.
+    """
+    store = store or DataStore(binary_path=None)
+    phoneme_features = store.phoneme_features
+    language_phonemes = store.language_phonemes
+    language_allophones = store.language_allophones
+
+    matrix = FeatureMatrix(phoneme_features)
+    segments = list(matrix.segments)
+    segment_ids = dict(matrix.index)
+
+    def intern(segment: str) -> int:
+        if segment not in segment_ids:
+            segment_ids[segment] = len(segments)
+            segments.append(segment)
+        return segment_ids[segment]
+
+    languages = sorted(set(language_phonemes) | set(language_allophones))
+
+    inventory_offsets = [0]
+    inventory_segments: List[int] = []
+    for language in languages:
+        inventory_segments.extend(intern(p) for p in language_phonemes.get(language, []))
+        inventory_offsets.append(len(inventory_segments))
+
+    allophone_offsets = [0]
+    allophone_phonemes: List[int] = []
+    allophone_list_offsets = [0]
+    allophone_segments: List[int] = []
+    for language in languages:
+        for phoneme, allophones in language_allophones.get(language, {}).items():
+            allophone_phonemes.append(intern(phoneme))
+            allophone_segments.extend(intern(a) for a in allophones)
+            allophone_list_offsets.append(len(allophone_segments))
+        allophone_offsets.append(len(allophone_phonemes))
+
+    arrays = [('inv.off', inventory_offsets), ('inv.seg', inventory_segments),
+              ('allo.off', allophone_offsets), ('allo.phon', allophone_phonemes),
+              ('allo.list', allophone_list_offsets), ('allo.seg', allophone_segments)]
+    strings = [('segments', segments), ('features', matrix.features), ('values', matrix.values), ('languages', languages)]
+
+    if conversion_tables:
+        pairs = sorted(conversion_tables)
+        table_offsets = [0]
+        table_sources: List[int] = []
+        table_targets: List[int] = []
+        for pair in pairs:
+            for source, target in conversion_tables[pair].items():
+                table_sources.append(intern(source))
+                table_targets.append(intern(target))
+            table_offsets.append(len(table_sources))
+        arrays += [('conv.off', table_offsets), ('conv.src', table_sources), ('conv.tgt', table_targets)]
+        strings.append(('pairs', [f'{source}\t{target}' for source, target in pairs]))
+
+    sections: Dict[str, bytes] = {}
+    for name, table in strings:
+        offsets, blob = _string_table(table)
+        sections[f'{name}.off'] = offsets.tobytes()
+        sections[f'{name}.str'] = blob
+    sections['codes'] = np.ascontiguousarray(matrix.codes, dtype=np.int8).tobytes()
+    sections['feat.extra'] = json.dumps(_feature_extras(phoneme_features, matrix), ensure_ascii=False,
+                                        separators=(',', ':')).encode('utf-8')
+    for name, values in arrays:
+        sections[name] = np.asarray(values, dtype='<u4').tobytes()
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'feature_segments': len(matrix.segments),
+        'sources': {name: _source_info(store.dataset_files[name]) for name in BINARY_DATASETS},
+    }
+    sections['meta'] = json.dumps(meta, sort_keys=True).encode('utf-8')
+    return sections
+
+def _feature_extras(phoneme_features: Mapping, matrix: FeatureMatrix) -> Dict[str, Dict[str, object]]:
+    # What the codes matrix cannot express, per segment: the non-feature
+    # keys and their values (in order, they come before the features) and
+    # features the segment does not list at all.
+    extras = {}
+    for segment, features in phoneme_features.items():
+        extra = {}
+        metadata = [[key, value] for key, value in features.items() if key not in matrix.feature_index]
+        if metadata:
+            extra['meta'] = metadata
+        absent = [feature for feature in matrix.features if feature not in features]
+        if absent:
+            extra['absent'] = absent
+        if extra:
+            extras[segment] = extra
+    return extras
+
+def compile_binary_data(output_path: Optional[str] = None, store: Optional[DataStore] = None,
+                        conversion_tables: Optional[Mapping] = None) -> str:
+    output_path = output_path or default_binary_path()
+    _write_sections(output_path, build_sections(store, conversion_tables))
+    return output_path
+
+def pack_sections(sections: Dict[str, bytes]) -> bytes:
+    table_size = HEADER.size + SECTION.size * len(sections)
+    offset = -(-table_size // ALIGNMENT) * ALIGNMENT
+    entries = []
+    for name, blob in sections.items():
+        entries.append((name, offset, len(blob)))
+        offset += -(-len(blob) // ALIGNMENT) * ALIGNMENT
+
+    data = bytearray(offset)
+    HEADER.pack_into(data, 0, MAGIC, FORMAT_VERSION, len(sections))
+    for i, (name, section_offset, length) in enumerate(entries):
+        SECTION.pack_into(data, HEADER.size + i * SECTION.size, name.encode('ascii'), section_offset, length)
+        data[section_offset:section_offset + length] = sections[name]
+    return bytes(data)
+
+def _write_sections(output_path: str, sections: Dict[str, bytes]):
+    with atomic_write(output_path) as f:
+        f.write(pack_sections(sections))
+
+
+class StringTable:
+    def __init__(self, offsets: np.ndarray, blob: memoryview):
+        self.offsets = offsets
+        self.blob = blob
+        self._strings: Optional[List[str]] = None
+        self._index: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.strings[i]
+
+    @property
+    def strings(self) -> List[str]:
+        if self._strings is None:
+            offsets = self.offsets.tolist()
+            blob = bytes(self.blob)
+            self._strings = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+        return self._strings
+
+    @property
+    def index(self) -> Dict[str, int]:
+        if self._index is None:
+            self._index = {s: i for i, s in enumerate(self.strings)}
+        return self._index
+
+
+class BinaryDataset:
+    """Read-only view over a compiled data file.
+
+    Arrays are numpy views straight onto the mapped pages, so opening the
+    file does no parsing and worker processes share the same memory.
+    Strings are decoded the first time a table is touched.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._init_from_buffer(self._mmap)
+
+    @classmethod
+    def from_buffer(cls, buffer, path: str = '<buffer>') -> 'BinaryDataset':
+        dataset = cls.__new__(cls)
+        dataset.path = path
+        dataset._mmap = None
+        dataset._init_from_buffer(buffer)
+        return dataset
+
+    def _init_from_buffer(self, buffer):
+        self._buffer = memoryview(buffer)
+        magic, version, count = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a compiled KUNAI data file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} has format version {version}, expected {FORMAT_VERSION}")
+        self._sections: Dict[str, Tuple[int, int]] = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(self._buffer, HEADER.size + i * SECTION.size)
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+
+        self.meta = json.loads(bytes(self._section('meta')).decode('utf-8'))
+        self.segments = self._strings('segments')
+        self.features = self._strings('features')
+        self.values = self._strings('values')
+        self.languages = self._strings('languages')
+        self.feature_segments: int = self.meta['feature_segments']
+        self.codes = self._array('codes', np.int8).reshape(self.feature_segments, len(self.features))
+        self.inventory_offsets = self._array('inv.off', '<u4')
+        self.inventory_segments = self._array('inv.seg', '<u4')
+        self.allophone_offsets = self._array('allo.off', '<u4')
+        self.allophone_phonemes = self._array('allo.phon', '<u4')
+        self.allophone_list_offsets = self._array('allo.list', '<u4')
+        self.allophone_segments = self._array('allo.seg', '<u4')
+        # Conversion tables are optional.
+        self.pairs = self._strings('pairs') if 'pairs.off' in self._sections else None
+        if self.pairs is not None:
+            self.table_offsets = self._array('conv.off', '<u4')
+            self.table_sources = self._array('conv.src', '<u4')
+            self.table_targets = self._array('conv.tgt', '<u4')
+        self._feature_extras: Optional[Dict[str, Dict[str, object]]] = None
+        # Decoded on first use; the arrays behind them never change.
+        self._inventories: Dict[str, List[str]] = {}
+        self._allophones: Dict[str, Dict[str, List[str]]] = {}
+        self.datasets = {
+            'language_phonemes': InventoryView(self),
+            'language_allophones': AllophoneView(self),
+            'phoneme_features': PhonemeFeatureView(self),
+        }
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self._sections[name]
+        return self._buffer[offset:offset + length]
+
+    def section(self, name: str) -> Optional[memoryview]:
+        """A raw section, or None when the file does not have it."""
+        return self._section(name) if name in self._sections else None
+
+    def _array(self, name: str, dtype) -> np.ndarray:
+        return np.frombuffer(self._section(name), dtype=dtype)
+
+    def _strings(self, name: str) -> StringTable:
+        return StringTable(self._array(f'{name}.off', '<u4'), self._section(f'{name}.str'))
+
+    def dataset(self, name: str) -> Mapping:
+        return self.datasets[name]
+
+    def is_current(self, dataset_files: Optional[Dict[str, str]] = None) -> bool:
+        dataset_files = dataset_files or DATASET_FILES
+        for name, source in self.meta['sources'].items():
+            if dataset_files.get(name) != source['file']:
+                return False
+            path = get_data_file_path(source['file'])
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Deployments may ship only the compiled file.
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (source['size'], source['mtime_ns']):
+                continue
+            if stat.st_size != source['size'] or file_digest(path) != source['sha256']:
+                return False
+        return True
+
+    def feature_matrix(self) -> FeatureMatrix:
+        return FeatureMatrix.from_arrays(
+            self.segments.strings[:self.feature_segments], list(self.features.strings),
+            list(self.values.strings), self.codes)
+
+    def inventory(self, language_code: str) -> List[str]:
+        inventory = self._inventories.get(language_code)
+        if inventory is None:
+            i = self.languages.index[language_code]
+            ids = self.inventory_segments[self.inventory_offsets[i]:self.inventory_offsets[i + 1]]
+            segments = self.segments.strings
+            inventory = self._inventories[language_code] = [segments[j] for j in ids.tolist()]
+        return inventory
+
+    def allophones(self, language_code: str) -> Dict[str, List[str]]:
+        result = self._allophones.get(language_code)
+        if result is None:
+            i = self.languages.index[language_code]
+            segments = self.segments.strings
+            result = {}
+            for k in range(self.allophone_offsets[i], self.allophone_offsets[i + 1]):
+                ids = self.allophone_segments[self.allophone_list_offsets[k]:self.allophone_list_offsets[k + 1]]
+                result[segments[self.allophone_phonemes[k]]] = [segments[j] for j in ids.tolist()]
+            self._allophones[language_code] = result
+        return result
+
+    def phoneme_features(self, segment: str) -> Dict[str, str]:
+        """The segment's entry exactly as in the JSON source."""
+        if self._feature_extras is None:
+            self._feature_extras = json.loads(bytes(self._section('feat.extra')).decode('utf-8'))
+        extra = self._feature_extras.get(segment, {})
+        codes = self.codes[self.segments.index[segment]].tolist()
+        values = self.values.strings
+        result = dict(extra.get('meta', ()))
+        result.update((feature, values[code]) for feature, code in zip(self.features.strings, codes))
+        for feature in extra.get('absent', ()):
+            del result[feature]
+        return result
+
+    def conversion_table(self, source_language: str, target_language: str) -> Optional[Dict[str, str]]:
+        if self.pairs is None:
+            return None
+        i = self.pairs.index.get(f'{source_language}\t{target_language}')
+        if i is None:
+            return None
+        start, stop = self.table_offsets[i], self.table_offsets[i + 1]
+        segments = self.segments.strings
+        return {segments[s]: segments[t] for s, t in zip(self.table_sources[start:stop].tolist(),
+                                                          self.table_targets[start:stop].tolist())}
+
+    def close(self):
+        # The mapping stays open while numpy views onto it are still alive.
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+
+
+class _LanguageView(Mapping):
+    def __init__(self, dataset: BinaryDataset):
+        self.dataset = dataset
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.dataset.languages.strings)
+
+    def __len__(self) -> int:
+        return len(self.dataset.languages)
+
+    def __contains__(self, language_code) -> bool:
+        return language_code in self.dataset.languages.index
+
+
+class InventoryView(_LanguageView):
+    def __getitem__(self, language_code: str) -> List[str]:
+        if language_code not in self.dataset.languages.index:
+            raise KeyError(language_code)
+        return self.dataset.inventory(language_code)
+
+
+class AllophoneView(_LanguageView):
+    def __getitem__(self, language_code: str) -> Dict[str, List[str]]:
+        if language_code not in self.dataset.languages.index:
+            raise KeyError(language_code)
+        return self.dataset.allophones(language_code)
+
+
+class PhonemeFeatureView(Mapping):
+    def __init__(self, dataset: BinaryDataset):
+        self.dataset = dataset
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.dataset.segments.strings[:self.dataset.feature_segments])
+
+    def __len__(self) -> int:
+        return self.dataset.feature_segments
+
+    def __contains__(self, segment) -> bool:
+        return self.dataset.segments.index.get(segment, self.dataset.feature_segments) < self.dataset.feature_segments
+
+    def __getitem__(self, segment: str) -> Dict[str, str]:
+        if segment not in self:
+            raise KeyError(segment)
+        return self.dataset.phoneme_features(segment)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the PHOIBLE JSON datasets into the binary data format.")
+    parser.add_argument('--output', default=None, help="Output path (default: data/compiled/phoible.kbin)")
+    args = parser.parse_args()
+    print(compile_binary_data(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from .utils import DataChange, DataStore, atomic_write, get_data_store, get_cache_path
+from .instrumentation import metrics
+
+TABLE_FORMAT_VERSION = 1
+TABLE_DATASETS = ('language_phonemes', 'phoneme_features')
+
+def default_cache_dir() -> str:
+    return get_cache_path('conversion_tables')
+
+class ConversionTableCache:
+    """Source-inventory -> target-inventory mappings, one per language pair.
+
+    Tables live in a bounded in-memory LRU and, when a cache directory is
+    set, on disk under a directory named after the version of the data
+    files the analyzer's store reads, so any change to them makes older
+    tables unreachable.
+    """
+
+    def __init__(self, feature_analyzer, max_tables: int = 512, cache_dir: Optional[str] = None):
+        self.feature_analyzer = feature_analyzer
+        self.max_tables = max_tables
+        self.cache_dir = cache_dir
+        self._tables: 'OrderedDict[Tuple[str, str], Dict[str, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source_language: str, target_language: str) -> Dict[str, str]:
+        key = (source_language, target_language)
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                if metrics.enabled:
+                    metrics.increment('conversion_table_requests', result='memory')
+                return table
+
+        table = self._load_shared(source_language, target_language)
+        if table is not None:
+            metrics.increment('conversion_table_requests', result='shared')
+        else:
+            table = self._load(source_language, target_language)
+            if table is None:
+                with metrics.stage('conversion_table_build', source=source_language, target=target_language):
+                    table = self.build(source_language, target_language)
+                self._save(source_language, target_language, table)
+                metrics.increment('conversion_table_requests', result='built')
+            else:
+                metrics.increment('conversion_table_requests', result='disk')
+
+        with self._lock:
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table
+
+    def build(self, source_language: str, target_language: str) -> Dict[str, str]:
+        _, source_phonemes = self.feature_analyzer.get_inventory_rows(source_language)
+        if source_language == target_language:
+            return {phoneme: phoneme for phoneme in source_phonemes}
+        return self.feature_analyzer.best_matches(source_phonemes, source_language, target_language)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+
+    def invalidate(self, change: DataChange) -> int:
+        """Drops the in-memory tables of language pairs affected by ``change``; returns how many."""
+        if change.datasets.isdisjoint(TABLE_DATASETS):
+            return 0
+        with self._lock:
+            keys = list(self._tables)
+        stale = [key for key in keys if change.affects(key[0]) or change.affects(key[1])]
+        with self._lock:
+            for key in stale:
+                self._tables.pop(key, None)
+        return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self._tables
+
+    @property
+    def store(self) -> DataStore:
+        return getattr(self.feature_analyzer, 'store', None) or get_data_store()
+
+    def _table_path(self, source_language: str, target_language: str) -> str:
+        version = f"v{TABLE_FORMAT_VERSION}-{self.store.data_version(TABLE_DATASETS)[:16]}"
+        return os.path.join(self.cache_dir, version, f"{source_language}__{target_language}.json")
+
+    def _load_shared(self, source_language: str, target_language: str) -> Optional[Dict[str, str]]:
+        # Tables published with the compiled data (see core.shared_data).
+        binary = self.store.binary
+        if binary is None:
+            return None
+        return binary.conversion_table(source_language, target_language)
+
+    def _load(self, source_language: str, target_language: str) -> Optional[Dict[str, str]]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._table_path(source_language, target_language), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, source_language: str, target_language: str, table: Dict[str, str]):
+        if not self.cache_dir:
+            return
+        try:
+            with atomic_write(self._table_path(source_language, target_language), 'w', encoding='utf-8') as f:
+                json.dump(table, f, ensure_ascii=False)
+        except OSError:
+            pass
@@ -0,0 +1,223 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+import unicodedata
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from .utils import DataStore, DATASET_FILES, DEFAULT_BINARY_FILE, atomic_write, file_digest, get_data_file_path
+from .glottolog import LANGUOID_FILE, read_languoids
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever a stage's output changes for the same input.
+BUILD_VERSION = 1
+PHOIBLE_FILE = 'sources/phoible.csv'
+MANIFEST_FILE = 'cache/build_manifest.json'
+TREE_FILE = 'cache/glottolog.npz'
+STAGES = ('phoible', 'glottolog', 'binary')
+PHOIBLE_DATASETS = ('language_phonemes', 'language_allophones', 'phoneme_features')
+
+# Per-inventory columns of the PHOIBLE export; every other column is a feature.
+PHOIBLE_METADATA_COLUMNS = frozenset((
+    'InventoryID', 'Glottocode', 'ISO6393', 'ISO639-3', 'LanguageName', 'SpecificDialect',
+    'GlyphID', 'Phoneme', 'Allophones', 'Marginal', 'MarginalSegment', 'Source',
+))
+MISSING_VALUES = ('', 'NA')
+
+def normalize_segment(segment: str) -> str:
+    """Segments are stored in NFD, the form PHOIBLE and the tokenizer use."""
+    return unicodedata.normalize('NFD', segment.strip())
+
+def _normalize_key(key: str) -> str:
+    return unicodedata.normalize('NFC', key.lstrip('\ufeff').strip())
+
+def write_json(path: str, data: Any):
+    with atomic_write(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, ensure_ascii=False, indent=2) + '\n')
+
+def read_phoible(path: str) -> Iterator[Dict[str, str]]:
+    """Streams the PHOIBLE CSV row by row with normalized column names.
+
+    ``utf-8-sig`` drops the byte order mark that otherwise ends up in the
+    first column name.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = [_normalize_key(column) for column in next(reader, [])]
+        for values in reader:
+            yield dict(zip(header, values))
+
+def build_phoible(csv_path: str) -> Dict[str, Dict]:
+    """Inventories, allophones and segment features from the PHOIBLE CSV.
+
+    Inventories sharing a glottocode are merged, keeping each language's
+    segments in the order they first appear; a segment's features come from
+    its first row. Languages and feature entries are sorted so the output
+    only depends on the input's content.
+    """
+    inventories: Dict[str, Dict[str, None]] = {}
+    allophones: Dict[str, Dict[str, List[str]]] = {}
+    features: Dict[str, Dict[str, str]] = {}
+    feature_columns: Optional[List[str]] = None
+    for row in read_phoible(csv_path):
+        glottocode = row.get('Glottocode', '').strip()
+        phoneme = normalize_segment(row.get('Phoneme', ''))
+        if glottocode in MISSING_VALUES or not phoneme:
+            continue
+        if feature_columns is None:
+            feature_columns = [column for column in row if column not in PHOIBLE_METADATA_COLUMNS]
+        inventories.setdefault(glottocode, {})[phoneme] = None
+        realizations = row.get('Allophones', '').strip()
+        if realizations not in MISSING_VALUES:
+            phoneme_allophones = allophones.setdefault(glottocode, {})
+            if phoneme not in phoneme_allophones:
+                phoneme_allophones[phoneme] = list(dict.fromkeys(normalize_segment(a) for a in realizations.split()))
+        if phoneme not in features:
+            features[phoneme] = {column: row[column].strip() for column in feature_columns}
+
+    languages = sorted(inventories)
+    return {
+        'language_phonemes': {code: list(inventories[code]) for code in languages},
+        'language_allophones': {code: allophones.get(code, {}) for code in languages},
+        'phoneme_features': {segment: features[segment] for segment in sorted(features)},
+    }
+
+
+class DataBuild:
+    """Rebuilds the data files from the PHOIBLE and Glottolog sources.
+
+    Stages and what they write:
+
+    * ``phoible``: the inventory, allophone and feature JSON files
+    * ``glottolog``: the cached languoid tree (``cache/glottolog.npz``)
+    * ``binary``: the compiled binary data file, from the JSON files
+
+    A manifest records each stage's input and output digests. A stage whose
+    inputs are unchanged and whose outputs are still in place is skipped,
+    so rebuilding after a data update only redoes the affected stages.
+    Every output is written to a temporary file and renamed into place.
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, phoible_path: Optional[str] = None,
+                 languoid_path: Optional[str] = None, manifest_path: Optional[str] = None):
+        self.data_dir = data_dir
+        self.phoible_path = phoible_path or self.path(PHOIBLE_FILE)
+        self.languoid_path = languoid_path or self.path(LANGUOID_FILE)
+        self.manifest_path = manifest_path or self.path(MANIFEST_FILE)
+        self.manifest = self._read_manifest()
+
+    def path(self, file_name: str) -> str:
+        if self.data_dir is None:
+            return get_data_file_path(file_name)
+        return os.path.join(self.data_dir, file_name)
+
+    def _dataset_files(self) -> Dict[str, str]:
+        # Relative names for the default data directory, so the compiled file
+        # is recognised as current by the default DataStore.
+        if self.data_dir is None:
+            return dict(DATASET_FILES)
+        return {name: self.path(file_name) for name, file_name in DATASET_FILES.items()}
+
+    def _dataset_paths(self) -> List[str]:
+        files = self._dataset_files()
+        return [self.path(files[name]) for name in PHOIBLE_DATASETS]
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {'build_version': BUILD_VERSION, 'stages': {}}
+        if manifest.get('build_version') != BUILD_VERSION:
+            return {'build_version': BUILD_VERSION, 'stages': {}}
+        return manifest
+
+    def _stage_inputs(self, stage: str) -> Dict[str, str]:
+        if stage == 'phoible':
+            paths = [self.phoible_path]
+        elif stage == 'glottolog':
+            paths = [self.languoid_path]
+        else:
+            paths = self._dataset_paths()
+        return {path: file_digest(path) for path in paths}
+
+    def _stage_outputs(self, stage: str) -> List[str]:
+        if stage == 'phoible':
+            return self._dataset_paths()
+        if stage == 'glottolog':
+            return [self.path(TREE_FILE)]
+        return [self.path(DEFAULT_BINARY_FILE)]
+
+    def _outputs_intact(self, recorded: Dict[str, Any]) -> bool:
+        for path, info in recorded.get('outputs', {}).items():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return False
+            if (stat.st_size, stat.st_mtime_ns) == (info['size'], info['mtime_ns']):
+                continue
+            if stat.st_size != info['size'] or file_digest(path) != info['sha256']:
+                return False
+        return True
+
+    def _run_stage(self, stage: str):
+        if stage == 'phoible':
+            outputs = build_phoible(self.phoible_path)
+            for name, path in zip(PHOIBLE_DATASETS, self._dataset_paths()):
+                write_json(path, outputs[name])
+        elif stage == 'glottolog':
+            tree = read_languoids(self.languoid_path)
+            # Same digest as utils.data_version, which the runtime checks.
+            tree.version = file_digest(self.languoid_path, LANGUOID_FILE)
+            tree.save(self.path(TREE_FILE))
+        else:
+            from .binary_data import compile_binary_data
+            store = DataStore(dataset_files=self._dataset_files(), binary_path=None)
+            compile_binary_data(self.path(DEFAULT_BINARY_FILE), store)
+
+    def build(self, stages: Sequence[str] = STAGES, force: bool = False) -> Dict[str, str]:
+        """Runs ``stages`` in order; returns 'built', 'skipped' or 'missing' per stage."""
+        results = {}
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            try:
+                inputs = self._stage_inputs(stage)
+            except FileNotFoundError as e:
+                logger.warning("Skipping the %s stage: %s", stage, e)
+                results[stage] = 'missing'
+                continue
+            recorded = self.manifest['stages'].get(stage, {})
+            if not force and recorded.get('inputs') == inputs and self._outputs_intact(recorded):
+                results[stage] = 'skipped'
+                continue
+            start = time.perf_counter()
+            self._run_stage(stage)
+            outputs = {}
+            for path in self._stage_outputs(stage):
+                stat = os.stat(path)
+                outputs[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_digest(path)}
+            self.manifest['stages'][stage] = {'inputs': inputs, 'outputs': outputs}
+            write_json(self.manifest_path, self.manifest)
+            logger.info("Built %s in %.2fs", stage, time.perf_counter() - start)
+            results[stage] = 'built'
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the data files from the PHOIBLE and Glottolog sources.")
+    parser.add_argument('--data-dir', default=None, help="Data directory (default: data/)")
+    parser.add_argument('--phoible', default=None, help="PHOIBLE CSV (default: data/sources/phoible.csv)")
+    parser.add_argument('--languoids', default=None, help="Glottolog languoid CSV (default: data/sources/glottolog_languoid/languoid.csv)")
+    parser.add_argument('--stage', action='append', choices=STAGES, help="Stage to run; repeatable (default: all)")
+    parser.add_argument('--force', action='store_true', help="Rebuild even when the inputs are unchanged")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    build = DataBuild(args.data_dir, args.phoible, args.languoids)
+    for stage, result in build.build(args.stage or STAGES, force=args.force).items():
+        print(f"{stage}: {result}")
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,90 @@
-from typing import List, Tuple, Dict
-from .utils import get_phoneme_inventory, get_phoneme_features
+import numpy as np
+from typing import List, Tuple, Dict, Optional, Sequence
+from .utils import DataStore, get_phoneme_inventory, get_phoneme_features, get_data_store, register_derived
+from .feature_matrix import get_feature_matrix
+from .segment_index import get_segment_index
+from .inventory_statistics import InventoryStatistics, get_inventory_statistics
+from .instrumentation import metrics
+
+register_derived('inventory_rows', ('language_phonemes', 'phoneme_features'), per_language=True)
 
 class FeatureAnalyzer:
-    def __init__(self):
-        pass
+    # Structures are looked up on use rather than kept, so that the analyzer
+    # follows DataStore.reload. ``store`` pins it to one store instead of
+    # the process-wide one.
+
+    def __init__(self, store: Optional[DataStore] = None):
+        self.store = store
+
+    @property
+    def feature_matrix(self):
+        return get_feature_matrix(self.store)
+
+    @property
+    def segment_index(self):
+        return get_segment_index(self.store)
+
+    @property
+    def _inventory_rows(self) -> Dict[str, Tuple[np.ndarray, List[str]]]:
+        return (self.store or get_data_store()).derived('inventory_rows', lambda store: {})
+
+    def _inventory(self, language_code: str) -> List[str]:
+        return get_phoneme_inventory(language_code, self.store)
 
     def get_language_features(self, language_code: str) -> Dict[str, Dict[str, str]]:
-        phoneme_inventory = get_phoneme_inventory(language_code)
-        return get_phoneme_features(phoneme_inventory, 'phoneme_features/phoneme_features.json')
+        store = self.store or get_data_store()
+        return get_phoneme_features(self._inventory(language_code), store.dataset_files['phoneme_features'], language_code, store)
+
+    def get_inventory_rows(self, language_code: str) -> Tuple[np.ndarray, List[str]]:
+        inventory_rows = self._inventory_rows
+        rows = inventory_rows.get(language_code)
+        if rows is None:
+            metrics.increment('inventory_rows_builds', language=language_code)
+            rows = inventory_rows[language_code] = self.feature_matrix.rows(self._inventory(language_code))
+        return rows
 
     def compare_phonemes(self, phoneme1: str, phoneme2: str) -> Tuple[List[str], List[str]]:
-        features1 = get_phoneme_features([phoneme1], 'phoneme_features/phoneme_features.json')[phoneme1]
-        features2 = get_phoneme_features([phoneme2], 'phoneme_features/phoneme_features.json')[phoneme2]
-        
-        similar_features = []
-        different_features = []
-        
-        all_features = set(features1.keys()) | set(features2.keys())
-        
-        for feature in all_features:
-            if features1.get(feature) == features2.get(feature):
-                similar_features.append(feature)
-            else:
-                different_features.append(feature)
-        
-        return similar_features, different_features
+        # Through the segment index, so that unseen segments are estimated.
+        return self.feature_matrix.compare_vectors(self.segment_index.vector(phoneme1), self.segment_index.vector(phoneme2))
 
     def find_similar_phonemes(self, target_phoneme: str, source_language: str, target_language: str) -> List[Tuple[str, int]]:
-        source_features = get_phoneme_features([target_phoneme], 'phoneme_features/phoneme_features.json')[target_phoneme]
-        target_inventory = get_phoneme_inventory(target_language)
-        target_features = get_phoneme_features(target_inventory, 'phoneme_features/phoneme_features.json')
-        
-        similarity_scores = []
-        
-        for phoneme, features in target_features.items():
-            score = sum(1 for f in source_features if f in features and source_features[f] == features[f])
-            similarity_scores.append((phoneme, score))
-        
-        return sorted(similarity_scores, key=lambda x: x[1], reverse=True)
+        return self.find_similar_phonemes_many([target_phoneme], source_language, target_language)[target_phoneme]
+
+    def find_similar_phonemes_many(self, phonemes: Sequence[str], source_language: str, target_language: str) -> Dict[str, List[Tuple[str, int]]]:
+        target_rows, target_phonemes = self.get_inventory_rows(target_language)
+
+        with metrics.stage('similarity_search', target=target_language):
+            scores = self.feature_matrix.vector_similarity(self.segment_index.vectors(phonemes), target_rows)
+            order = np.argsort(-scores, axis=1, kind='stable')
+
+        return {
+            phoneme: [(target_phonemes[j], int(scores[i, j])) for j in order[i]]
+            for i, phoneme in enumerate(phonemes)
+        }
+
+    def best_matches(self, phonemes: Sequence[str], source_language: str, target_language: str) -> Dict[str, str]:
+        target_rows, target_phonemes = self.get_inventory_rows(target_language)
+        if not target_phonemes:
+            return {phoneme: phoneme for phoneme in phonemes}
+
+        with metrics.stage('similarity_search', target=target_language):
+            best = self.feature_matrix.vector_similarity(self.segment_index.vectors(phonemes), target_rows).argmax(axis=1)
+        return {phoneme: target_phonemes[j] for phoneme, j in zip(phonemes, best)}
 
     def analyze_language_inventory(self, language_code: str) -> Dict[str, Dict[str, int]]:
-        language_features = self.get_language_features(language_code)
-        feature_counts = {}
-        
-        for phoneme, features in language_features.items():
-            for feature, value in features.items():
-                if feature not in feature_counts:
-                    feature_counts[feature] = {}
-                feature_counts[feature][value] = feature_counts[feature].get(value, 0) + 1
-        
-        return feature_counts
\ No newline at end of file
+        rows, _ = self.get_inventory_rows(language_code)
+        return self.feature_matrix.value_counts(rows)
+
+    def analyze_language_inventories(self, language_codes: Optional[Sequence[str]] = None) -> InventoryStatistics:
+        """Statistics for many languages (default: all) from one cached pass over every inventory."""
+        statistics = get_inventory_statistics(self.store)
+        if language_codes is None:
+            return statistics
+        from .glottolog import resolve_language_code
+        resolved = []
+        for code in language_codes:
+            glottocode = code if code in statistics.language_index else resolve_language_code(code, self.store)
+            if glottocode is None:
+                raise ValueError(f"Language code '{code}' not found in the phoneme database.")
+            resolved.append(glottocode)
+        return statistics.subset(resolved)
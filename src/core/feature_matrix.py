@@ -0,0 +1,122 @@
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+from .utils import get_data_store, register_derived
+
+# Per-inventory bookkeeping columns carried over from the PHOIBLE export;
+# they are not phonological features and are left out of the matrix.
+METADATA_KEYS = ('InventoryID', '\ufeffInventoryID', 'ISO6393', 'Marginal')
+BASE_VALUES = ('0', '+', '-')
+
+
+class FeatureMatrix:
+    """Every segment's feature values encoded once as a small-int matrix."""
+
+    def __init__(self, phoneme_features: Dict[str, Dict[str, str]]):
+        self.segments: List[str] = list(phoneme_features)
+        self.index: Dict[str, int] = {segment: i for i, segment in enumerate(self.segments)}
+
+        self.features: List[str] = []
+        seen = set(METADATA_KEYS)
+        for features in phoneme_features.values():
+            for feature in features:
+                if feature not in seen:
+                    seen.add(feature)
+                    self.features.append(feature)
+        self.feature_index: Dict[str, int] = {feature: i for i, feature in enumerate(self.features)}
+
+        self.values: List[str] = list(BASE_VALUES)
+        self.value_codes: Dict[str, int] = {value: i for i, value in enumerate(self.values)}
+
+        self.codes = np.zeros((len(self.segments), len(self.features)), dtype=np.int8)
+        for row, features in enumerate(phoneme_features.values()):
+            for col, feature in enumerate(self.features):
+                self.codes[row, col] = self.encode_value(features.get(feature, '0'))
+
+    @classmethod
+    def from_arrays(cls, segments: List[str], features: List[str], values: List[str], codes: np.ndarray) -> 'FeatureMatrix':
+        matrix = cls.__new__(cls)
+        matrix.segments = segments
+        matrix.index = {segment: i for i, segment in enumerate(segments)}
+        matrix.features = features
+        matrix.feature_index = {feature: i for i, feature in enumerate(features)}
+        matrix.values = values
+        matrix.value_codes = {value: i for i, value in enumerate(values)}
+        matrix.codes = codes
+        return matrix
+
+    def encode_value(self, value: str) -> int:
+        code = self.value_codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.value_codes[value] = code
+        return code
+
+    def __contains__(self, segment: str) -> bool:
+        return segment in self.index
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def row(self, segment: str) -> int:
+        return self.index[segment]
+
+    def rows(self, segments: Sequence[str]) -> Tuple[np.ndarray, List[str]]:
+        found = [segment for segment in segments if segment in self.index]
+        return np.array([self.index[segment] for segment in found], dtype=np.intp), found
+
+    def vector(self, segment: str) -> np.ndarray:
+        return self.codes[self.index[segment]]
+
+    def decode(self, row: int) -> Dict[str, str]:
+        return self.decode_vector(self.codes[row])
+
+    def decode_vector(self, codes: np.ndarray) -> Dict[str, str]:
+        return {feature: self.values[code] for feature, code in zip(self.features, codes)}
+
+    def similarity(self, source_rows: np.ndarray, target_rows: np.ndarray) -> np.ndarray:
+        return self.vector_similarity(self.codes[np.atleast_1d(source_rows)], target_rows)
+
+    def vector_similarity(self, vectors: np.ndarray, target_rows: np.ndarray) -> np.ndarray:
+        target = self.codes[target_rows]
+        return (vectors[:, None, :] == target[None, :, :]).sum(axis=2, dtype=np.int32)
+
+    def distances(self, source_rows: Optional[np.ndarray] = None, target_rows: Optional[np.ndarray] = None,
+                  chunk_size: int = 256) -> np.ndarray:
+        # Hamming distance over feature values, computed a block of source
+        # rows at a time to keep the broadcast temporaries small.
+        source = self.codes if source_rows is None else self.codes[source_rows]
+        target = self.codes if target_rows is None else self.codes[target_rows]
+        result = np.empty((len(source), len(target)), dtype=np.uint8)
+        for start in range(0, len(source), chunk_size):
+            block = source[start:start + chunk_size]
+            result[start:start + chunk_size] = (block[:, None, :] != target[None, :, :]).sum(axis=2)
+        return result
+
+    def compare(self, segment1: str, segment2: str) -> Tuple[List[str], List[str]]:
+        return self.compare_vectors(self.vector(segment1), self.vector(segment2))
+
+    def compare_vectors(self, vector1: np.ndarray, vector2: np.ndarray) -> Tuple[List[str], List[str]]:
+        equal = vector1 == vector2
+        similar = [feature for feature, same in zip(self.features, equal) if same]
+        different = [feature for feature, same in zip(self.features, equal) if not same]
+        return similar, different
+
+    def value_counts(self, rows: np.ndarray) -> Dict[str, Dict[str, int]]:
+        block = self.codes[rows]
+        counts = {}
+        for col, feature in enumerate(self.features):
+            tally = np.bincount(block[:, col], minlength=len(self.values))
+            counts[feature] = {self.values[code]: int(n) for code, n in enumerate(tally) if n}
+        return counts
+
+
+def _build_feature_matrix(store) -> FeatureMatrix:
+    if store.binary is not None:
+        return store.binary.feature_matrix()
+    return FeatureMatrix(store.phoneme_features)
+
+register_derived('feature_matrix', ('phoneme_features',))
+
+def get_feature_matrix(store=None) -> FeatureMatrix:
+    return (store or get_data_store()).derived('feature_matrix', _build_feature_matrix)
@@ -0,0 +1,275 @@
+import argparse
+import csv
+import logging
+import os
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+from .utils import DataStore, atomic_write, get_data_store, get_cache_path, get_data_file_path, data_version, register_derived
+
+logger = logging.getLogger(__name__)
+
+LANGUOID_FILE = 'sources/glottolog_languoid/languoid.csv'
+LEVELS = ('family', 'language', 'dialect')
+TREE_FORMAT_VERSION = 2
+
+def default_tree_path() -> str:
+    return get_cache_path('glottolog.npz')
+
+
+class LanguoidTree:
+    """Array-backed Glottolog languoid tree.
+
+    Nodes are numbered in file order; ``parent`` and ``family`` hold node
+    numbers (-1 for none) and children are stored in CSR form. ``tin`` and
+    ``tout`` are pre-order entry and exit times, so a node's descendants
+    are ``order[tin[i] + 1:tout[i]]`` and ancestry is two comparisons.
+    """
+
+    def __init__(self, glottocodes: Iterable[str], parent: np.ndarray, family: np.ndarray, level: np.ndarray,
+                 iso_codes: Iterable[str], names: Iterable[str], version: str = ''):
+        self.glottocodes: List[str] = list(glottocodes)
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.family = np.asarray(family, dtype=np.int32)
+        self.level = np.asarray(level, dtype=np.int8)
+        self.iso_codes: List[str] = list(iso_codes)
+        self.names: List[str] = list(names)
+        self.version = version
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(self.glottocodes)}
+        self.iso_index: Dict[str, int] = {iso: i for i, iso in enumerate(self.iso_codes) if iso}
+        self._build_children()
+        self._build_euler()
+        # Store whose inventories ``resolve`` uses (None: the process store).
+        self.store: Optional[DataStore] = None
+        self._inventory_codes: Optional[frozenset] = None
+        self._inventory_positions: Optional[np.ndarray] = None
+        self._resolved: Dict[str, Optional[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.glottocodes)
+
+    def __contains__(self, code: str) -> bool:
+        return self.node(code) is not None
+
+    def _build_children(self):
+        n = len(self.glottocodes)
+        has_parent = np.flatnonzero(self.parent >= 0)
+        counts = np.bincount(self.parent[has_parent], minlength=n)
+        self.child_offsets = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(counts, out=self.child_offsets[1:])
+        # A stable sort by parent keeps siblings in file order.
+        self.child_index = has_parent[np.argsort(self.parent[has_parent], kind='stable')].astype(np.int32)
+
+    def _build_euler(self):
+        n = len(self.glottocodes)
+        self.tin = np.zeros(n, dtype=np.int32)
+        self.tout = np.zeros(n, dtype=np.int32)
+        self.depth = np.zeros(n, dtype=np.int32)
+        self.order = np.zeros(n, dtype=np.int32)
+        offsets, children = self.child_offsets, self.child_index
+        clock = 0
+        for root in np.flatnonzero(self.parent < 0).tolist():
+            stack = [(root, False)]
+            while stack:
+                node, done = stack.pop()
+                if done:
+                    self.tout[node] = clock
+                    continue
+                self.tin[node] = clock
+                self.order[clock] = node
+                clock += 1
+                stack.append((node, True))
+                for child in reversed(children[offsets[node]:offsets[node + 1]].tolist()):
+                    self.depth[child] = self.depth[node] + 1
+                    stack.append((child, False))
+
+    def node(self, code: str) -> Optional[int]:
+        """Node number for a glottocode or ISO 639-3 code."""
+        i = self.index.get(code)
+        if i is None:
+            i = self.iso_index.get(code.lower())
+        return i
+
+    def glottocode(self, code: str) -> Optional[str]:
+        i = self.node(code)
+        return None if i is None else self.glottocodes[i]
+
+    def level_of(self, code: str) -> Optional[str]:
+        i = self.node(code)
+        return None if i is None else LEVELS[self.level[i]]
+
+    def family_of(self, code: str) -> Optional[str]:
+        i = self.node(code)
+        if i is None:
+            return None
+        family = self.family[i]
+        return self.glottocodes[i] if family < 0 else self.glottocodes[family]
+
+    def children(self, code: str) -> List[str]:
+        i = self.node(code)
+        if i is None:
+            return []
+        return [self.glottocodes[c] for c in self.child_index[self.child_offsets[i]:self.child_offsets[i + 1]]]
+
+    def ancestors(self, code: str) -> List[str]:
+        """Ancestors from the parent up to the top-level family."""
+        i = self.node(code)
+        result = []
+        while i is not None and self.parent[i] >= 0:
+            i = int(self.parent[i])
+            result.append(self.glottocodes[i])
+        return result
+
+    def descendants(self, code: str) -> List[str]:
+        i = self.node(code)
+        if i is None:
+            return []
+        return [self.glottocodes[d] for d in self.order[self.tin[i] + 1:self.tout[i]]]
+
+    def is_ancestor(self, ancestor: str, code: str) -> bool:
+        a, i = self.node(ancestor), self.node(code)
+        if a is None or i is None or a == i:
+            return False
+        return bool(self.tin[a] < self.tin[i] and self.tout[i] <= self.tout[a])
+
+    def set_inventories(self, glottocodes: Iterable[str]):
+        """Marks which languoids have a phoneme inventory, for ``resolve``."""
+        codes = frozenset(glottocodes)
+        nodes = [self.index[code] for code in codes if code in self.index]
+        self._inventory_codes = codes
+        self._inventory_positions = np.sort(self.tin[nodes]) if nodes else np.empty(0, dtype=np.int32)
+        self._resolved.clear()
+
+    def resolve(self, code: str) -> Optional[str]:
+        """Glottocode of the closest languoid that has a phoneme inventory.
+
+        A languoid with its own inventory resolves to itself. Otherwise the
+        search widens one ancestor at a time: its own subtree first, then
+        the parent and the parent's subtree (siblings and their dialects),
+        and so on up to the top-level family. Within a subtree the
+        shallowest languoid wins, ties going to file order.
+        """
+        if self._inventory_codes is None:
+            self.set_inventories((self.store or get_data_store()).language_phonemes)
+        if code in self._resolved:
+            return self._resolved[code]
+        if code in self._inventory_codes:
+            return code
+
+        i = self.node(code)
+        result = None
+        while i is not None:
+            glottocode = self.glottocodes[i]
+            if glottocode in self._inventory_codes:
+                result = glottocode
+                break
+            result = self._closest_in_subtree(i)
+            if result is not None or self.parent[i] < 0:
+                break
+            i = int(self.parent[i])
+        self._resolved[code] = result
+        return result
+
+    def _closest_in_subtree(self, i: int) -> Optional[str]:
+        positions = self._inventory_positions
+        lo, hi = np.searchsorted(positions, [self.tin[i] + 1, self.tout[i]])
+        if lo == hi:
+            return None
+        nodes = self.order[positions[lo:hi]]
+        return self.glottocodes[nodes[np.argmin(self.depth[nodes])]]
+
+    def save(self, path: Optional[str] = None) -> str:
+        # Strings are stored as NUL-separated UTF-8: fixed-width unicode
+        # arrays would pad every name to the longest one.
+        path = path or default_tree_path()
+        with atomic_write(path) as f:
+            np.savez(f, glottocodes=_pack_strings(self.glottocodes), parent=self.parent, family=self.family,
+                     level=self.level, iso_codes=_pack_strings(self.iso_codes), names=_pack_strings(self.names),
+                     format=np.array(TREE_FORMAT_VERSION), version=np.array(self.version))
+        return path
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'LanguoidTree':
+        with np.load(path or default_tree_path(), allow_pickle=False) as data:
+            if 'format' not in data or int(data['format']) != TREE_FORMAT_VERSION:
+                raise ValueError("unsupported languoid tree format")
+            return cls(_unpack_strings(data['glottocodes']), data['parent'], data['family'], data['level'],
+                       _unpack_strings(data['iso_codes']), _unpack_strings(data['names']), str(data['version']))
+
+
+def _pack_strings(strings: List[str]) -> np.ndarray:
+    return np.frombuffer(''.join(string + '\0' for string in strings).encode('utf-8'), dtype=np.uint8)
+
+def _unpack_strings(packed: np.ndarray) -> List[str]:
+    return packed.tobytes().decode('utf-8').split('\0')[:-1]
+
+
+def read_languoids(path: Optional[str] = None) -> LanguoidTree:
+    path = path or get_data_file_path(LANGUOID_FILE)
+    # Streamed a row at a time; only the columns the tree needs are kept.
+    glottocodes, parent_ids, family_ids, levels, iso_codes, names = [], [], [], [], [], []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            glottocodes.append(row['id'])
+            parent_ids.append(row['parent_id'])
+            family_ids.append(row['family_id'])
+            levels.append(LEVELS.index(row['level']))
+            iso_codes.append(row['iso639P3code'])
+            names.append(row['name'])
+    index = {code: i for i, code in enumerate(glottocodes)}
+    parent = np.array([index.get(code, -1) for code in parent_ids], dtype=np.int32)
+    family = np.array([index.get(code, -1) for code in family_ids], dtype=np.int32)
+    return LanguoidTree(glottocodes, parent, family, np.array(levels, dtype=np.int8), iso_codes, names)
+
+def _load_tree(store, path: Optional[str] = None) -> LanguoidTree:
+    path = path or default_tree_path()
+    try:
+        version = data_version((LANGUOID_FILE,))
+    except FileNotFoundError:
+        logger.warning("Glottolog file %s not found; languoid lookups are disabled", get_data_file_path(LANGUOID_FILE))
+        return LanguoidTree([], np.empty(0), np.empty(0), np.empty(0), [], [])
+    if os.path.exists(path):
+        try:
+            tree = LanguoidTree.load(path)
+        except Exception as e:
+            # A truncated or corrupt cache is rebuilt and overwritten.
+            logger.warning("Ignoring cached languoid tree %s: %s", path, e)
+        else:
+            if tree.version == version:
+                return tree
+    tree = read_languoids()
+    tree.version = version
+    try:
+        tree.save(path)
+    except OSError as e:
+        logger.warning("Could not cache the languoid tree at %s: %s", path, e)
+    return tree
+
+# The tree remembers which languoids have an inventory (see set_inventories).
+register_derived('languoid_tree', ('language_phonemes',))
+
+def _store_tree(store: DataStore) -> LanguoidTree:
+    tree = _load_tree(store)
+    tree.store = store
+    return tree
+
+def get_languoid_tree(store: Optional[DataStore] = None) -> LanguoidTree:
+    return (store or get_data_store()).derived('languoid_tree', _store_tree)
+
+def resolve_language_code(code: str, store: Optional[DataStore] = None) -> Optional[str]:
+    """Glottocode whose inventory serves ``code`` (a glottocode or ISO 639-3 code)."""
+    store = store or get_data_store()
+    if code in store.language_phonemes:
+        return code
+    return get_languoid_tree(store).resolve(code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache the Glottolog languoid tree.")
+    parser.add_argument('--output', default=None, help="Output path (default: data/cache/glottolog.npz)")
+    args = parser.parse_args()
+    tree = read_languoids()
+    tree.version = data_version((LANGUOID_FILE,))
+    print(tree.save(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: Labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics._observe(self.name, self.labels, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Process-wide counters and per-stage timers.
+
+    Disabled by default (or enabled with ``KUNAI_METRICS=1``). While
+    disabled, ``increment`` returns at once and ``stage`` hands out a shared
+    no-op context manager; the hottest paths check ``enabled`` themselves
+    so they skip even that call.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # name, labels -> [count, total seconds, max seconds]
+        self._timers: Dict[Tuple[str, Labels], list] = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def increment(self, name: str, value: float = 1, **labels: Any):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def stage(self, name: str, **labels: Any):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, _labels(labels))
+
+    def observe(self, name: str, seconds: float, **labels: Any):
+        if self.enabled:
+            self._observe(name, _labels(labels), seconds)
+
+    def _observe(self, name: str, labels: Labels, seconds: float):
+        key = (name, labels)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                self._timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and timers as plain dicts keyed by metric, then by label string."""
+        with self._lock:
+            counters: Dict[str, Dict[str, float]] = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                counters.setdefault(name, {})[_label_text(labels)] = value
+            timers: Dict[str, Dict[str, Dict[str, float]]] = {}
+            for (name, labels), (count, total, longest) in sorted(self._timers.items()):
+                timers.setdefault(name, {})[_label_text(labels)] = {'count': count, 'total': total, 'max': longest}
+        return {'enabled': self.enabled, 'counters': counters, 'timers': timers}
+
+    def to_prometheus(self, prefix: str = 'kunai') -> str:
+        """Renders the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted(self._timers.items())
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f'{prefix}_{name}_total'
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{_prometheus_labels(labels)} {value:g}')
+        for (name, labels), (count, total, longest) in timers:
+            metric = f'{prefix}_{name}_seconds'
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f'# TYPE {metric} summary')
+                lines.append(f'# TYPE {metric}_max gauge')
+            text = _prometheus_labels(labels)
+            lines.append(f'{metric}_count{text} {count}')
+            lines.append(f'{metric}_sum{text} {total:.9g}')
+            lines.append(f'{metric}_max{text} {longest:.9g}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+def _label_text(labels: Labels) -> str:
+    return ','.join(f'{name}={value}' for name, value in labels)
+
+def _prometheus_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+metrics = Metrics(enabled=os.environ.get('KUNAI_METRICS', '') not in ('', '0'))
+
+def get_metrics() -> Metrics:
+    return metrics
+
+
+class RateLimitedLogger:
+    """Logs each distinct event at most once per ``interval`` seconds.
+
+    Structured fields are passed to the log record through ``extra``, and
+    the number of occurrences suppressed since the last record is attached
+    as ``suppressed``.
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = 60.0):
+        self.logger = logger
+        self.interval = interval
+        self._last: Dict[Any, float] = {}
+        self._suppressed: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+
+    def log(self, level: int, key: Any, message: str, *args: Any, **fields: Any) -> bool:
+        if not self.logger.isEnabledFor(level):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            message += ' (%d similar messages suppressed)'
+            args += (suppressed,)
+        self.logger.log(level, message, *args, extra=dict(fields, suppressed=suppressed))
+        return True
+
+    def warning(self, key: Any, message: str, *args: Any, **fields: Any) -> bool:
+        return self.log(logging.WARNING, key, message, *args, **fields)
@@ -0,0 +1,119 @@
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .utils import DataStore, get_data_store, register_derived
+from .feature_matrix import get_feature_matrix
+
+CLASS_FEATURE = 'SegmentClass'
+
+
+class InventoryStatistics:
+    """Feature and segment statistics for a set of inventories, as arrays.
+
+    ``incidence[l, s]`` counts segment ``segments[s]`` in the inventory of
+    ``languages[l]``. The first ``n_known`` segments are the feature
+    matrix's rows; the rest are segments without features, which count
+    towards inventory sizes and segment frequencies only, as in
+    ``FeatureAnalyzer.analyze_language_inventory``.
+
+    ``value_counts[l, f, v]`` is how many segments of language ``l`` have
+    value ``values[v]`` for ``features[f]``.
+    """
+
+    def __init__(self, languages: Sequence[str], segments: Sequence[str], n_known: int,
+                 incidence: np.ndarray, features: Sequence[str], values: Sequence[str], value_counts: np.ndarray):
+        self.languages = list(languages)
+        self.segments = list(segments)
+        self.n_known = n_known
+        self.incidence = incidence
+        self.features = list(features)
+        self.values = list(values)
+        self.value_counts = value_counts
+        self.language_index = {language: i for i, language in enumerate(self.languages)}
+        self.feature_index = {feature: i for i, feature in enumerate(self.features)}
+
+    @classmethod
+    def build(cls, language_phonemes: Optional[Dict[str, List[str]]] = None,
+              languages: Optional[Sequence[str]] = None, store: Optional[DataStore] = None) -> 'InventoryStatistics':
+        store = store or get_data_store()
+        language_phonemes = store.language_phonemes if language_phonemes is None else language_phonemes
+        matrix = get_feature_matrix(store)
+        languages = list(language_phonemes) if languages is None else list(languages)
+
+        segment_ids = dict(matrix.index)
+        segments = list(matrix.segments)
+        language_rows, segment_rows = [], []
+        for i, language in enumerate(languages):
+            for segment in language_phonemes[language]:
+                if segment not in segment_ids:
+                    segment_ids[segment] = len(segments)
+                    segments.append(segment)
+                language_rows.append(i)
+                segment_rows.append(segment_ids[segment])
+        incidence = np.zeros((len(languages), len(segments)), dtype=np.uint8)
+        np.add.at(incidence, (np.array(language_rows, dtype=np.intp), np.array(segment_rows, dtype=np.intp)), 1)
+
+        # One matrix product per feature over a one-hot encoding of its values.
+        known = incidence[:, :len(matrix.segments)].astype(np.float32)
+        value_counts = np.empty((len(languages), len(matrix.features), len(matrix.values)), dtype=np.int32)
+        for f in range(len(matrix.features)):
+            one_hot = (matrix.codes[:, f][:, None] == np.arange(len(matrix.values))).astype(np.float32)
+            value_counts[:, f] = np.rint(known @ one_hot)
+        return cls(languages, segments, len(matrix.segments), incidence, matrix.features, matrix.values, value_counts)
+
+    def __len__(self) -> int:
+        return len(self.languages)
+
+    def subset(self, languages: Sequence[str]) -> 'InventoryStatistics':
+        rows = np.array([self.language_index[language] for language in languages], dtype=np.intp)
+        return InventoryStatistics(languages, self.segments, self.n_known, self.incidence[rows],
+                                   self.features, self.values, self.value_counts[rows])
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """Number of segments in each inventory."""
+        return self.incidence.sum(axis=1, dtype=np.int32)
+
+    def segment_frequencies(self) -> np.ndarray:
+        """Number of languages with each segment."""
+        return (self.incidence > 0).sum(axis=0, dtype=np.int32)
+
+    def top_segments(self, k: int = 20) -> List[Tuple[str, int]]:
+        frequencies = self.segment_frequencies()
+        order = np.argsort(-frequencies, kind='stable')[:k]
+        return [(self.segments[i], int(frequencies[i])) for i in order.tolist() if frequencies[i]]
+
+    def feature_distribution(self) -> Dict[str, Dict[str, int]]:
+        """Value counts summed over all languages."""
+        totals = self.value_counts.sum(axis=0)
+        return {
+            feature: {value: int(n) for value, n in zip(self.values, totals[f].tolist()) if n}
+            for f, feature in enumerate(self.features)
+        }
+
+    def class_counts(self, feature: str = CLASS_FEATURE) -> Tuple[List[str], np.ndarray]:
+        """Per-language counts of each value of ``feature`` that occurs at all."""
+        counts = self.value_counts[:, self.feature_index[feature]]
+        present = np.flatnonzero(counts.any(axis=0))
+        return [self.values[v] for v in present.tolist()], counts[:, present]
+
+    def language(self, language_code: str) -> Dict[str, Dict[str, int]]:
+        """One language's value counts, shaped like ``analyze_language_inventory``."""
+        counts = self.value_counts[self.language_index[language_code]].tolist()
+        return {
+            feature: {value: n for value, n in zip(self.values, counts[f]) if n}
+            for f, feature in enumerate(self.features)
+        }
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """One row per language: inventory size and segment class breakdown."""
+        classes, counts = self.class_counts()
+        sizes = self.sizes.tolist()
+        return [
+            dict({'language': language, 'size': sizes[i]}, **dict(zip(classes, counts[i].tolist())))
+            for i, language in enumerate(self.languages)
+        ]
+
+register_derived('inventory_statistics', ('language_phonemes', 'phoneme_features'))
+
+def get_inventory_statistics(store: Optional[DataStore] = None) -> InventoryStatistics:
+    return (store or get_data_store()).derived('inventory_statistics', lambda store: InventoryStatistics.build(store=store))
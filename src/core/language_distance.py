@@ -0,0 +1,154 @@
+import argparse
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+from .utils import DataStore, atomic_write, get_data_store, get_cache_path
+from .feature_matrix import get_feature_matrix
+
+DISTANCE_DATASETS = ('language_phonemes', 'phoneme_features')
+
+def default_distance_path() -> str:
+    return get_cache_path('language_distances.npz')
+
+
+class LanguageDistanceMatrix:
+    """Inventory-to-inventory phonological distances.
+
+    The distance between two inventories is the symmetric mean of each
+    segment's feature distance to its nearest segment in the other
+    inventory, scaled to [0, 1] by the number of features.
+    """
+
+    def __init__(self, languages: Sequence[str], targets: Sequence[str], distances: np.ndarray, version: str = ''):
+        self.languages = list(languages)
+        self.targets = list(targets)
+        self.distances = distances
+        self.version = version
+        self.language_index = {language: i for i, language in enumerate(self.languages)}
+        self.target_index = {language: i for i, language in enumerate(self.targets)}
+
+    def distance(self, language1: str, language2: str) -> float:
+        return float(self.distances[self.language_index[language1], self.target_index[language2]])
+
+    def nearest(self, language_code: str, k: int = 10, candidates: Optional[Sequence[str]] = None) -> List[Tuple[str, float]]:
+        row = self.distances[self.language_index[language_code]]
+        if candidates is None:
+            columns = np.arange(len(self.targets))
+        else:
+            columns = np.array([self.target_index[c] for c in candidates if c in self.target_index], dtype=np.intp)
+        if language_code in self.target_index:
+            columns = columns[columns != self.target_index[language_code]]
+        if k < len(columns):
+            columns = columns[np.argpartition(row[columns], k)[:k]]
+        columns = columns[np.argsort(row[columns], kind='stable')]
+        return [(self.targets[j], float(row[j])) for j in columns]
+
+    def save(self, path: Optional[str] = None) -> str:
+        path = path or default_distance_path()
+        with atomic_write(path) as f:
+            np.savez(f, languages=np.array(self.languages), targets=np.array(self.targets),
+                     distances=self.distances, version=np.array(self.version))
+        return path
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'LanguageDistanceMatrix':
+        with np.load(path or default_distance_path(), allow_pickle=False) as data:
+            return cls(data['languages'].tolist(), data['targets'].tolist(), data['distances'], str(data['version']))
+
+
+def _nearest_distances(inventories: List[np.ndarray], segment_distances: np.ndarray) -> np.ndarray:
+    # nearest[j, s] is the feature distance from segment s to the closest
+    # segment of inventory j.
+    nearest = np.full((len(inventories), len(segment_distances)), segment_distances.max(initial=0), dtype=np.float32)
+    for j, rows in enumerate(inventories):
+        if len(rows):
+            nearest[j] = segment_distances[:, rows].min(axis=1)
+    return nearest
+
+def _incidence(inventories: List[np.ndarray], size: int) -> np.ndarray:
+    # Row-normalised, so that incidence @ nearest.T averages over segments.
+    incidence = np.zeros((len(inventories), size), dtype=np.float32)
+    for j, rows in enumerate(inventories):
+        if len(rows):
+            incidence[j, rows] = 1.0 / len(rows)
+    return incidence
+
+_worker_arrays = None
+
+def _init_worker(arrays):
+    global _worker_arrays
+    _worker_arrays = arrays
+
+def _distance_block(start: int, stop: int, arrays=None) -> np.ndarray:
+    source_incidence, source_nearest, target_incidence, target_nearest = arrays or _worker_arrays
+    forward = source_incidence[start:stop] @ target_nearest.T
+    backward = (target_incidence @ source_nearest[start:stop].T).T
+    return (forward + backward) / 2
+
+def compute_language_distances(languages: Optional[Sequence[str]] = None, targets: Optional[Sequence[str]] = None,
+                               workers: int = 0, chunk_size: int = 256,
+                               store: Optional[DataStore] = None) -> LanguageDistanceMatrix:
+    store = store or get_data_store()
+    matrix = get_feature_matrix(store)
+    inventories = store.language_phonemes
+    languages = list(inventories) if languages is None else list(languages)
+    targets = languages if targets is None else list(targets)
+
+    source_rows = [matrix.rows(inventories[language])[0] for language in languages]
+    target_rows = source_rows if targets is languages else [matrix.rows(inventories[language])[0] for language in targets]
+
+    # Work in the space of segments that occur in any selected inventory.
+    space = np.unique(np.concatenate(source_rows + target_rows + [np.empty(0, dtype=np.intp)]))
+    source_rows = [np.searchsorted(space, rows) for rows in source_rows]
+    target_rows = source_rows if targets is languages else [np.searchsorted(space, rows) for rows in target_rows]
+
+    segment_distances = matrix.distances(space, space)
+    source_nearest = _nearest_distances(source_rows, segment_distances)
+    target_nearest = source_nearest if targets is languages else _nearest_distances(target_rows, segment_distances)
+    arrays = (_incidence(source_rows, len(space)), source_nearest, _incidence(target_rows, len(space)), target_nearest)
+
+    blocks = [(start, min(start + chunk_size, len(languages))) for start in range(0, len(languages), chunk_size)]
+    distances = np.empty((len(languages), len(targets)), dtype=np.float32)
+    if workers > 0 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(arrays,)) as pool:
+            futures = [(start, stop, pool.submit(_distance_block, start, stop)) for start, stop in blocks]
+            for start, stop, future in futures:
+                distances[start:stop] = future.result()
+    else:
+        for start, stop in blocks:
+            distances[start:stop] = _distance_block(start, stop, arrays)
+    distances /= len(matrix.features)
+
+    return LanguageDistanceMatrix(languages, targets, distances, store.data_version(DISTANCE_DATASETS))
+
+def get_language_distances(path: Optional[str] = None, workers: int = 0,
+                           store: Optional[DataStore] = None) -> LanguageDistanceMatrix:
+    """Loads the all-pairs matrix from disk, recomputing it if the data changed."""
+    store = store or get_data_store()
+    if path is None:
+        if not store.reads_default_files(DISTANCE_DATASETS):
+            # Other data files never share the default cache.
+            return compute_language_distances(workers=workers, store=store)
+        path = default_distance_path()
+    version = store.data_version(DISTANCE_DATASETS)
+    if os.path.exists(path):
+        distances = LanguageDistanceMatrix.load(path)
+        if distances.version == version:
+            return distances
+    distances = compute_language_distances(workers=workers, store=store)
+    distances.save(path)
+    return distances
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the all-pairs language distance matrix.")
+    parser.add_argument('--output', default=None, help="Output path (default: data/cache/language_distances.npz)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    args = parser.parse_args()
+    distances = compute_language_distances(workers=args.workers, chunk_size=args.chunk_size)
+    print(distances.save(args.output))
+
+if __name__ == '__main__':
+    main()
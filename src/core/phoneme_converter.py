@@ -1,36 +1,160 @@
-from .utils import load_json, get_data_file_path
+import hashlib
+from .utils import LRUCache, get_data_store
 from .feature_analyzer import FeatureAnalyzer
-from typing import List, Dict, Any, Tuple
+from .conversion_tables import ConversionTableCache, default_cache_dir
+from .allophones import get_allophone_index
+from .rule_processor import Rule, RuleSet
+from .instrumentation import metrics
+from .syllabifier import get_syllabifier
+from .word_cache import WORD_CACHE_DATASETS, WordCache, word_key
+from itertools import islice
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Iterator, Union
+
+_DEFAULT = object()
+# Matches remembered for segments outside the source inventory.
+MAX_FALLBACK_MATCHES = 4096
 
 class PhonemeConverter:
-    def __init__(self):
+    def __init__(self, max_tables: int = 512, table_cache_dir: Optional[str] = _DEFAULT, word_cache: Optional[WordCache] = None):
         self.feature_analyzer = FeatureAnalyzer()
-        self.prosodic_features = load_json(get_data_file_path('language_inventories/prosodic_features.json'))
+        store = get_data_store()
+        self._store, self._generation = store, store.generation
+        if table_cache_dir is _DEFAULT:
+            table_cache_dir = default_cache_dir()
+        self.conversion_tables = ConversionTableCache(self.feature_analyzer, max_tables, table_cache_dir)
+        self._fallback_matches = LRUCache(MAX_FALLBACK_MATCHES)
+        self.rules: Dict[str, RuleSet] = {}
+        # Optional cache of frozen convert_word_with_prosody results.
+        self.word_cache = word_cache
+        self._check_word_cache()
+
+    @property
+    def prosodic_features(self) -> Dict[str, Dict[str, Any]]:
+        return get_data_store().prosodic_features
+
+    def word_cache_version(self) -> str:
+        """Digest of what cached words depend on: the store's data files and the registered rules."""
+        digest = hashlib.sha256(self._store.data_version(WORD_CACHE_DATASETS).encode('ascii'))
+        for language_code in sorted(self.rules):
+            digest.update(f"\0{language_code}\0".encode('utf-8'))
+            digest.update('\n'.join(rule.text for rule in self.rules[language_code].rules).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _check_word_cache(self):
+        # Entries loaded from disk or kept from other data or rules are dropped.
+        if self.word_cache is None:
+            return
+        version = self.word_cache_version()
+        if self.word_cache.version != version:
+            self.word_cache.clear()
+            self.word_cache.version = version
+
+    def _sync(self):
+        # Drops tables and cached words made stale by DataStore.reload (or
+        # by a different store being installed) since the last call.
+        store = get_data_store()
+        if store is self._store and store.generation == self._generation:
+            return
+        change = store.changes_since(self._generation) if store is self._store else None
+        self._store, self._generation = store, store.generation
+        self._fallback_matches.clear()
+        if change is None:
+            self.conversion_tables.clear()
+            self._check_word_cache()
+            return
+        self.conversion_tables.invalidate(change)
+        if self.word_cache is not None:
+            affected = {}
+            def stale(key):
+                for code in key[1:3]:
+                    if code not in affected:
+                        affected[code] = change.affects(code)
+                return affected[key[1]] or affected[key[2]]
+            self.word_cache.discard_if(stale)
+            # The surviving entries hold for the new files too.
+            self.word_cache.version = self.word_cache_version()
+
+    def register_rules(self, target_language: str, rules: Union[RuleSet, Iterable[Union[str, Rule]]]) -> RuleSet:
+        # Rules are applied in order to every word converted into the language.
+        if not isinstance(rules, RuleSet):
+            rules = RuleSet(rules, target_language)
+        self.rules[target_language] = rules
+        self._check_word_cache()
+        return rules
+
+    def get_conversion_table(self, source_language: str, target_language: str) -> Dict[str, str]:
+        self._sync()
+        return self.conversion_tables.get(source_language, target_language)
 
     def convert_phoneme(self, source_phoneme: str, source_language: str, target_language: str) -> str:
         if source_language == target_language:
             return source_phoneme
 
-        similar_phonemes = self.feature_analyzer.find_similar_phonemes(source_phoneme, source_language, target_language)
-        return similar_phonemes[0][0] if similar_phonemes else source_phoneme
+        # A single segment has no context, so the target's rules do not apply.
+        self._sync()
+        return self._map_phonemes([source_phoneme], source_language, target_language)[0]
+
+    def convert_word(self, word: List[str], source_language: str, target_language: str, realize_allophones: bool = False) -> List[str]:
+        if source_language == target_language:
+            return list(word)
+        self._sync()
+        if not metrics.enabled:
+            return self._convert_word(word, source_language, target_language, realize_allophones)
+        with metrics.stage('convert_word', source=source_language, target=target_language):
+            return self._convert_word(word, source_language, target_language, realize_allophones)
+
+    def _convert_word(self, word: List[str], source_language: str, target_language: str, realize_allophones: bool) -> List[str]:
+        converted = self._map_phonemes(word, source_language, target_language)
+
+        if realize_allophones:
+            target_allophones = get_allophone_index(target_language)
+            converted = [target_allophones.realize(phoneme, surface) for phoneme, surface in zip(converted, word)]
+
+        rules = self.rules.get(target_language)
+        if rules is not None:
+            with metrics.stage('rules', target=target_language):
+                converted = rules.apply(converted)
+        return converted
 
-    def convert_word(self, word: List[str], source_language: str, target_language: str) -> List[str]:
-        return [self.convert_phoneme(phoneme, source_language, target_language) for phoneme in word]
+    def _map_phonemes(self, word: List[str], source_language: str, target_language: str) -> List[str]:
+        # Surface allophones are mapped through their underlying phoneme.
+        underlying = get_allophone_index(source_language).resolve_word(word)
+        table = self.conversion_tables.get(source_language, target_language)
+        missing = [phoneme for phoneme in dict.fromkeys(underlying) if phoneme not in table]
+        if not missing:
+            return [table[phoneme] for phoneme in underlying]
+        # Phonemes outside the source inventory are matched into a bounded
+        # memo; the cached table is shared between threads and stays as built.
+        matches = {}
+        for phoneme in missing:
+            match = self._fallback_matches.get((source_language, target_language, phoneme))
+            if match is not None:
+                matches[phoneme] = match
+        unmatched = [phoneme for phoneme in missing if phoneme not in matches]
+        if unmatched:
+            metrics.increment('unmapped_phonemes', len(unmatched), source=source_language, target=target_language)
+            for phoneme, match in self.feature_analyzer.best_matches(unmatched, source_language, target_language).items():
+                matches[phoneme] = self._fallback_matches.put((source_language, target_language, phoneme), match)
+        return [table[phoneme] if phoneme in table else matches[phoneme] for phoneme in underlying]
 
     def apply_prosody(self, phonemes: List[str], language_code: str) -> List[Dict[str, Any]]:
-        language_prosody = self.prosodic_features.get(language_code, {})
-        if not language_prosody:
-            return [{'phoneme': p} for p in phonemes]
-        
-        syllables = self.analyze_syllable_structure(phonemes, language_prosody)
-        syllables = self.apply_stress_pattern(syllables, language_prosody)
-        syllables = self.apply_tone_pattern(syllables, language_prosody)
-        
-        return syllables
+        return self.apply_prosody_many([phonemes], language_code)[0]
+
+    def apply_prosody_many(self, words: List[List[str]], language_code: str) -> List[List[Dict[str, Any]]]:
+        self._sync()
+        with metrics.stage('prosody', language=language_code):
+            language_prosody = self.prosodic_features.get(language_code, {})
+            syllabified = get_syllabifier(language_code, language_prosody).syllabify_many(words)
+            if language_prosody:
+                for syllables in syllabified:
+                    self.apply_stress_pattern(syllables, language_prosody)
+                    self.apply_tone_pattern(syllables, language_prosody)
+        return syllabified
 
-    def analyze_syllable_structure(self, phonemes: List[str], language_prosody: Dict[str, Any]) -> List[Dict[str, Any]]:
-        # Placeholder implementation
-        return [{'onset': [], 'nucleus': [p], 'coda': []} for p in phonemes]
+    def analyze_syllable_structure(self, phonemes: List[str], language_prosody: Dict[str, Any], language_code: Optional[str] = None) -> List[Dict[str, Any]]:
+        if language_code is None:
+            return get_syllabifier().syllabify(phonemes)
+        return get_syllabifier(language_code, language_prosody).syllabify(phonemes)
 
     def apply_stress_pattern(self, syllables: List[Dict[str, Any]], language_prosody: Dict[str, Any]) -> List[Dict[str, Any]]:
         stress_system = language_prosody.get('stress_system', 'none')
@@ -47,7 +171,38 @@ class PhonemeConverter:
                 syllable['tone'] = tones[i % len(tones)] if tones else 'neutral'
         return syllables
 
-    def convert_word_with_prosody(self, word: List[str], source_language: str, target_language: str) -> Tuple[List[str], List[Dict[str, Any]]]:
-        converted_phonemes = self.convert_word(word, source_language, target_language)
+    def convert_word_with_prosody(self, word: List[str], source_language: str, target_language: str, realize_allophones: bool = False) -> Tuple[List[str], List[Dict[str, Any]]]:
+        self._sync()
+        if self.word_cache is not None:
+            key = word_key(word, source_language, target_language, realize_allophones)
+            cached = self.word_cache.get(key)
+            if cached is not None:
+                return cached
+        converted_phonemes = self.convert_word(word, source_language, target_language, realize_allophones)
         target_prosody = self.apply_prosody(converted_phonemes, target_language)
-        return converted_phonemes, target_prosody
\ No newline at end of file
+        if self.word_cache is not None:
+            return self.word_cache.put(key, (converted_phonemes, target_prosody))
+        return converted_phonemes, target_prosody
+
+    def convert_words_with_prosody(self, words: Iterable[List[str]], source_language: str, target_language: str, realize_allophones: bool = False, chunk_size: int = 256) -> Iterator[Tuple[List[str], List[Dict[str, Any]]]]:
+        # Words are syllabified a chunk at a time, so the input can be a stream.
+        iterator = iter(words)
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                return
+            self._sync()
+            if self.word_cache is None:
+                converted = [self.convert_word(word, source_language, target_language, realize_allophones) for word in chunk]
+                yield from zip(converted, self.apply_prosody_many(converted, target_language))
+                continue
+
+            keys = [word_key(word, source_language, target_language, realize_allophones) for word in chunk]
+            results = [self.word_cache.get(key) for key in keys]
+            misses = {key: word for key, word, result in zip(keys, chunk, results) if result is None}
+            if misses:
+                converted = [self.convert_word(word, source_language, target_language, realize_allophones) for word in misses.values()]
+                computed = {key: self.word_cache.put(key, result)
+                            for key, result in zip(misses, zip(converted, self.apply_prosody_many(converted, target_language)))}
+                results = [computed[key] if result is None else result for key, result in zip(keys, results)]
+            yield from results
@@ -0,0 +1,299 @@
+import re
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from .utils import DataStore, LRUCache, get_data_store, get_phoneme_inventory
+from .feature_matrix import get_feature_matrix
+from .segment_index import get_segment_index
+from .glottolog import resolve_language_code
+
+BOUNDARY = '#'
+EMPTY = ('∅', '0', 'Ø')
+ARROWS = ('->', '→')
+# Features a feature-changing rule keeps unless it sets them itself, so
+# that e.g. nasalizing a vowel cannot turn it into a nasal consonant.
+MAJOR_CLASS_FEATURES = ('syllabic', 'consonantal')
+# Shorthand classes, expressed as PHOIBLE feature bundles.
+CLASSES = {
+    'C': (('syllabic', '-'),),
+    'V': (('syllabic', '+'),),
+}
+# Masks and rewrites memoized for segments outside the language's alphabet.
+MAX_MEMOIZED_SEGMENTS = 4096
+_TOKEN = re.compile(r'\[[^\]]*\]|\S+')
+
+class RuleSyntaxError(ValueError):
+    pass
+
+# An element is ('seg', segment), ('bundle', ((feature, value), ...)) or
+# ('boundary', '#'). Each distinct element is one predicate bit.
+Element = Tuple[str, object]
+
+
+def parse_bundle(token: str) -> Tuple[Tuple[str, str], ...]:
+    matrix = get_feature_matrix()
+    items = []
+    for item in re.split(r'[,\s]+', token[1:-1].strip()):
+        if not item:
+            continue
+        if '=' in item:
+            feature, value = item.split('=', 1)
+        elif item[0] in '+-0':
+            feature, value = item[1:], item[0]
+        else:
+            raise RuleSyntaxError(f"Cannot parse feature specification '{item}' in {token}")
+        if feature not in matrix.feature_index:
+            raise RuleSyntaxError(f"Unknown feature '{feature}' in {token}")
+        if value not in matrix.value_codes:
+            raise RuleSyntaxError(f"Unknown value '{value}' for feature '{feature}' in {token}")
+        items.append((feature, value))
+    if not items:
+        raise RuleSyntaxError(f"Empty feature bundle {token}")
+    return tuple(sorted(items))
+
+def parse_element(token: str) -> Element:
+    if token == BOUNDARY:
+        return ('boundary', BOUNDARY)
+    if token in CLASSES:
+        return ('bundle', CLASSES[token])
+    if token.startswith('['):
+        return ('bundle', parse_bundle(token))
+    return ('seg', token)
+
+def _parse_sequence(text: str) -> List[Element]:
+    tokens = _TOKEN.findall(text)
+    if len(tokens) == 1 and tokens[0] in EMPTY:
+        return []
+    return [parse_element(token) for token in tokens]
+
+
+class Rule:
+    """A single SPE-style rewrite rule, ``A -> B / C _ D``.
+
+    ``A`` is one segment or feature bundle, or ∅ for insertion. ``B`` is a
+    sequence of segments, ∅ for deletion, or a feature bundle whose values
+    are written onto the matched segment. Insertion and deletion must be
+    spelled out with ∅ (or 0); an empty side is a syntax error. The environment is optional;
+    its contexts may mix segments, bundles, ``C``/``V`` and ``#``.
+    """
+
+    def __init__(self, text: str):
+        self.text = text.strip()
+        arrow = next((a for a in ARROWS if a in self.text), None)
+        if arrow is None:
+            raise RuleSyntaxError(f"Missing '->' in rule '{self.text}'")
+        focus, rest = self.text.split(arrow, 1)
+        change, _, environment = rest.partition('/')
+        if not focus.strip():
+            raise RuleSyntaxError(f"Rule '{self.text}' has nothing to rewrite; write ∅ for insertion")
+        if not change.strip():
+            raise RuleSyntaxError(f"Rule '{self.text}' has an empty replacement; write ∅ for deletion")
+
+        target = _parse_sequence(focus)
+        if len(target) > 1:
+            raise RuleSyntaxError(f"Rule '{self.text}' must rewrite a single element")
+        self.target: Optional[Element] = target[0] if target else None
+        if self.target is not None and self.target[0] == 'boundary':
+            raise RuleSyntaxError(f"Rule '{self.text}' cannot rewrite a word boundary")
+
+        replacement = _parse_sequence(change)
+        self.feature_change: Optional[Tuple[Tuple[str, str], ...]] = None
+        if len(replacement) == 1 and replacement[0][0] == 'bundle':
+            if self.target is None:
+                raise RuleSyntaxError(f"Rule '{self.text}' cannot insert a feature bundle")
+            self.feature_change = replacement[0][1]
+            self.replacement: List[str] = []
+        elif any(kind != 'seg' for kind, _ in replacement):
+            raise RuleSyntaxError(f"Rule '{self.text}' must rewrite to segments, ∅ or a single feature bundle")
+        else:
+            self.replacement = [segment for _, segment in replacement]
+        if self.target is None and not self.replacement:
+            raise RuleSyntaxError(f"Rule '{self.text}' rewrites ∅ to ∅")
+
+        self.left: List[Element] = []
+        self.right: List[Element] = []
+        if environment.strip():
+            if environment.count('_') != 1:
+                raise RuleSyntaxError(f"Environment of rule '{self.text}' needs exactly one '_'")
+            left, right = environment.split('_')
+            self.left, self.right = _parse_sequence(left), _parse_sequence(right)
+        for position, element in enumerate(self.left):
+            if element[0] == 'boundary' and position != 0:
+                raise RuleSyntaxError(f"'#' can only open the left context in rule '{self.text}'")
+        for position, element in enumerate(self.right):
+            if element[0] == 'boundary' and position != len(self.right) - 1:
+                raise RuleSyntaxError(f"'#' can only close the right context in rule '{self.text}'")
+
+    @property
+    def pattern(self) -> List[Element]:
+        return self.left + ([self.target] if self.target is not None else []) + self.right
+
+    def __repr__(self) -> str:
+        return f"Rule({self.text!r})"
+
+
+class RuleSet:
+    """Ordered rules compiled to per-segment predicate bitmasks.
+
+    Every distinct context element becomes one bit. A segment's bitmask is
+    worked out once, vectorized over the language's inventory and
+    allophones at compile time and memoized (in a bounded LRU) for anything
+    else, so applying
+    a rule is a scan of integer masks. Each rule runs once, left to right,
+    with all matches taken from its input (simultaneous application), and
+    rules whose required bits are absent from a word are skipped outright.
+    """
+
+    def __init__(self, rules: Iterable[Union[str, Rule]], language_code: Optional[str] = None,
+                 store: Optional[DataStore] = None):
+        self.rules: List[Rule] = [rule if isinstance(rule, Rule) else Rule(rule) for rule in rules]
+        self.language_code = language_code
+        store = store or get_data_store()
+        self.matrix = get_feature_matrix(store)
+        self.segment_index = get_segment_index(store)
+
+        self.predicates: Dict[Element, int] = {('boundary', BOUNDARY): 0}
+        for rule in self.rules:
+            for element in rule.pattern:
+                self.predicates.setdefault(element, len(self.predicates))
+        self._bundles = []
+        for element, bit in self.predicates.items():
+            if element[0] == 'bundle':
+                cols = np.array([self.matrix.feature_index[f] for f, _ in element[1]], dtype=np.intp)
+                codes = np.array([self.matrix.value_codes[v] for _, v in element[1]])
+                self._bundles.append((bit, cols, codes))
+
+        self._compiled = [self._compile(rule) for rule in self.rules]
+        # Alphabet masks are kept for good; other segments go through the LRU.
+        self._masks: Dict[str, int] = {BOUNDARY: 1 << self.predicates[('boundary', BOUNDARY)]}
+        self._other_masks = LRUCache(MAX_MEMOIZED_SEGMENTS)
+        self._changes = LRUCache(MAX_MEMOIZED_SEGMENTS)
+        self._alphabet_rows: Optional[np.ndarray] = None
+        if language_code is not None:
+            alphabet = list(get_phoneme_inventory(language_code, store))
+            for surface_forms in store.language_allophones.get(resolve_language_code(language_code, store) or language_code, {}).values():
+                alphabet.extend(surface_forms)
+            alphabet = list(dict.fromkeys(alphabet))
+            self._alphabet_rows, _ = self.matrix.rows(alphabet)
+            self._masks.update(zip(alphabet, self._compute_masks(alphabet)))
+
+    @classmethod
+    def from_text(cls, text: str, language_code: Optional[str] = None, store: Optional[DataStore] = None) -> 'RuleSet':
+        lines = [line.strip() for line in text.splitlines()]
+        return cls([line for line in lines if line and not line.startswith('//')], language_code, store)
+
+    def _compile(self, rule: Rule) -> Tuple[Rule, List[int], int]:
+        bits = [1 << self.predicates[element] for element in rule.pattern]
+        required = 0
+        for element, bit in zip(rule.pattern, bits):
+            if element[0] != 'boundary':
+                required |= bit
+        return rule, bits, required
+
+    def _compute_masks(self, segments: List[str]) -> List[int]:
+        vectors = self.segment_index.vectors(segments)
+        masks = np.zeros(len(segments), dtype=object)
+        masks[:] = 0
+        for bit, cols, codes in self._bundles:
+            hits = np.all(vectors[:, cols] == codes, axis=1)
+            masks[hits] = masks[hits] + (1 << bit)
+        result = []
+        for segment, mask in zip(segments, masks):
+            bit = self.predicates.get(('seg', segment))
+            result.append(int(mask) | (1 << bit if bit is not None else 0))
+        return result
+
+    def mask(self, segment: str) -> int:
+        mask = self._masks.get(segment)
+        if mask is None:
+            mask = self._other_masks.get(segment)
+            if mask is None:
+                mask = self._other_masks.put(segment, self._compute_masks([segment])[0])
+        return mask
+
+    def _changed_segment(self, rule_number: int, segment: str) -> str:
+        key = (rule_number, segment)
+        result = self._changes.get(key)
+        if result is None:
+            change = self._compiled[rule_number][0].feature_change
+            cols = np.array([self.matrix.feature_index[feature] for feature, _ in change], dtype=np.intp)
+            values = np.array([self.matrix.value_codes[value] for _, value in change])
+            codes = self.segment_index.vector(segment).copy()
+            codes[cols] = values
+            # The closest segment that actually carries the new values and
+            # keeps the segment's major class, preferably from the language's
+            # own alphabet; the major class is given up only as a last resort.
+            kept = [self.matrix.feature_index[feature] for feature in MAJOR_CLASS_FEATURES
+                    if feature in self.matrix.feature_index and feature not in dict(change)]
+            required_cols = np.concatenate([cols, np.array(kept, dtype=np.intp)])
+            all_rows = np.arange(len(self.matrix))
+            rows = self._alphabet_rows if self._alphabet_rows is not None else all_rows
+            pools = [(rows, required_cols), (all_rows, required_cols), (all_rows, cols)]
+            for candidates, checked in pools:
+                candidates = candidates[np.all(self.matrix.codes[candidates][:, checked] == codes[checked], axis=1)]
+                if len(candidates):
+                    break
+            else:
+                candidates = rows
+            (row, _), = self.segment_index.query_vector(codes, 1, candidates)
+            result = self._changes.put(key, self.matrix.segments[row])
+        return result
+
+    def apply(self, word: Sequence[str]) -> List[str]:
+        tokens = list(word)
+        boundary = self._masks[BOUNDARY]
+        masks = [boundary] + [self.mask(token) for token in tokens] + [boundary]
+        present = 0
+        for mask in masks:
+            present |= mask
+
+        for rule_number, (rule, bits, required) in enumerate(self._compiled):
+            if required & present != required:
+                continue
+            matches = self._match(rule, bits, masks, len(tokens))
+            if not matches:
+                continue
+            tokens = self._rewrite(rule_number, rule, tokens, matches)
+            masks = [boundary] + [self.mask(token) for token in tokens] + [boundary]
+            present = 0
+            for mask in masks:
+                present |= mask
+        return tokens
+
+    def apply_many(self, words: Iterable[Sequence[str]]) -> List[List[str]]:
+        return [self.apply(word) for word in words]
+
+    def _match(self, rule: Rule, bits: List[int], masks: List[int], n: int) -> List[int]:
+        # masks is padded with one boundary on each side; a match at token
+        # position i puts the focus (or, for insertion, the gap before
+        # token i) right after the left context.
+        left = len(rule.left)
+        width = len(bits)
+        focus = 1 if rule.target is not None else 0
+        matches = []
+        for i in range(n + 1 - focus):
+            start = i + 1 - left
+            if start < 0 or start + width > n + 2:
+                continue
+            for k in range(width):
+                if not masks[start + k] & bits[k]:
+                    break
+            else:
+                matches.append(i)
+        return matches
+
+    def _rewrite(self, rule_number: int, rule: Rule, tokens: List[str], matches: List[int]) -> List[str]:
+        matched = set(matches)
+        output = []
+        for i in range(len(tokens) + 1):
+            if i in matched:
+                if rule.target is None:
+                    output.extend(rule.replacement)
+                elif rule.feature_change is not None:
+                    output.append(self._changed_segment(rule_number, tokens[i]))
+                    continue
+                else:
+                    output.extend(rule.replacement)
+                    continue
+            if i < len(tokens):
+                output.append(tokens[i])
+        return output
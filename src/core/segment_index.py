@@ -0,0 +1,236 @@
+import heapq
+import unicodedata
+import numpy as np
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+from .utils import LRUCache, get_data_store, register_derived
+from .feature_matrix import FeatureMatrix, get_feature_matrix
+
+DEFAULT_LEAF_SIZE = 64
+# Unseen segments whose estimated vectors are remembered.
+MAX_ESTIMATES = 4096
+# Candidate sets at most this large are scanned directly instead of
+# walking the tree, which would visit mostly excluded segments.
+BRUTE_FORCE_LIMIT = 512
+
+def is_modifier(char: str) -> bool:
+    return bool(unicodedata.combining(char)) or unicodedata.category(char) in ('Lm', 'Sk')
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+else:
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        return _BYTE_COUNTS[words.view(np.uint8)].sum(axis=-1, dtype=np.int32)
+
+
+class SegmentIndex:
+    """Nearest-neighbour index over the feature vectors of all segments.
+
+    Each segment is one-hot encoded per (feature, value) and bit-packed, so
+    the Hamming distance between two packed rows is twice the number of
+    features on which they differ. Unrestricted queries go through a
+    vantage-point tree; queries restricted to a small candidate set (an
+    inventory) are a packed scan of just those rows.
+
+    Segments missing from the features database are split into a known
+    base and trailing diacritics, and the diacritics' feature changes,
+    learned from base/base+diacritic pairs in the database, are applied to
+    the base's vector.
+    """
+
+    def __init__(self, matrix: FeatureMatrix, leaf_size: int = DEFAULT_LEAF_SIZE):
+        self.matrix = matrix
+        self.leaf_size = leaf_size
+        self.n_values = len(matrix.values)
+        self.n_words = -(-len(matrix.features) * self.n_values // 64)
+        self.packed = self.pack(matrix.codes)
+        self.modifier_deltas = self._learn_modifier_deltas()
+        # Estimates of unseen segments, which come from user input.
+        self._estimates = LRUCache(MAX_ESTIMATES)
+        self._build_tree()
+
+    def pack(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.atleast_2d(codes).astype(np.intp)
+        positions = np.arange(codes.shape[1]) * self.n_values + codes
+        rows = np.broadcast_to(np.arange(len(codes))[:, None], positions.shape)
+        packed = np.zeros((len(codes), self.n_words), dtype=np.uint64)
+        bits = np.left_shift(np.uint64(1), (positions % 64).astype(np.uint64))
+        np.bitwise_or.at(packed, (rows, positions // 64), bits)
+        return packed
+
+    def _distances(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        return _popcount(self.packed[rows] ^ query) // 2
+
+    def _learn_modifier_deltas(self) -> Dict[str, Dict[int, int]]:
+        matrix = self.matrix
+        changes: Dict[str, Counter] = defaultdict(Counter)
+        pairs: Counter = Counter()
+        for segment, row in matrix.index.items():
+            base, modifier = segment[:-1], segment[-1:]
+            if not base or not is_modifier(modifier) or base not in matrix.index:
+                continue
+            pairs[modifier] += 1
+            base_codes = matrix.codes[matrix.index[base]]
+            for col in np.flatnonzero(matrix.codes[row] != base_codes):
+                changes[modifier][(int(col), int(matrix.codes[row, col]))] += 1
+
+        deltas = {}
+        for modifier, counter in changes.items():
+            delta = {}
+            for (col, code), count in counter.most_common():
+                if col not in delta and 2 * count >= pairs[modifier]:
+                    delta[col] = code
+            deltas[modifier] = delta
+        return deltas
+
+    def vector(self, segment: str) -> np.ndarray:
+        row = self.matrix.index.get(segment)
+        if row is not None:
+            return self.matrix.codes[row]
+        estimate = self._estimates.get(segment)
+        if estimate is None:
+            estimate = self._estimates.put(segment, self.estimate(segment))
+        return estimate
+
+    def vectors(self, segments: Sequence[str]) -> np.ndarray:
+        if not segments:
+            return np.empty((0, len(self.matrix.features)), dtype=self.matrix.codes.dtype)
+        return np.stack([self.vector(segment) for segment in segments])
+
+    def estimate(self, segment: str) -> np.ndarray:
+        index = self.matrix.index
+        for form in (unicodedata.normalize('NFD', segment), unicodedata.normalize('NFC', segment)):
+            if form in index:
+                return self.matrix.codes[index[form]]
+
+        text = unicodedata.normalize('NFD', segment)
+        # Longest known stem followed only by diacritics.
+        for cut in range(len(text) - 1, 0, -1):
+            stem, rest = text[:cut], text[cut:]
+            if stem in index and all(is_modifier(char) for char in rest):
+                return self._apply_modifiers(self.matrix.codes[index[stem]], rest)
+
+        bases = ''.join(char for char in text if not is_modifier(char))
+        modifiers = ''.join(char for char in text if is_modifier(char))
+        if bases in index:
+            codes = self.matrix.codes[index[bases]]
+        else:
+            known = [char for char in bases if char in index]
+            # Otherwise use the shortest segment spelled with the first base,
+            # e.g. a click letter that only occurs with an accompaniment.
+            containing = [] if known or not bases else sorted((seg for seg in index if bases[0] in seg), key=len)
+            if known:
+                codes = self.matrix.codes[index[known[0]]]
+            elif containing:
+                codes = self.matrix.codes[index[containing[0]]]
+            else:
+                codes = np.full(len(self.matrix.features), self.matrix.value_codes['0'], dtype=self.matrix.codes.dtype)
+        return self._apply_modifiers(codes, modifiers)
+
+    def _apply_modifiers(self, codes: np.ndarray, modifiers: str) -> np.ndarray:
+        codes = codes.copy()
+        for modifier in modifiers:
+            for col, code in self.modifier_deltas.get(modifier, {}).items():
+                codes[col] = code
+        return codes
+
+    def query(self, segment: str, k: int = 1, candidates: Optional[Sequence[str]] = None) -> List[Tuple[str, int]]:
+        if candidates is None:
+            rows = None
+        else:
+            rows, _ = self.matrix.rows(list(dict.fromkeys(candidates)))
+        result = self.query_vector(self.vector(segment), k, rows)
+        return [(self.matrix.segments[row], distance) for row, distance in result]
+
+    def query_vector(self, codes: np.ndarray, k: int = 1, rows: Optional[np.ndarray] = None) -> List[Tuple[int, int]]:
+        query = self.pack(codes)[0]
+        if rows is not None and len(rows) <= BRUTE_FORCE_LIMIT:
+            distances = self._distances(query, rows)
+            order = np.lexsort((rows, distances))[:k]
+            return [(int(rows[i]), int(distances[i])) for i in order]
+
+        mask = None
+        if rows is not None:
+            mask = np.zeros(len(self.matrix), dtype=bool)
+            mask[rows] = True
+        heap: List[Tuple[int, int]] = []
+        self._search(0, query, k, mask, heap)
+        found = sorted((-distance, -row) for distance, row in heap)
+        return [(row, distance) for distance, row in found]
+
+    # Vantage-point tree, stored as flat lists indexed by node id.
+
+    def _build_tree(self):
+        self._vantage: List[int] = []
+        self._radius: List[int] = []
+        self._inside: List[int] = []
+        self._outside: List[int] = []
+        self._leaf: List[Optional[np.ndarray]] = []
+        self._build_node(np.arange(len(self.matrix), dtype=np.intp))
+
+    def _build_node(self, rows: np.ndarray) -> int:
+        node = len(self._vantage)
+        self._vantage.append(-1)
+        self._radius.append(0)
+        self._inside.append(-1)
+        self._outside.append(-1)
+        self._leaf.append(None)
+        if len(rows) <= self.leaf_size:
+            self._leaf[node] = rows
+            return node
+
+        vantage, rest = rows[0], rows[1:]
+        distances = self._distances(self.packed[vantage], rest)
+        radius = int(np.median(distances))
+        inside, outside = rest[distances < radius], rest[distances >= radius]
+        if not len(inside) or not len(outside):
+            self._leaf[node] = rows
+            return node
+
+        self._vantage[node] = int(vantage)
+        self._radius[node] = radius
+        self._inside[node] = self._build_node(inside)
+        self._outside[node] = self._build_node(outside)
+        return node
+
+    def _search(self, node: int, query: np.ndarray, k: int, mask: Optional[np.ndarray], heap: List[Tuple[int, int]]):
+        # heap holds (-distance, -row) so the worst kept candidate is on top.
+        leaf = self._leaf[node]
+        if leaf is not None:
+            rows = leaf if mask is None else leaf[mask[leaf]]
+            for row, distance in zip(rows.tolist(), self._distances(query, rows).tolist()):
+                self._offer(heap, k, row, distance)
+            return
+
+        vantage = self._vantage[node]
+        distance = int(self._distances(query, np.array([vantage]))[0])
+        if mask is None or mask[vantage]:
+            self._offer(heap, k, vantage, distance)
+
+        radius = self._radius[node]
+        first, second = (self._inside[node], self._outside[node]) if distance < radius else (self._outside[node], self._inside[node])
+        self._search(first, query, k, mask, heap)
+        tau = -heap[0][0] if len(heap) == k else None
+        if second == self._inside[node]:
+            needed = tau is None or distance - tau < radius
+        else:
+            needed = tau is None or distance + tau >= radius
+        if needed:
+            self._search(second, query, k, mask, heap)
+
+    @staticmethod
+    def _offer(heap: List[Tuple[int, int]], k: int, row: int, distance: int):
+        item = (-distance, -row)
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+
+register_derived('segment_index', ('phoneme_features',))
+
+def get_segment_index(store=None) -> SegmentIndex:
+    return (store or get_data_store()).derived('segment_index', lambda store: SegmentIndex(get_feature_matrix(store)))
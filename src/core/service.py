@@ -0,0 +1,486 @@
+import argparse
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from .utils import PhonemeTokenizer, get_data_store
+from .tokenizer import UNMATCHED_POLICIES
+from .glottolog import resolve_language_code
+from .phoneme_converter import PhonemeConverter
+from .batch import BatchConverter
+from .instrumentation import metrics
+from .word_cache import WordCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_BATCH_DELAY = 0.001
+DEFAULT_MAX_PENDING = 1024
+DEFAULT_MAX_BODY = 1 << 20
+DEFAULT_MAX_BATCHERS = 256
+TOKENIZER_DATASETS = ('language_phonemes', 'language_allophones')
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class MicroBatcher:
+    """Groups concurrent submissions into batches for one executor call.
+
+    A batch closes when it reaches ``max_batch`` items or ``max_delay``
+    seconds after its first item arrived. ``function`` receives the list of
+    items and returns one result, or one exception, per item.
+    """
+
+    def __init__(self, function: Callable[[List[Any]], List[Any]], executor: Executor,
+                 max_batch: int = DEFAULT_MAX_BATCH, max_delay: float = DEFAULT_BATCH_DELAY):
+        self.function = function
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.pending = 0
+
+    @property
+    def idle(self) -> bool:
+        """No submission is queued or running, so closing loses nothing."""
+        return self.pending == 0
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.task = loop.create_task(self._run())
+        future = loop.create_future()
+        self.queue.put_nowait((item, future))
+        self.pending += 1
+        try:
+            return await future
+        finally:
+            self.pending -= 1
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            metrics.observe('service_batch_size', len(batch))
+            try:
+                results = await loop.run_in_executor(self.executor, self.function, [item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+def _each(function: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+    results = []
+    for item in items:
+        try:
+            results.append(function(item))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+class ConversionService:
+    """HTTP/JSON front end for tokenization and conversion.
+
+    Tokenizers and per-language-pair converters are created once and kept
+    warm. Requests for the same language pair are micro-batched and run on
+    ``executor`` so the event loop only parses and routes. At most
+    ``max_pending`` requests are queued or running at once; beyond that
+    requests are answered with 503 straight away. Language codes are
+    resolved before a request is queued, and at most ``max_batchers`` idle
+    batchers are kept, least recently used first out.
+
+    Endpoints: ``GET /health``, ``GET /metrics`` (Prometheus text),
+    ``POST /tokenize`` with ``{"language", "text"}``, ``POST /convert``
+    with ``{"source", "target", "text"}`` (or pre-tokenized ``"words"``) and
+    ``POST /reload``, which picks up edited data files. After a reload only
+    the tokenizers and conversion tables of changed languages are rebuilt.
+    """
+
+    def __init__(self, converter: Optional[PhonemeConverter] = None, executor: Optional[Executor] = None,
+                 workers: int = 1, max_batch: int = DEFAULT_MAX_BATCH, batch_delay: float = DEFAULT_BATCH_DELAY,
+                 max_pending: int = DEFAULT_MAX_PENDING, max_body: int = DEFAULT_MAX_BODY,
+                 max_batchers: int = DEFAULT_MAX_BATCHERS):
+        self.converter = converter or PhonemeConverter(word_cache=WordCache())
+        # Converters share conversion tables, so one worker thread by default.
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kunai-service')
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.max_batchers = max_batchers
+        self.pending = 0
+        self.batch_converters: Dict[Tuple[str, str], BatchConverter] = {}
+        self.tokenizers: Dict[Tuple[str, str], PhonemeTokenizer] = {}
+        self.batchers: 'OrderedDict[Tuple[str, ...], MicroBatcher]' = OrderedDict()
+        self.server: Optional[asyncio.AbstractServer] = None
+        store = get_data_store()
+        self._store, self._generation = store, store.generation
+
+    def _sync(self):
+        # Tokenizers keep their trie, so those of changed languages go.
+        store = get_data_store()
+        if store is self._store and store.generation == self._generation:
+            return
+        change = store.changes_since(self._generation) if store is self._store else None
+        self._store, self._generation = store, store.generation
+        if change is not None and change.datasets.isdisjoint(TOKENIZER_DATASETS):
+            return
+        keep = (lambda key: False) if change is None else (lambda key: not change.affects(key[0]))
+        self.tokenizers = {key: tokenizer for key, tokenizer in self.tokenizers.items() if keep(key)}
+        self.batch_converters = {key: converter for key, converter in self.batch_converters.items() if keep(key)}
+
+    def batch_converter(self, source_language: str, target_language: str) -> BatchConverter:
+        self._sync()
+        key = (source_language, target_language)
+        converter = self.batch_converters.get(key)
+        if converter is None:
+            converter = self.batch_converters[key] = BatchConverter(source_language, target_language, self.converter)
+        return converter
+
+    def tokenizer(self, language_code: str, unmatched: str = 'skip') -> PhonemeTokenizer:
+        self._sync()
+        key = (language_code, unmatched)
+        tokenizer = self.tokenizers.get(key)
+        if tokenizer is None:
+            tokenizer = self.tokenizers[key] = PhonemeTokenizer(language_code, unmatched)
+        return tokenizer
+
+    def warm(self, pairs: Iterable[Tuple[str, str]]):
+        """Builds tokenizers and conversion tables ahead of the first request.
+
+        Codes are resolved as in requests, so ISO codes warm the glottocode
+        pairs that requests use; unknown codes raise ValueError.
+        """
+        resolved = []
+        for pair in pairs:
+            codes = [resolve_language_code(code) for code in pair]
+            for code, glottocode in zip(pair, codes):
+                if glottocode is None:
+                    raise ValueError(f"Language code '{code}' not found in the phoneme database.")
+            resolved.append(codes)
+        for source_language, target_language in resolved:
+            self.batch_converter(source_language, target_language)
+            self.converter.get_conversion_table(source_language, target_language)
+
+    async def reload(self) -> Dict[str, Any]:
+        """Reloads changed data files off the event loop."""
+        store = get_data_store()
+        change = await asyncio.get_running_loop().run_in_executor(None, store.reload)
+        if change is None:
+            return {'generation': store.generation, 'files': []}
+        return {'generation': change.generation, 'files': sorted(change.files),
+                'languages': None if change.languages is None else sorted(change.languages)}
+
+    async def watch(self, interval: float):
+        """Checks the data files for changes every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("Reloading the data files failed; keeping the current data")
+
+    # Batch functions, run on the executor.
+
+    def _convert_batch(self, key: Tuple[str, ...], items: List[Any]) -> List[Any]:
+        _, source_language, target_language = key
+        try:
+            converter = self.batch_converter(source_language, target_language)
+        except Exception as e:
+            return [e] * len(items)
+
+        def convert(item):
+            kind, value = item
+            if kind == 'text':
+                return converter.convert_line(value)
+            converted = self.converter.convert_words_with_prosody(value, source_language, target_language)
+            return {'words': [{'source': source, 'converted': phonemes, 'prosody': prosody}
+                              for source, (phonemes, prosody) in zip(value, converted)]}
+
+        # The words of every item go through one conversion call and are
+        # split back per item; items that cannot be tokenized fail alone.
+        results: List[Any] = [None] * len(items)
+        spans, words = [], []
+        for i, (kind, value) in enumerate(items):
+            try:
+                if kind == 'text':
+                    sources = converter.tokenizer.tokenize_many(value.split())
+                elif isinstance(value, list) and all(isinstance(word, list) for word in value):
+                    sources = value
+                else:
+                    raise TypeError("'words' must be a list of lists of segments")
+            except Exception as e:
+                results[i] = e
+                continue
+            spans.append((i, sources, len(words)))
+            words.extend(sources)
+        try:
+            converted = list(self.converter.convert_words_with_prosody(words, source_language, target_language))
+        except Exception:
+            return _each(convert, items)
+        for i, sources, start in spans:
+            record = {'words': [{'source': source, 'converted': phonemes, 'prosody': prosody}
+                                for source, (phonemes, prosody) in zip(sources, converted[start:start + len(sources)])]}
+            kind, value = items[i]
+            results[i] = dict({'text': value}, **record) if kind == 'text' else record
+        return results
+
+    def _tokenize_batch(self, key: Tuple[str, ...], items: List[str]) -> List[Any]:
+        _, language_code, unmatched = key
+        try:
+            tokenizer = self.tokenizer(language_code, unmatched)
+        except Exception as e:
+            return [e] * len(items)
+        return _each(lambda text: {'text': text, 'words': tokenizer.tokenize_many(text.split())}, items)
+
+    def _batcher(self, key: Tuple[str, ...]) -> MicroBatcher:
+        batcher = self.batchers.get(key)
+        if batcher is not None:
+            self.batchers.move_to_end(key)
+            return batcher
+        function = self._convert_batch if key[0] == 'convert' else self._tokenize_batch
+        batcher = self.batchers[key] = MicroBatcher(lambda items: function(key, items), self.executor,
+                                                    self.max_batch, self.batch_delay)
+        for old_key in [k for k in self.batchers if k != key][:max(0, len(self.batchers) - self.max_batchers)]:
+            if self.batchers[old_key].idle:
+                self.batchers.pop(old_key).close()
+                if old_key[0] == 'convert':
+                    self.batch_converters.pop(old_key[1:], None)
+        return batcher
+
+    # Request handling.
+
+    async def handle(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        path = path.split('?', 1)[0]
+        if path == '/health':
+            if method != 'GET':
+                raise RequestError(405, "Use GET")
+            health = {'status': 'ok', 'pending': self.pending, 'max_pending': self.max_pending,
+                      'language_pairs': len(self.batch_converters), 'data_generation': get_data_store().generation}
+            if self.converter.word_cache is not None:
+                health['word_cache'] = self.converter.word_cache.stats()
+            return 200, health
+        if path == '/metrics':
+            if method != 'GET':
+                raise RequestError(405, "Use GET")
+            return 200, metrics.to_prometheus()
+        if path == '/reload':
+            if method != 'POST':
+                raise RequestError(405, "Use POST")
+            try:
+                return 200, await self.reload()
+            except (OSError, ValueError) as e:
+                raise RequestError(500, f"Reload failed: {e}")
+        if path not in ('/convert', '/tokenize'):
+            raise RequestError(404, f"Unknown path {path}")
+        if method != 'POST':
+            raise RequestError(405, "Use POST")
+
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError as e:
+            raise RequestError(400, f"Invalid JSON: {e}")
+        if not isinstance(request, dict):
+            raise RequestError(400, "Expected a JSON object")
+
+        if path == '/convert':
+            key = ('convert', _language(request, 'source'), _language(request, 'target'))
+            if 'words' in request:
+                item = ('words', request['words'])
+            else:
+                item = ('text', _text(request))
+        else:
+            unmatched = request.get('unmatched', 'skip')
+            if unmatched not in UNMATCHED_POLICIES:
+                raise RequestError(400, f"Unknown unmatched policy {unmatched!r}, expected one of {UNMATCHED_POLICIES}")
+            key = ('tokenize', _language(request, 'language'), unmatched)
+            item = _text(request)
+
+        if self.pending >= self.max_pending:
+            raise RequestError(503, "Too many pending requests")
+        self.pending += 1
+        try:
+            result = await self._batcher(key).submit(item)
+        except (ValueError, KeyError, TypeError) as e:
+            raise RequestError(400, str(e))
+        finally:
+            self.pending -= 1
+        return 200, result
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    await self._respond(writer, 400, {'error': "Malformed request"}, False)
+                    break
+                if length > self.max_body:
+                    await self._respond(writer, 413, {'error': f"Body larger than {self.max_body} bytes"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                try:
+                    status, payload = await self.handle(method, path, body)
+                except RequestError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception:
+                    logger.exception("Error handling %s %s", method, path)
+                    status, payload = 500, {'error': "Internal server error"}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8'
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}"]
+        if status == 503:
+            head.append('Retry-After: 1')
+        if not keep_alive:
+            head.append('Connection: close')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8000) -> asyncio.AbstractServer:
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        for batcher in self.batchers.values():
+            batcher.close()
+        self.batchers.clear()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+def _field(request: Dict[str, Any], name: str) -> Any:
+    if name not in request:
+        raise RequestError(400, f"Missing field '{name}'")
+    return request[name]
+
+def _text(request: Dict[str, Any]) -> str:
+    text = _field(request, 'text')
+    if not isinstance(text, str):
+        raise RequestError(400, "'text' must be a string")
+    return text
+
+def _language(request: Dict[str, Any], name: str) -> str:
+    # Resolved up front, so that unknown codes never get a batcher.
+    code = _field(request, name)
+    glottocode = resolve_language_code(code) if isinstance(code, str) else None
+    if glottocode is None:
+        raise RequestError(400, f"Language code {code!r} not found in the phoneme database.")
+    return glottocode
+
+async def serve(host: str = '127.0.0.1', port: int = 8000, warm: Iterable[Tuple[str, str]] = (),
+                word_cache: Optional[WordCache] = None, reload_interval: Optional[float] = None, **options):
+    service = ConversionService(PhonemeConverter(word_cache=word_cache or WordCache()), **options)
+    service.warm(warm)
+    server = await service.start(host, port)
+    logger.info("Serving on %s", ', '.join(str(sock.getsockname()) for sock in server.sockets))
+    watcher = asyncio.create_task(service.watch(reload_interval)) if reload_interval else None
+    try:
+        await server.serve_forever()
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await service.close()
+        if service.converter.word_cache.path:
+            service.converter.word_cache.save()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve tokenization and conversion over HTTP/JSON.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help="Executor threads for conversion work")
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, help="Requests per batch")
+    parser.add_argument('--batch-delay-ms', type=float, default=DEFAULT_BATCH_DELAY * 1000,
+                        help="How long a batch waits for more requests")
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help="Queued or running requests before answering 503")
+    parser.add_argument('--warm', action='append', default=[], metavar='SOURCE:TARGET',
+                        help="Language pair to prepare at start-up (repeatable)")
+    parser.add_argument('--word-cache-size', type=int, default=100_000, help="Cached word conversions")
+    parser.add_argument('--word-cache-file', default=None,
+                        help="Load the word cache from this file at start-up and save it on shutdown")
+    parser.add_argument('--reload-interval', type=float, default=None, metavar='SECONDS',
+                        help="Check the data files for changes this often (default: only on POST /reload)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    warm = [tuple(pair.split(':', 1)) for pair in args.warm]
+    if any(len(pair) != 2 for pair in warm):
+        parser.error("--warm expects SOURCE:TARGET")
+    for code in {code for pair in warm for code in pair}:
+        if resolve_language_code(code) is None:
+            parser.error(f"Language code '{code}' not found in the phoneme database.")
+    word_cache = WordCache(args.word_cache_size, path=args.word_cache_file)
+    asyncio.run(serve(args.host, args.port, warm, word_cache, args.reload_interval, workers=args.workers,
+                      max_batch=args.max_batch, batch_delay=args.batch_delay_ms / 1000, max_pending=args.max_pending))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Iterable, List, Optional, Tuple
+from .utils import DataStore, get_data_store, set_data_store
+from .binary_data import BinaryDataset, build_sections, pack_sections
+
+logger = logging.getLogger(__name__)
+
+# Attached blocks stay referenced for the life of the process, since the
+# data store's arrays are views onto them.
+_attached: Dict[str, 'SharedDatasets'] = {}
+
+
+class _SharedMemory(shared_memory.SharedMemory):
+    def __del__(self):
+        # Views onto the block may outlive it at interpreter exit.
+        try:
+            self.close()
+        except BufferError:
+            pass
+
+
+class SharedDatasets:
+    """The compiled datasets in a ``multiprocessing.shared_memory`` block.
+
+    The publishing process owns the block and unlinks it when done; other
+    processes attach to it by name. Every process reads the same physical
+    pages: the feature matrix and inventory arrays are numpy views onto
+    the block, and only the strings and structures a worker actually uses
+    become Python objects.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        self.memory = memory
+        self.owner = owner
+        self.dataset = BinaryDataset.from_buffer(memory.buf, path=f'shm:{memory.name}')
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    @property
+    def size(self) -> int:
+        return self.memory.size
+
+    def store(self) -> DataStore:
+        return DataStore.from_binary(self.dataset)
+
+    def close(self):
+        """Detaches this process; the arrays viewing the block must be gone first."""
+        self.dataset = None
+        try:
+            self.memory.close()
+        except BufferError:
+            logger.warning("Shared datasets %s are still in use and stay mapped", self.name)
+
+    def unlink(self):
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self) -> 'SharedDatasets':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unlink()
+        return False
+
+
+def publish_shared_datasets(conversion_pairs: Iterable[Tuple[str, str]] = (), name: Optional[str] = None,
+                            store: Optional[DataStore] = None) -> SharedDatasets:
+    """Compiles the datasets into a new shared memory block.
+
+    Conversion tables for ``conversion_pairs`` are built once here and
+    published with the datasets. Publish before forking workers, or pass
+    ``name`` to a pool initializer that calls ``attach_shared_datasets``.
+    """
+    store = store or get_data_store()
+    tables = {}
+    pairs = list(conversion_pairs)
+    if pairs:
+        from .feature_analyzer import FeatureAnalyzer
+        from .conversion_tables import ConversionTableCache
+        cache = ConversionTableCache(FeatureAnalyzer(store), max_tables=0)
+        tables = {(source, target): cache.build(source, target) for source, target in pairs}
+    sections = build_sections(store, tables)
+    if os.name == 'posix':
+        resource_tracker.ensure_running()
+    sections['owner'] = json.dumps({'tracker': _tracker_id()}).encode('utf-8')
+    data = pack_sections(sections)
+    memory = _SharedMemory(name=name, create=True, size=len(data))
+    memory.buf[:len(data)] = data
+    return SharedDatasets(memory, owner=True)
+
+def _tracker_id() -> Optional[List[int]]:
+    # Identifies this process's resource tracker by its pipe, which child
+    # processes inherit (both forked and spawned).
+    fd = getattr(resource_tracker._resource_tracker, '_fd', None)
+    if fd is None:
+        return None
+    try:
+        stat = os.fstat(fd)
+    except OSError:
+        return None
+    return [stat.st_dev, stat.st_ino]
+
+def _attach(name: str) -> SharedDatasets:
+    try:
+        return SharedDatasets(_SharedMemory(name=name, track=False), owner=False)
+    except TypeError:
+        pass
+    # Before Python 3.13 attaching registers the block with the resource
+    # tracker. The publisher's own tracker already has it, but a separate
+    # tracker would unlink it when this process exits, so leave that one.
+    shared = SharedDatasets(_SharedMemory(name=name), owner=False)
+    owner = shared.dataset.section('owner')
+    if owner is None or json.loads(bytes(owner).decode('utf-8'))['tracker'] != _tracker_id():
+        resource_tracker.unregister(shared.memory._name, 'shared_memory')
+    return shared
+
+def attach_shared_datasets(name: str, install: bool = True) -> SharedDatasets:
+    """Attaches to published datasets and, with ``install``, serves the ``core`` API from them."""
+    shared = _attached.get(name)
+    if shared is None:
+        shared = _attached[name] = _attach(name)
+    if install:
+        set_data_store(shared.store())
+    return shared
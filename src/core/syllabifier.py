@@ -0,0 +1,187 @@
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .utils import get_data_store, get_phoneme_inventory, register_derived
+from .feature_matrix import FeatureMatrix, get_feature_matrix
+from .segment_index import get_segment_index
+
+SONORITY_CLASSES = ('stop', 'fricative', 'nasal', 'liquid', 'glide', 'vowel')
+STOP, FRICATIVE, NASAL, LIQUID, GLIDE, VOWEL = range(len(SONORITY_CLASSES))
+
+DEFAULT_MAX_ONSET = 3
+DEFAULT_MIN_SONORITY_DISTANCE = 2
+
+def _positive(matrix: FeatureMatrix, codes: np.ndarray, feature: str, anywhere: bool = False) -> np.ndarray:
+    # Contour values ('-,+' for an affricate's continuant) count by their
+    # first phase, or by any phase when ``anywhere`` is set.
+    plus = np.array([value.startswith('+') or (anywhere and '+' in value) for value in matrix.values])
+    return plus[codes[..., matrix.feature_index[feature]]]
+
+def sonority_classes(matrix: FeatureMatrix, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sonority class and syllabicity for each row of ``codes``.
+
+    Vowels and syllabic consonants are nuclei; consonants rank, from least
+    to most sonorous, as stops and affricates, fricatives, nasals, liquids
+    and glides.
+    """
+    syllabic = _positive(matrix, codes, 'syllabic', anywhere=True)
+    sonorant = _positive(matrix, codes, 'sonorant')
+    approximant = _positive(matrix, codes, 'approximant')
+    consonantal = _positive(matrix, codes, 'consonantal')
+    sonority = np.select(
+        [syllabic & ~consonantal, approximant & ~consonantal, approximant | (sonorant & ~_positive(matrix, codes, 'nasal')),
+         _positive(matrix, codes, 'nasal'), _positive(matrix, codes, 'continuant')],
+        [VOWEL, GLIDE, LIQUID, NASAL, FRICATIVE],
+        STOP,
+    ).astype(np.int8)
+    return sonority, syllabic
+
+register_derived('sonority_table', ('phoneme_features',))
+
+def get_sonority_table() -> Tuple[np.ndarray, np.ndarray]:
+    def build(store):
+        matrix = get_feature_matrix()
+        return sonority_classes(matrix, matrix.codes)
+    return get_data_store().derived('sonority_table', build)
+
+
+class Syllabifier:
+    """Splits words into onset/nucleus/coda syllables by sonority.
+
+    Every syllabic segment is a nucleus (a word without one uses its most
+    sonorous segment). Consonants between two nuclei go to the second
+    syllable's onset as long as sonority keeps rising towards the nucleus
+    by at least ``min_sonority_distance`` steps and the onset stays within
+    ``max_onset``; the rest is the first syllable's coda, capped at
+    ``max_coda``. Word-initial and word-final consonants always join the
+    first onset and the last coda.
+    """
+
+    def __init__(self, max_onset: int = DEFAULT_MAX_ONSET, max_coda: Optional[int] = None,
+                 min_sonority_distance: int = DEFAULT_MIN_SONORITY_DISTANCE, segments: Sequence[str] = ()):
+        self.max_onset = max_onset
+        self.max_coda = max_onset if max_coda is None else max_coda
+        self.min_sonority_distance = min_sonority_distance
+        self.matrix = get_feature_matrix()
+        self.sonority_table = get_sonority_table()
+        self._segments: Dict[str, Tuple[int, bool]] = {}
+        if segments:
+            self._precompute(list(segments))
+
+    @classmethod
+    def for_language(cls, language_code: str, language_prosody: Optional[Dict[str, Any]] = None) -> 'Syllabifier':
+        """Constraints from the language's prosodic data, else from its inventory.
+
+        Without explicit ``max_onset``/``max_coda``/``min_sonority_distance``
+        values, the longest onset is the longest chain of the inventory's
+        consonant sonority classes that rises by the minimum distance at
+        each step, and codas mirror it.
+        """
+        language_prosody = language_prosody or {}
+        inventory = get_phoneme_inventory(language_code)
+        distance = language_prosody.get('min_sonority_distance', DEFAULT_MIN_SONORITY_DISTANCE)
+        syllabifier = cls(segments=inventory, min_sonority_distance=distance)
+        classes = sorted({syllabifier.sonority(p) for p in inventory if not syllabifier.is_syllabic(p)})
+        chain = 0
+        last = None
+        for sonority in classes:
+            if last is None or sonority - last >= distance:
+                chain += 1
+                last = sonority
+        inferred = max(1, min(chain, DEFAULT_MAX_ONSET))
+        syllabifier.max_onset = language_prosody.get('max_onset', inferred)
+        syllabifier.max_coda = language_prosody.get('max_coda', inferred)
+        return syllabifier
+
+    def _precompute(self, segments: List[str]):
+        rows, found = self.matrix.rows(segments)
+        sonority, syllabic = self.sonority_table
+        known = set(found)
+        for segment, row in zip(found, rows.tolist()):
+            self._segments[segment] = (int(sonority[row]), bool(syllabic[row]))
+        unknown = [segment for segment in segments if segment not in known]
+        if unknown:
+            estimated, estimated_syllabic = sonority_classes(self.matrix, get_segment_index().vectors(unknown))
+            for segment, value, flag in zip(unknown, estimated.tolist(), estimated_syllabic.tolist()):
+                self._segments[segment] = (value, flag)
+
+    def _info(self, segment: str) -> Tuple[int, bool]:
+        info = self._segments.get(segment)
+        if info is None:
+            self._precompute([segment])
+            info = self._segments[segment]
+        return info
+
+    def sonority(self, segment: str) -> int:
+        return self._info(segment)[0]
+
+    def is_syllabic(self, segment: str) -> bool:
+        return self._info(segment)[1]
+
+    def syllabify(self, word: Sequence[str]) -> List[Dict[str, List[str]]]:
+        return self.syllabify_many([word])[0]
+
+    def syllabify_many(self, words: Sequence[Sequence[str]]) -> List[List[Dict[str, List[str]]]]:
+        flat = [segment for word in words for segment in word]
+        missing = [segment for segment in dict.fromkeys(flat) if segment not in self._segments]
+        if missing:
+            self._precompute(missing)
+        info = self._segments
+        sonority = [info[segment][0] for segment in flat]
+        offsets = np.zeros(len(words) + 1, dtype=np.intp)
+        np.cumsum([len(word) for word in words], out=offsets[1:])
+        # Nuclei for the whole batch at once, then grouped by word.
+        nuclei = np.flatnonzero(np.fromiter((info[segment][1] for segment in flat), dtype=bool, count=len(flat)))
+        bounds = np.searchsorted(nuclei, offsets).tolist()
+        offsets = offsets.tolist()
+
+        result = []
+        for w, word in enumerate(words):
+            start, stop = offsets[w], offsets[w + 1]
+            if start == stop:
+                result.append([])
+                continue
+            peaks = [n - start for n in nuclei[bounds[w]:bounds[w + 1]].tolist()]
+            if not peaks:
+                local = sonority[start:stop]
+                peaks = [local.index(max(local))]
+            result.append(self._split(list(word), sonority[start:stop], peaks))
+        return result
+
+    def _split(self, word: List[str], sonority: List[int], peaks: List[int]) -> List[Dict[str, List[str]]]:
+        # Each syllable starts at ``onset_starts[i]`` and ends just before the next.
+        onset_starts = [0]
+        for previous, peak in zip(peaks, peaks[1:]):
+            onset = peak
+            while peak - onset < self.max_onset and onset - 1 > previous:
+                candidate = onset - 1
+                upper = sonority[peak] if onset == peak else sonority[onset]
+                if upper - sonority[candidate] < (1 if onset == peak else self.min_sonority_distance):
+                    break
+                onset = candidate
+            # Consonants the coda cannot hold are pushed into the onset.
+            onset = min(onset, previous + 1 + self.max_coda)
+            onset_starts.append(onset)
+        onset_starts.append(len(word))
+
+        syllables = []
+        for i, peak in enumerate(peaks):
+            syllables.append({
+                'onset': word[onset_starts[i]:peak],
+                'nucleus': [word[peak]],
+                'coda': word[peak + 1:onset_starts[i + 1]],
+            })
+        return syllables
+
+
+register_derived('syllabifiers', ('language_phonemes', 'phoneme_features', 'prosodic_features'), per_language=True)
+
+def get_syllabifier(language_code: Optional[str] = None, language_prosody: Optional[Dict[str, Any]] = None) -> Syllabifier:
+    syllabifiers = get_data_store().derived('syllabifiers', lambda store: {})
+    syllabifier = syllabifiers.get(language_code)
+    if syllabifier is None:
+        if language_code is None:
+            syllabifier = Syllabifier()
+        else:
+            syllabifier = Syllabifier.for_language(language_code, language_prosody)
+        syllabifiers[language_code] = syllabifier
+    return syllabifier
@@ -8,11 +8,14 @@ from core.utils import (
     language_phonemes, language_allophones, prosodic_features, phoneme_features
 )
 
+ENGLISH_GLOTTOCODE = 'stan1293'
+SPANISH_GLOTTOCODE = 'stan1288'
+
 class TestUtils(unittest.TestCase):
     def test_load_json(self):
         data = load_json(get_data_file_path('language_inventories/language_phonemes.json'))
         self.assertIsInstance(data, dict)
-        self.assertIn('eng', data)
+        self.assertIn(ENGLISH_GLOTTOCODE, data)
 
     def test_get_data_file_path(self):
         path = get_data_file_path('test.json')
@@ -23,10 +26,10 @@ class TestUtils(unittest.TestCase):
         features = get_phoneme_features(phoneme_inventory, 'phoneme_features/phoneme_features.json')
         self.assertIsInstance(features, dict)
         self.assertIn('p', features)
-        self.assertIn('place', features['p'])
+        self.assertIn('labial', features['p'])
 
     def test_get_phoneme_inventory(self):
-        inventory = get_phoneme_inventory('eng')
+        inventory = get_phoneme_inventory(ENGLISH_GLOTTOCODE)
         self.assertIsInstance(inventory, list)
         self.assertIn('p', inventory)
 
@@ -35,9 +38,9 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(regex, 'p\\*')
 
     def test_phoneme_tokenizer(self):
-        tokenizer = PhonemeTokenizer('eng')
-        tokens = tokenizer.tokenize('pɪg')
-        self.assertEqual(tokens, ['p', 'ɪ', 'g'])
+        tokenizer = PhonemeTokenizer(ENGLISH_GLOTTOCODE)
+        tokens = tokenizer.tokenize('pɪɡ')
+        self.assertEqual(tokens, ['p', 'ɪ', 'ɡ'])
 
     def test_global_data_loaded(self):
         self.assertIsInstance(language_phonemes, dict)
@@ -50,7 +53,7 @@ class TestFeatureAnalyzer(unittest.TestCase):
         self.analyzer = FeatureAnalyzer()
 
     def test_get_language_features(self):
-        features = self.analyzer.get_language_features('eng')
+        features = self.analyzer.get_language_features(ENGLISH_GLOTTOCODE)
         self.assertIsInstance(features, dict)
         self.assertIn('p', features)
 
@@ -58,45 +61,45 @@ class TestFeatureAnalyzer(unittest.TestCase):
         similar, different = self.analyzer.compare_phonemes('p', 'b')
         self.assertIsInstance(similar, list)
         self.assertIsInstance(different, list)
-        self.assertIn('place', similar)
-        self.assertIn('voice', different)
+        self.assertIn('labial', similar)
+        self.assertIn('periodicGlottalSource', different)
 
     def test_find_similar_phonemes(self):
-        similar = self.analyzer.find_similar_phonemes('θ', 'eng')
+        similar = self.analyzer.find_similar_phonemes('θ', ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
         self.assertIsInstance(similar, list)
         self.assertTrue(all(isinstance(x, tuple) and len(x) == 2 for x in similar))
 
     def test_analyze_language_inventory(self):
-        analysis = self.analyzer.analyze_language_inventory('eng')
+        analysis = self.analyzer.analyze_language_inventory(ENGLISH_GLOTTOCODE)
         self.assertIsInstance(analysis, dict)
-        self.assertIn('place', analysis)
+        self.assertIn('labial', analysis)
 
 class TestPhonemeConverter(unittest.TestCase):
     def setUp(self):
         self.converter = PhonemeConverter()
 
     def test_convert_phoneme(self):
-        converted = self.converter.convert_phoneme('θ', 'eng', 'spa')
+        converted = self.converter.convert_phoneme('θ', ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
         self.assertIsInstance(converted, str)
 
     def test_convert_word(self):
         word = ['θ', 'ɪ', 'ŋ', 'k']
-        converted = self.converter.convert_word(word, 'eng', 'spa')
+        converted = self.converter.convert_word(word, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
         self.assertIsInstance(converted, list)
         self.assertEqual(len(converted), len(word))
 
     def test_apply_prosody(self):
         phonemes = ['θ', 'ɪ', 'ŋ', 'k']
-        prosody = self.converter.apply_prosody(phonemes, 'eng')
+        prosody = self.converter.apply_prosody(phonemes, ENGLISH_GLOTTOCODE)
         self.assertIsInstance(prosody, list)
-        self.assertEqual(len(prosody), len(phonemes))
+        self.assertEqual(len(prosody), 1)
 
     def test_analyze_syllable_structure(self):
         phonemes = ['θ', 'ɪ', 'ŋ', 'k']
         language_prosody = {}
         syllables = self.converter.analyze_syllable_structure(phonemes, language_prosody)
         self.assertIsInstance(syllables, list)
-        self.assertEqual(len(syllables), len(phonemes))
+        self.assertEqual(len(syllables), 1)
 
     def test_apply_stress_pattern(self):
         syllables = [{'onset': [], 'nucleus': ['a'], 'coda': []}]
@@ -112,11 +115,11 @@ class TestPhonemeConverter(unittest.TestCase):
 
     def test_convert_word_with_prosody(self):
         word = ['θ', 'ɪ', 'ŋ', 'k']
-        converted, prosody = self.converter.convert_word_with_prosody(word, 'eng', 'spa')
+        converted, prosody = self.converter.convert_word_with_prosody(word, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
         self.assertIsInstance(converted, list)
         self.assertIsInstance(prosody, list)
         self.assertEqual(len(converted), len(word))
-        self.assertEqual(len(prosody), len(word))
+        self.assertEqual(len(prosody), 1)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
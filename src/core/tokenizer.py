@@ -0,0 +1,81 @@
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+UNMATCHED_POLICIES = ('emit', 'skip', 'raise')
+
+# Children are keyed by single characters, so the empty string can never
+# collide with one and marks the segment that ends at a node.
+_END = ''
+
+class UnmatchedSegmentError(ValueError):
+    def __init__(self, text: str, start: int, end: int):
+        self.text = text
+        self.start = start
+        self.end = end
+        super().__init__(f"No phoneme matches {text[start:end]!r} at position {start} of {text!r}")
+
+
+class PhonemeTrie:
+    """Longest-match tokenizer over a phoneme inventory.
+
+    Segments and input are both compared in NFD, so precomposed and
+    decomposed spellings of the same segment match; tokens are returned in
+    the inventory's own spelling. Each match walks at most as many
+    characters as the longest segment, so tokenizing is linear in the
+    input length.
+    """
+
+    def __init__(self, segments: Iterable[str]):
+        self.root: Dict[str, dict] = {}
+        self.segments: List[str] = []
+        for segment in segments:
+            if not segment:
+                continue
+            node = self.root
+            for char in unicodedata.normalize('NFD', segment):
+                node = node.setdefault(char, {})
+            if _END not in node:
+                node[_END] = segment
+                self.segments.append(segment)
+        self.segments.sort(key=len, reverse=True)
+
+    def longest_match(self, text: str, pos: int) -> Tuple[int, Optional[str]]:
+        node = self.root
+        end, segment = -1, None
+        for i in range(pos, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if _END in node:
+                end, segment = i + 1, node[_END]
+        return end, segment
+
+    def tokenize(self, text: str, unmatched: str = 'skip') -> List[str]:
+        if unmatched not in UNMATCHED_POLICIES:
+            raise ValueError(f"Unknown unmatched policy '{unmatched}', expected one of {UNMATCHED_POLICIES}")
+
+        text = unicodedata.normalize('NFD', text)
+        tokens = []
+        pos, n = 0, len(text)
+        unmatched_start = -1
+        while pos < n:
+            end, segment = self.longest_match(text, pos)
+            if segment is None:
+                if unmatched_start < 0:
+                    unmatched_start = pos
+                pos += 1
+                continue
+            if unmatched_start >= 0:
+                self._unmatched(text, unmatched_start, pos, unmatched, tokens)
+                unmatched_start = -1
+            tokens.append(segment)
+            pos = end
+        if unmatched_start >= 0:
+            self._unmatched(text, unmatched_start, n, unmatched, tokens)
+        return tokens
+
+    def _unmatched(self, text: str, start: int, end: int, unmatched: str, tokens: List[str]):
+        if unmatched == 'emit':
+            tokens.append(text[start:end])
+        elif unmatched == 'raise':
+            raise UnmatchedSegmentError(text, start, end)
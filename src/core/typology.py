@@ -0,0 +1,304 @@
+import argparse
+import logging
+import os
+import re
+import unicodedata
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+from .utils import DataStore, atomic_write, get_data_store, get_cache_path, register_derived
+from .feature_matrix import get_feature_matrix
+from .segment_index import get_segment_index, _popcount
+from .rule_processor import RuleSyntaxError, parse_bundle
+
+logger = logging.getLogger(__name__)
+
+TYPOLOGY_DATASETS = ('language_phonemes', 'phoneme_features')
+QUERY_CACHE_SIZE = 1024
+_TOKEN = re.compile(r'\s*(\(|\)|&|\||!|~|\[[^\]]*\]|/[^/]+/|[^\s()&|!~]+)')
+_KEYWORDS = {'and': '&', 'or': '|', 'not': '!'}
+
+def default_typology_path() -> str:
+    return get_cache_path('typology.npz')
+
+class QuerySyntaxError(ValueError):
+    pass
+
+def _pack(rows: np.ndarray) -> np.ndarray:
+    """Packs the last axis of a boolean array into little-endian uint64 words."""
+    size = rows.shape[-1]
+    padded = np.zeros(rows.shape[:-1] + (-(-size // 64) * 64,), dtype=bool)
+    padded[..., :size] = rows
+    return np.packbits(padded, axis=-1, bitorder='little').view('<u8')
+
+
+class TypologyIndex:
+    """Bitsets of languages, one per segment and per feature value.
+
+    Bit ``i`` of a bitset stands for ``languages[i]``. A language is in a
+    segment's bitset when the segment is in its inventory. It is in the
+    bitset of a value such as ``raisedLarynxEjective=+`` when any of its
+    segments has that value. Queries combine bitsets with AND/OR/NOT, so
+    answering one touches a few dozen machine words instead of every
+    inventory.
+
+    Query syntax: segments (``θ`` or ``/θ/``), feature values
+    (``feature=value``), bundles that a single segment must match
+    (``[+consonantal,-sonorant]``), ``&``/``and``, ``|``/``or``,
+    ``!``/``~``/``not`` and parentheses.
+    """
+
+    def __init__(self, languages: Sequence[str], segments: Sequence[str], segment_bits: np.ndarray,
+                 segment_codes: np.ndarray, features: Sequence[str], values: Sequence[str],
+                 feature_bits: np.ndarray, version: str = ''):
+        self.languages = list(languages)
+        self.segments = list(segments)
+        self.segment_bits = segment_bits
+        self.segment_codes = segment_codes
+        self.features = list(features)
+        self.values = list(values)
+        self.feature_bits = feature_bits
+        self.version = version
+        self.language_index = {language: i for i, language in enumerate(self.languages)}
+        self.segment_index = {segment: i for i, segment in enumerate(self.segments)}
+        self.feature_index = {feature: i for i, feature in enumerate(self.features)}
+        self.value_index = {value: i for i, value in enumerate(self.values)}
+        self.n_words = segment_bits.shape[-1]
+        self.all_bits = _pack(np.ones(len(self.languages), dtype=bool))
+        self.empty_bits = np.zeros(self.n_words, dtype=np.uint64)
+        self._compiled: Dict[str, tuple] = {}
+
+    @classmethod
+    def build(cls, language_phonemes: Optional[Dict[str, List[str]]] = None,
+              store: Optional[DataStore] = None) -> 'TypologyIndex':
+        store = store or get_data_store()
+        language_phonemes = store.language_phonemes if language_phonemes is None else language_phonemes
+        matrix = get_feature_matrix(store)
+        languages = sorted(language_phonemes)
+        segment_ids: Dict[str, int] = {}
+        pairs = []
+        for i, language in enumerate(languages):
+            for segment in language_phonemes[language]:
+                pairs.append((i, segment_ids.setdefault(segment, len(segment_ids))))
+        segments = list(segment_ids)
+
+        incidence = np.zeros((len(segments), len(languages)), dtype=bool)
+        if pairs:
+            language_rows, segment_rows = np.array(pairs, dtype=np.intp).T
+            incidence[segment_rows, language_rows] = True
+        # Segments missing from the features database get estimated vectors.
+        codes = get_segment_index(store).vectors(segments) if segments else np.zeros((0, len(matrix.features)), dtype=np.int8)
+
+        # has[f, v, language]: some segment of the language has value v for f.
+        weights = incidence.T.astype(np.float32)
+        has = np.zeros((len(matrix.features), len(matrix.values), len(languages)), dtype=bool)
+        for f in range(len(matrix.features)):
+            one_hot = (codes[:, f][:, None] == np.arange(len(matrix.values))).astype(np.float32)
+            has[f] = (weights @ one_hot).T > 0
+        return cls(languages, segments, _pack(incidence), np.asarray(codes, dtype=np.int8),
+                   matrix.features, matrix.values, _pack(has), store.data_version(TYPOLOGY_DATASETS))
+
+    def save(self, path: Optional[str] = None) -> str:
+        path = path or default_typology_path()
+        with atomic_write(path) as f:
+            np.savez(f, languages=np.array(self.languages), segments=np.array(self.segments),
+                     segment_bits=self.segment_bits, segment_codes=self.segment_codes,
+                     features=np.array(self.features), values=np.array(self.values),
+                     feature_bits=self.feature_bits, version=np.array(self.version))
+        return path
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'TypologyIndex':
+        with np.load(path or default_typology_path(), allow_pickle=False) as data:
+            return cls(data['languages'].tolist(), data['segments'].tolist(), data['segment_bits'],
+                       data['segment_codes'], data['features'].tolist(), data['values'].tolist(),
+                       data['feature_bits'], str(data['version']))
+
+    def _segment(self, segment: str) -> np.ndarray:
+        for form in (segment, unicodedata.normalize('NFD', segment), unicodedata.normalize('NFC', segment)):
+            i = self.segment_index.get(form)
+            if i is not None:
+                return self.segment_bits[i]
+        return self.empty_bits
+
+    def _feature_value(self, feature: str, value: str) -> np.ndarray:
+        if feature not in self.feature_index:
+            raise QuerySyntaxError(f"Unknown feature '{feature}'")
+        if value not in self.value_index:
+            raise QuerySyntaxError(f"Unknown value '{value}' for feature '{feature}'")
+        return self.feature_bits[self.feature_index[feature], self.value_index[value]]
+
+    def _bundle(self, token: str) -> np.ndarray:
+        try:
+            bundle = parse_bundle(token)
+        except RuleSyntaxError as e:
+            raise QuerySyntaxError(str(e)) from None
+        match = np.ones(len(self.segments), dtype=bool)
+        for feature, value in bundle:
+            match &= self.segment_codes[:, self.feature_index[feature]] == self.value_index[value]
+        if not match.any():
+            return self.empty_bits
+        return np.bitwise_or.reduce(self.segment_bits[match], axis=0)
+
+    def compile(self, query: str) -> tuple:
+        """Parses ``query`` into a tree of operators over bitsets; cached."""
+        compiled = self._compiled.get(query)
+        if compiled is None:
+            tokens = _tokenize(query)
+            compiled, position = self._parse_or(tokens, 0)
+            if position != len(tokens):
+                raise QuerySyntaxError(f"Unexpected '{tokens[position]}' in query '{query}'")
+            if len(self._compiled) >= QUERY_CACHE_SIZE:
+                self._compiled.clear()
+            self._compiled[query] = compiled
+        return compiled
+
+    def _parse_or(self, tokens: List[str], position: int) -> Tuple[tuple, int]:
+        node, position = self._parse_and(tokens, position)
+        operands = [node]
+        while position < len(tokens) and tokens[position] == '|':
+            node, position = self._parse_and(tokens, position + 1)
+            operands.append(node)
+        return (operands[0] if len(operands) == 1 else ('or', operands)), position
+
+    def _parse_and(self, tokens: List[str], position: int) -> Tuple[tuple, int]:
+        node, position = self._parse_not(tokens, position)
+        operands = [node]
+        while position < len(tokens) and tokens[position] == '&':
+            node, position = self._parse_not(tokens, position + 1)
+            operands.append(node)
+        return (operands[0] if len(operands) == 1 else ('and', operands)), position
+
+    def _parse_not(self, tokens: List[str], position: int) -> Tuple[tuple, int]:
+        if position >= len(tokens):
+            raise QuerySyntaxError("Unexpected end of query")
+        token = tokens[position]
+        if token == '!':
+            node, position = self._parse_not(tokens, position + 1)
+            return ('not', node), position
+        if token == '(':
+            node, position = self._parse_or(tokens, position + 1)
+            if position >= len(tokens) or tokens[position] != ')':
+                raise QuerySyntaxError("Missing ')'")
+            return node, position + 1
+        if token in (')', '&', '|'):
+            raise QuerySyntaxError(f"Unexpected '{token}'")
+        if token.startswith('['):
+            return ('bits', self._bundle(token)), position + 1
+        if '=' in token:
+            return ('bits', self._feature_value(*token.split('=', 1))), position + 1
+        if len(token) > 2 and token[0] == token[-1] == '/':
+            token = token[1:-1]
+        return ('bits', self._segment(token)), position + 1
+
+    def _evaluate(self, node: tuple) -> np.ndarray:
+        kind, operand = node
+        if kind == 'bits':
+            return operand
+        if kind == 'not':
+            return ~self._evaluate(operand) & self.all_bits
+        result = self._evaluate(operand[0])
+        combine = np.bitwise_and if kind == 'and' else np.bitwise_or
+        for child in operand[1:]:
+            result = combine(result, self._evaluate(child))
+        return result
+
+    def bits(self, query: str) -> np.ndarray:
+        return self._evaluate(self.compile(query))
+
+    def mask(self, query: str) -> np.ndarray:
+        """Boolean array over ``languages``."""
+        return np.unpackbits(self.bits(query).view(np.uint8), bitorder='little', count=len(self.languages)).astype(bool)
+
+    def query(self, query: str) -> List[str]:
+        languages = self.languages
+        return [languages[i] for i in np.flatnonzero(self.mask(query)).tolist()]
+
+    def count(self, query: str) -> int:
+        return int(_popcount(self.bits(query)))
+
+    def counts(self, queries: Sequence[str]) -> Dict[str, int]:
+        return {query: self.count(query) for query in queries}
+
+    def segment_counts(self, query: Optional[str] = None, top: Optional[int] = None) -> List[Tuple[str, int]]:
+        """How many of the matching languages have each segment, most frequent first."""
+        bits = self.all_bits if query is None else self.bits(query)
+        counts = _popcount(self.segment_bits & bits)
+        order = np.argsort(-counts, kind='stable')
+        order = order[counts[order] > 0][:top]
+        return [(self.segments[i], int(counts[i])) for i in order.tolist()]
+
+    def feature_counts(self, query: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """How many of the matching languages have each value of each feature."""
+        bits = self.all_bits if query is None else self.bits(query)
+        counts = _popcount(self.feature_bits & bits)
+        return {
+            feature: {value: int(counts[f, v]) for v, value in enumerate(self.values) if counts[f, v]}
+            for f, feature in enumerate(self.features)
+        }
+
+def _tokenize(query: str) -> List[str]:
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None:
+            raise QuerySyntaxError(f"Cannot parse query '{query}'")
+        token = match.group(1)
+        tokens.append(_KEYWORDS.get(token.lower(), '!' if token == '~' else token))
+        position = match.end()
+    return tokens
+
+def _load_index(store, path: Optional[str] = None) -> TypologyIndex:
+    if path is None:
+        if not store.reads_default_files(TYPOLOGY_DATASETS):
+            # Other data files never share the default cache.
+            return TypologyIndex.build(store=store)
+        path = default_typology_path()
+    version = store.data_version(TYPOLOGY_DATASETS)
+    if os.path.exists(path):
+        try:
+            index = TypologyIndex.load(path)
+        except Exception as e:
+            # Includes zipfile.BadZipFile from a truncated file; rebuilt below.
+            logger.warning("Ignoring typology index %s: %s", path, e)
+        else:
+            if index.version == version:
+                return index
+    index = TypologyIndex.build(store=store)
+    try:
+        index.save(path)
+    except OSError as e:
+        logger.warning("Could not cache the typology index at %s: %s", path, e)
+    return index
+
+register_derived('typology_index', ('language_phonemes', 'phoneme_features'))
+
+def get_typology_index() -> TypologyIndex:
+    return get_data_store().derived('typology_index', _load_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query languages by the segments and feature values in their inventories.")
+    parser.add_argument('query', nargs='?', help="e.g. 'θ & ð & !s' or 'raisedLarynxEjective=+'")
+    parser.add_argument('--count', action='store_true', help="Print only the number of matching languages")
+    parser.add_argument('--segments', type=int, metavar='N', help="Print the N most common segments among the matches")
+    parser.add_argument('--build', action='store_true', help="Rebuild the on-disk index")
+    args = parser.parse_args()
+    if args.build:
+        index = TypologyIndex.build()
+        print(index.save())
+    else:
+        index = get_typology_index()
+    if args.query is None:
+        return
+    if args.count:
+        print(index.count(args.query))
+    elif args.segments:
+        for segment, count in index.segment_counts(args.query, args.segments):
+            print(f"{segment}\t{count}")
+    else:
+        print('\n'.join(index.query(args.query)))
+
+if __name__ == '__main__':
+    main()
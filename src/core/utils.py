@@ -1,7 +1,31 @@
+import hashlib
 import json
+import logging
 import os
-import re
-from typing import Dict, List, Any
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, FrozenSet, Hashable, IO, Iterator, List, Any, Callable, Iterable, Optional, Sequence, Set, Tuple
+from .tokenizer import PhonemeTrie, UNMATCHED_POLICIES
+from .instrumentation import metrics, RateLimitedLogger
+
+logger = logging.getLogger(__name__)
+_rate_limited_logger = RateLimitedLogger(logger)
+
+DATASET_FILES = {
+    'language_phonemes': 'language_inventories/language_phonemes.json',
+    'language_allophones': 'language_inventories/language_allophones.json',
+    'prosodic_features': 'language_inventories/prosodic_features.json',
+    'phoneme_features': 'phoneme_features/phoneme_features.json',
+}
+DEFAULT_BINARY_FILE = 'compiled/phoible.kbin'
+# Datasets keyed by glottocode, whose changes can be traced to single languages.
+LANGUAGE_DATASETS = ('language_phonemes', 'language_allophones', 'prosodic_features')
+# Reloads remembered for ``DataStore.changes_since``.
+MAX_CHANGES = 64
+
+_UNSET = object()
 
 def load_json(file_path: str) -> Dict:
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -10,8 +34,436 @@ def load_json(file_path: str) -> Dict:
 def get_data_file_path(file_name: str) -> str:
     return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', file_name)
 
-def get_phoneme_features(phoneme_inventory: List[str], phoneme_features_file: str) -> Dict[str, Dict[str, str]]:
-    all_phoneme_features = load_json(get_data_file_path(phoneme_features_file))
+# Directory of the on-disk caches; None means data/cache. See set_cache_dir.
+_cache_dir: Optional[str] = None
+
+def get_cache_path(file_name: str) -> str:
+    return os.path.join(_cache_dir or get_data_file_path('cache'), file_name)
+
+def set_cache_dir(path: Optional[str]) -> Optional[str]:
+    """Moves the default caches (tree, typology, tables, ...) to ``path``; returns the previous setting."""
+    global _cache_dir
+    previous, _cache_dir = _cache_dir, path
+    return previous
+
+def _update_digest(digest: Any, path: str):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+def file_digest(path: str, name: str = '') -> str:
+    """sha256 of ``name`` followed by the file's content."""
+    digest = hashlib.sha256(name.encode('utf-8'))
+    _update_digest(digest, path)
+    return digest.hexdigest()
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb', **kwargs) -> Iterator[IO]:
+    """Writes through a temporary file in the same directory that replaces ``path`` on success."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+_data_versions: Dict[Tuple[str, ...], str] = {}
+
+def data_version(file_names: Sequence[str]) -> str:
+    key = tuple(file_names)
+    if key not in _data_versions:
+        digest = hashlib.sha256()
+        for file_name in key:
+            digest.update(file_name.encode('utf-8'))
+            _update_digest(digest, get_data_file_path(file_name))
+        _data_versions[key] = digest.hexdigest()
+    return _data_versions[key]
+
+def _forget_data_versions(file_names: Iterable[str]):
+    file_names = set(file_names)
+    for key in list(_data_versions):
+        if file_names.intersection(key):
+            _data_versions.pop(key, None)
+
+# Datasets each derived cache is built from; see ``register_derived``.
+_derived_dependencies: Dict[str, FrozenSet[str]] = {}
+_per_language_caches: Set[str] = set()
+
+def register_derived(name: str, datasets: Iterable[str], per_language: bool = False):
+    """Declares which datasets the derived cache ``name`` is built from.
+
+    ``DataStore.reload`` keeps a cache when none of its datasets changed.
+    A ``per_language`` cache is a dict keyed by language code (or by tuples
+    containing codes) and only loses the entries of changed languages.
+    Unregistered caches are dropped on every reload.
+    """
+    _derived_dependencies[name] = frozenset(datasets)
+    if per_language:
+        _per_language_caches.add(name)
+    else:
+        _per_language_caches.discard(name)
+
+def _key_codes(key: Any) -> List[str]:
+    return [code for code in (key if isinstance(key, tuple) else (key,)) if isinstance(code, str)]
+
+class LRUCache:
+    """A thread-safe memo that keeps the ``max_size`` most recently used entries.
+
+    For results keyed by user input (unseen segments, words), which would
+    otherwise grow without bound in a long-running process.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._entries.get(key, _UNSET)
+            if value is _UNSET:
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> Any:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+
+class DataChange:
+    """What one or more ``DataStore.reload`` calls changed.
+
+    ``languages`` holds the glottocodes whose inventory, allophones or
+    prosody changed, or None when the change (e.g. to segment features)
+    affects every language. ``resolution_changed`` is set when languages
+    were added or removed, which can move ISO codes and dialects to
+    another inventory.
+    """
+
+    def __init__(self, generation: int, files: Iterable[str], datasets: Iterable[str],
+                 languages: Optional[Iterable[str]], resolution_changed: bool = False):
+        self.generation = generation
+        self.files = frozenset(files)
+        self.datasets = frozenset(datasets)
+        self.languages = None if languages is None else frozenset(languages)
+        self.resolution_changed = resolution_changed
+
+    def merge(self, later: 'DataChange') -> 'DataChange':
+        languages = None if self.languages is None or later.languages is None else self.languages | later.languages
+        return DataChange(later.generation, self.files | later.files, self.datasets | later.datasets, languages,
+                          self.resolution_changed or later.resolution_changed)
+
+    def affects(self, code: Optional[str], resolve: Optional[Callable[[str], Optional[str]]] = None) -> bool:
+        """Whether data served for ``code`` (a glottocode or ISO code) may have changed."""
+        if self.languages is None:
+            return True
+        if code is None:
+            return False
+        if code in self.languages:
+            return True
+        if resolve is None:
+            from .glottolog import resolve_language_code as resolve
+        resolved = resolve(code)
+        if resolved == code:
+            return False
+        return self.resolution_changed or resolved in self.languages
+
+    def __repr__(self) -> str:
+        languages = 'all' if self.languages is None else len(self.languages)
+        return f"DataChange(generation={self.generation}, datasets={sorted(self.datasets)}, languages={languages})"
+
+
+class DataStore:
+    """Loads each data file at most once, on first access.
+
+    A missing file is logged and read as an empty dataset so that importing
+    the package never depends on every optional dataset being present.
+    Structures derived from the datasets (feature matrix, tokenizers, ...)
+    are cached alongside them through ``derived``.
+
+    When a compiled binary data file is present and up to date with the
+    JSON sources, the inventories, allophones and features are served from
+    it instead (see ``core.binary_data``).
+
+    ``reload`` picks up data files edited in place: only changed files are
+    parsed again, and only the derived structures built from them are
+    dropped. ``generation`` counts the reloads that changed something.
+    """
+
+    def __init__(self, dataset_files: Optional[Dict[str, str]] = None, binary_path: Optional[str] = DEFAULT_BINARY_FILE):
+        self.dataset_files = dict(DATASET_FILES, **(dataset_files or {}))
+        if binary_path and not os.path.isabs(binary_path):
+            binary_path = get_data_file_path(binary_path)
+        self.binary_path = binary_path
+        self._binary: Any = _UNSET
+        self._files: Dict[str, Any] = {}
+        self._derived: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        # file name -> (size, mtime_ns, sha256) of what was loaded, None if missing
+        self._states: Dict[str, Optional[Tuple[int, int, str]]] = {}
+        self._changes: Tuple[DataChange, ...] = ()
+        self.generation = 0
+
+    @classmethod
+    def from_binary(cls, dataset: Any, dataset_files: Optional[Dict[str, str]] = None) -> 'DataStore':
+        """A store served from an already opened ``BinaryDataset`` (e.g. in shared memory)."""
+        store = cls(dataset_files, binary_path=None)
+        store._binary = dataset
+        return store
+
+    @property
+    def binary(self) -> Any:
+        if self._binary is _UNSET:
+            with self._lock:
+                if self._binary is _UNSET:
+                    self._binary = self._open_binary()
+        return self._binary
+
+    def _open_binary(self) -> Any:
+        if not self.binary_path or not os.path.exists(self.binary_path):
+            return None
+        from .binary_data import BinaryDataset
+        try:
+            dataset = BinaryDataset(self.binary_path)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring compiled data file %s: %s", self.binary_path, e)
+            return None
+        if not dataset.is_current(self.dataset_files):
+            logger.warning("Compiled data file %s is out of date; reading the JSON sources", self.binary_path)
+            dataset.close()
+            return None
+        return dataset
+
+    def get_file(self, file_name: str) -> Any:
+        data = self._files.get(file_name)
+        if data is None:
+            with self._lock:
+                data = self._files.get(file_name)
+                if data is None:
+                    data = self._files[file_name] = self._load(file_name)
+        return data
+
+    def get(self, name: str) -> Any:
+        return self.get_file(self.dataset_files[name])
+
+    def derived(self, name: str, factory: Callable[['DataStore'], Any]) -> Any:
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    metrics.increment('derived_cache_requests', cache=name, result='miss')
+                    with metrics.stage('derived_build', cache=name):
+                        value = self._derived[name] = factory(self)
+                    return value
+        if metrics.enabled:
+            metrics.increment('derived_cache_requests', cache=name, result='hit')
+        return value
+
+    def data_version(self, names: Sequence[str]) -> str:
+        """``data_version`` of the files this store reads for the datasets ``names``."""
+        return data_version([self.dataset_files[name] for name in names])
+
+    def reads_default_files(self, names: Sequence[str]) -> bool:
+        """Whether the datasets ``names`` come from the default files, whose caches are shared."""
+        return all(self.dataset_files[name] == DATASET_FILES[name] for name in names)
+
+    def is_loaded(self, name: str) -> bool:
+        return self.dataset_files.get(name, name) in self._files
+
+    def _load(self, file_name: str) -> Any:
+        with metrics.stage('data_load', file=file_name):
+            binary = self.binary
+            if binary is not None:
+                for name, dataset_file in self.dataset_files.items():
+                    if dataset_file == file_name and name in binary.datasets:
+                        source = binary.meta['sources'][name]
+                        self._states[file_name] = (source['size'], source['mtime_ns'], source['sha256'])
+                        metrics.increment('data_loads', file=file_name, source='binary')
+                        return binary.dataset(name)
+            data, self._states[file_name] = self._read_json(file_name)
+            return data
+
+    def _read_json(self, file_name: str) -> Tuple[Any, Optional[Tuple[int, int, str]]]:
+        path = get_data_file_path(file_name)
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                raw = f.read()
+        except FileNotFoundError:
+            logger.warning("Data file %s not found; using an empty dataset", path, extra={'data_file': path})
+            metrics.increment('data_loads', file=file_name, source='missing')
+            return {}, None
+        data = json.loads(raw.decode('utf-8'))
+        metrics.increment('data_loads', file=file_name, source='json')
+        return data, (stat.st_size, stat.st_mtime_ns, hashlib.sha256(raw).hexdigest())
+
+    def changed_files(self) -> List[str]:
+        """Loaded files whose content changed since they were read.
+
+        Size and mtime are checked first and the content hash only when they
+        differ, so touching a file does not count as a change. Files that
+        have disappeared keep their loaded data.
+        """
+        changed = []
+        for file_name, state in list(self._states.items()):
+            path = get_data_file_path(file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if state is None:
+                changed.append(file_name)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == state[:2]:
+                continue
+            sha256 = file_digest(path) if stat.st_size == state[0] else None
+            if sha256 == state[2]:
+                self._states[file_name] = (stat.st_size, stat.st_mtime_ns, sha256)
+            else:
+                changed.append(file_name)
+        return changed
+
+    def reload(self) -> Optional[DataChange]:
+        """Re-reads changed data files and drops what was derived from them.
+
+        The files are parsed before anything is replaced; the new datasets
+        and caches are then swapped in with single assignments. Readers
+        never wait on a reload: they see the old data or the new. Returns
+        None when no file changed.
+        """
+        with self._reload_lock:
+            changed = self.changed_files()
+            if not changed:
+                return None
+            loaded = {file_name: self._read_json(file_name) for file_name in changed}
+            with self._lock:
+                change = self._describe_change(loaded)
+                files = dict(self._files)
+                for file_name, (data, state) in loaded.items():
+                    files[file_name] = data
+                    self._states[file_name] = state
+                derived = self._surviving_derived(change)
+                binary = self._binary
+                if binary is not _UNSET and binary is not None and not change.datasets.isdisjoint(binary.meta['sources']):
+                    # Datasets already served from it stay valid views.
+                    self._binary = None
+                # Files first, so that nothing derived from the old files
+                # lands in the new caches.
+                self._files = files
+                self._derived = derived
+                self._changes = self._changes[-(MAX_CHANGES - 1):] + (change,)
+                self.generation = change.generation
+            _forget_data_versions(changed)
+            logger.info("Reloaded %s (%r)", ', '.join(changed), change)
+            metrics.increment('data_reloads', len(changed))
+            return change
+
+    def _describe_change(self, loaded: Dict[str, Tuple[Any, Any]]) -> DataChange:
+        datasets = [name for name, file_name in self.dataset_files.items() if file_name in loaded]
+        languages: Optional[Set[str]] = set()
+        resolution_changed = False
+        for name in datasets:
+            file_name = self.dataset_files[name]
+            old, new = self._files.get(file_name, {}), loaded[file_name][0]
+            if name not in LANGUAGE_DATASETS:
+                languages = None
+                continue
+            if name == 'language_phonemes' and old.keys() != new.keys():
+                resolution_changed = True
+            if languages is not None:
+                languages.update(code for code in old.keys() | new.keys() if old.get(code) != new.get(code))
+        return DataChange(self.generation + 1, loaded, datasets, languages, resolution_changed)
+
+    def _surviving_derived(self, change: DataChange) -> Dict[str, Any]:
+        # Codes in per-language caches resolve as they did before the change
+        # unless resolution_changed, in which case they count as affected.
+        tree = self._derived.get('languoid_tree')
+        resolve = tree.resolve if tree is not None else (lambda code: code)
+        derived = {}
+        for name, value in self._derived.items():
+            if name.startswith('dict:'):
+                dependencies = frozenset((name[len('dict:'):],))
+            else:
+                dependencies = _derived_dependencies.get(name)
+            if dependencies is None:
+                continue
+            if dependencies.isdisjoint(change.datasets):
+                derived[name] = value
+            elif name in _per_language_caches and change.languages is not None:
+                derived[name] = {key: entry for key, entry in list(value.items())
+                                 if not any(change.affects(code, resolve) for code in _key_codes(key))}
+        return derived
+
+    def changes_since(self, generation: int) -> Optional[DataChange]:
+        """All reloads after ``generation`` merged into one change; None if there were none."""
+        if generation >= self.generation:
+            return None
+        changes = [change for change in self._changes if change.generation > generation]
+        if len(changes) < self.generation - generation:
+            # Older than the remembered reloads: assume everything changed.
+            return DataChange(self.generation, self._states, self.dataset_files, None, True)
+        merged = changes[0]
+        for change in changes[1:]:
+            merged = merged.merge(change)
+        return merged
+
+    @property
+    def language_phonemes(self) -> Dict[str, List[str]]:
+        return self.get('language_phonemes')
+
+    @property
+    def language_allophones(self) -> Dict[str, Dict[str, List[str]]]:
+        return self.get('language_allophones')
+
+    @property
+    def prosodic_features(self) -> Dict[str, Dict[str, Any]]:
+        return self.get('prosodic_features')
+
+    @property
+    def phoneme_features(self) -> Dict[str, Dict[str, str]]:
+        return self.get('phoneme_features')
+
+_data_store: Optional[DataStore] = None
+_data_store_lock = threading.Lock()
+
+def get_data_store() -> DataStore:
+    global _data_store
+    if _data_store is None:
+        with _data_store_lock:
+            if _data_store is None:
+                _data_store = DataStore()
+    return _data_store
+
+def set_data_store(store: DataStore) -> DataStore:
+    global _data_store
+    _data_store = store
+    return store
+
+def get_phoneme_features(phoneme_inventory: List[str], phoneme_features_file: str, language_code: Optional[str] = None,
+                         store: Optional[DataStore] = None) -> Dict[str, Dict[str, str]]:
+    all_phoneme_features = (store or get_data_store()).get_file(phoneme_features_file)
     inventory_features = {}
     missing_phonemes = []
     
@@ -22,33 +474,81 @@ def get_phoneme_features(phoneme_inventory: List[str], phoneme_features_file: st
             missing_phonemes.append(phoneme)
     
     if missing_phonemes:
-        print(f"Warning: The following phonemes were not found in the features database: {', '.join(missing_phonemes)}")
+        language = language_code or 'unknown'
+        metrics.increment('missing_segments', len(missing_phonemes), language=language)
+        _rate_limited_logger.warning(('missing_segments', language), "%d phonemes of %s not found in the features database: %s",
+                                     len(missing_phonemes), language, ', '.join(missing_phonemes),
+                                     language_code=language, missing_segments=missing_phonemes)
     
     return inventory_features
 
-def get_phoneme_inventory(language_code: str) -> List[str]:
-    language_phonemes = load_json(get_data_file_path('language_inventories/language_phonemes.json'))
+def get_phoneme_inventory(language_code: str, store: Optional[DataStore] = None) -> List[str]:
+    language_phonemes = (store or get_data_store()).language_phonemes
     
     if language_code not in language_phonemes:
-        raise ValueError(f"Language code '{language_code}' not found in the phoneme database.")
-    
+        # ISO codes and dialects without an inventory of their own borrow
+        # the closest inventory in the Glottolog tree.
+        from .glottolog import resolve_language_code
+        resolved = resolve_language_code(language_code, store)
+        if resolved is None:
+            raise ValueError(f"Language code '{language_code}' not found in the phoneme database.")
+        language_code = resolved
+
     return language_phonemes[language_code]
 
 def ipa_to_regex(ipa_string: str) -> str:
     special_chars = r'[](){}?*+|^$.\\'
     return ''.join('\\' + char if char in special_chars else char for char in ipa_string)
 
+register_derived('phoneme_tries', ('language_phonemes', 'language_allophones'), per_language=True)
+
+def get_phoneme_trie(language_code: str, allophones: bool = False) -> PhonemeTrie:
+    store = get_data_store()
+    tries = store.derived('phoneme_tries', lambda store: {})
+    key = (language_code, allophones)
+    trie = tries.get(key)
+    if trie is None:
+        segments = list(get_phoneme_inventory(language_code))
+        if allophones:
+            from .glottolog import resolve_language_code
+            resolved = resolve_language_code(language_code) or language_code
+            for surface_forms in store.language_allophones.get(resolved, {}).values():
+                segments.extend(surface_forms)
+        trie = tries[key] = PhonemeTrie(segments)
+    return trie
+
 class PhonemeTokenizer:
-    def __init__(self, language_code: str):
-        phoneme_inventory = get_phoneme_inventory(language_code)
-        self.phoneme_inventory = sorted(phoneme_inventory, key=len, reverse=True)
-        self.phoneme_pattern = re.compile('|'.join(map(ipa_to_regex, self.phoneme_inventory)))
+    def __init__(self, language_code: str, unmatched: str = 'skip', allophones: bool = False):
+        if unmatched not in UNMATCHED_POLICIES:
+            raise ValueError(f"Unknown unmatched policy '{unmatched}', expected one of {UNMATCHED_POLICIES}")
+        self.language_code = language_code
+        self.unmatched = unmatched
+        self.allophones = allophones
+        self.trie = get_phoneme_trie(language_code, allophones)
+        self.phoneme_inventory = self.trie.segments
     
-    def tokenize(self, text: str) -> List[str]:
-        return self.phoneme_pattern.findall(text)
-
-# Load global data
-language_phonemes = load_json(get_data_file_path('language_inventories/language_phonemes.json'))
-language_allophones = load_json(get_data_file_path('language_inventories/language_allophones.json'))
-prosodic_features = load_json(get_data_file_path('language_inventories/prosodic_features.json'))
-phoneme_features = load_json(get_data_file_path('phoneme_features/phoneme_features.json'))
\ No newline at end of file
+    def tokenize(self, text: str, unmatched: Optional[str] = None) -> List[str]:
+        if not metrics.enabled:
+            return self.trie.tokenize(text, unmatched or self.unmatched)
+        with metrics.stage('tokenize', language=self.language_code):
+            tokens = self.trie.tokenize(text, unmatched or self.unmatched)
+        metrics.increment('tokenized_texts', language=self.language_code)
+        return tokens
+
+    def tokenize_many(self, texts: Iterable[str], unmatched: Optional[str] = None) -> List[List[str]]:
+        tokenize = self.trie.tokenize
+        unmatched = unmatched or self.unmatched
+        with metrics.stage('tokenize_many', language=self.language_code):
+            tokens = [tokenize(text, unmatched) for text in texts]
+        metrics.increment('tokenized_texts', len(tokens), language=self.language_code)
+        return tokens
+
+# Global datasets are resolved lazily through the shared DataStore
+def __getattr__(name: str) -> Any:
+    if name in DATASET_FILES:
+        store = get_data_store()
+        data = store.get(name)
+        if not isinstance(data, dict):
+            data = store.derived(f'dict:{name}', lambda store: dict(data.items()))
+        return data
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from .utils import atomic_write
+from .instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+WORD_CACHE_FORMAT_VERSION = 2
+# Datasets cached conversions depend on; see PhonemeConverter.word_cache_version.
+WORD_CACHE_DATASETS = ('language_phonemes', 'language_allophones', 'phoneme_features')
+
+class FrozenDict(dict):
+    """A dict that refuses modification, so cached results can be shared."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("cached results are read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.items())))
+
+def freeze(value: Any) -> Any:
+    """Deep copy of ``value`` with lists as tuples and dicts as FrozenDicts."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint of a cached key or result, in bytes."""
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+_HALVE = bytes(i >> 1 for i in range(256))
+
+
+class FrequencySketch:
+    """Count-min sketch of access frequencies with periodic aging.
+
+    Counters saturate at 15. After ``sample_size`` increments every counter
+    is halved, so the sketch tracks recent popularity rather than all-time
+    counts.
+    """
+
+    DEPTH = 4
+    _SEEDS = (0x9E3779B9, 0x85EBCA6B, 0xC2B2AE35, 0x27D4EB2F)
+
+    def __init__(self, capacity: int):
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self.width = width
+        self.mask = width - 1
+        self.table = bytearray(self.DEPTH * width)
+        self.sample_size = 10 * max(capacity, 1)
+        self.additions = 0
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        h = hash(key)
+        return [row * self.width + ((h ^ seed) * 0x2545F491 >> 7 & self.mask) for row, seed in enumerate(self._SEEDS)]
+
+    def frequency(self, key: Hashable) -> int:
+        table = self.table
+        return min(table[i] for i in self._indexes(key))
+
+    def increment(self, key: Hashable):
+        table = self.table
+        indexes = self._indexes(key)
+        low = min(table[i] for i in indexes)
+        if low < 15:
+            # Conservative update: only the smallest counters grow.
+            for i in indexes:
+                if table[i] == low:
+                    table[i] = low + 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table = bytearray(self.table.translate(_HALVE))
+            self.additions //= 2
+
+
+class WordCache:
+    """Bounded W-TinyLFU cache for per-word conversion results.
+
+    New entries go through a small LRU window (1% of the capacity). Entries
+    leaving the window compete for a place in the main segmented LRU with
+    its least recently used probationary entry. The entry with the higher
+    estimated access frequency wins, so one-off words cannot push out
+    frequent ones. Entries hit again while on probation are promoted to the
+    protected segment (80% of the main space).
+
+    Capacity is ``max_entries`` entries, or ``max_bytes`` of estimated
+    memory when given. Cached values are deeply immutable.
+    """
+
+    def __init__(self, max_entries: int = 100_000, max_bytes: Optional[int] = None, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.capacity = max_bytes if max_bytes is not None else max_entries
+        self.window_capacity = max(1, self.capacity // 100)
+        main_capacity = max(0, self.capacity - self.window_capacity)
+        self.protected_capacity = main_capacity * 8 // 10
+        self.main_capacity = main_capacity
+        self.path = path
+        # What the entries were computed from, set by their converter.
+        self.version: Optional[str] = None
+        self.sketch = FrequencySketch(max_entries if max_bytes is None else max(1, max_bytes // 512))
+
+        # key -> (value, weight)
+        self._window: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._probation: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._protected: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._weights = {'window': 0, 'probation': 0, 'protected': 0}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.rejections = 0
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def _weigh(self, key: Hashable, value: Any) -> int:
+        if self.max_bytes is None:
+            return 1
+        return estimate_size(key) + estimate_size(value)
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._probation) + len(self._protected)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._window or key in self._probation or key in self._protected
+
+    @property
+    def weight(self) -> int:
+        return sum(self._weights.values())
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            self.sketch.increment(key)
+            entry = self._window.get(key)
+            if entry is not None:
+                self._window.move_to_end(key)
+            else:
+                entry = self._protected.get(key)
+                if entry is not None:
+                    self._protected.move_to_end(key)
+                else:
+                    entry = self._probation.pop(key, None)
+                    if entry is not None:
+                        self._promote(key, entry)
+            if entry is None:
+                self.misses += 1
+                if metrics.enabled:
+                    metrics.increment('word_cache_requests', result='miss')
+                return None
+            self.hits += 1
+            if metrics.enabled:
+                metrics.increment('word_cache_requests', result='hit')
+            return entry[0]
+
+    def _promote(self, key: Hashable, entry: Tuple[Any, int]):
+        self._weights['probation'] -= entry[1]
+        self._protected[key] = entry
+        self._weights['protected'] += entry[1]
+        while self._weights['protected'] > self.protected_capacity and len(self._protected) > 1:
+            demoted, demoted_entry = self._protected.popitem(last=False)
+            self._weights['protected'] -= demoted_entry[1]
+            self._probation[demoted] = demoted_entry
+            self._weights['probation'] += demoted_entry[1]
+
+    def put(self, key: Hashable, value: Any) -> Any:
+        """Stores a frozen copy of ``value`` and returns it."""
+        value = freeze(value)
+        weight = self._weigh(key, value)
+        with self._lock:
+            if key in self:
+                self._discard(key)
+            if weight > self.capacity:
+                self.rejections += 1
+                return value
+            self._window[key] = (value, weight)
+            self._weights['window'] += weight
+            while self._weights['window'] > self.window_capacity and len(self._window) > 1:
+                candidate, entry = self._window.popitem(last=False)
+                self._weights['window'] -= entry[1]
+                self._admit(candidate, entry)
+        return value
+
+    def _admit(self, key: Hashable, entry: Tuple[Any, int]):
+        main_weight = self._weights['probation'] + self._weights['protected']
+        while main_weight + entry[1] > self.main_capacity:
+            victims = self._probation if self._probation else self._protected
+            if not victims:
+                self.rejections += 1
+                return
+            victim = next(iter(victims))
+            if self.sketch.frequency(key) <= self.sketch.frequency(victim):
+                self.rejections += 1
+                return
+            victim_entry = victims.pop(victim)
+            segment = 'probation' if victims is self._probation else 'protected'
+            self._weights[segment] -= victim_entry[1]
+            main_weight -= victim_entry[1]
+            self.evictions += 1
+        self._probation[key] = entry
+        self._weights['probation'] += entry[1]
+
+    def _discard(self, key: Hashable):
+        for name, segment in (('window', self._window), ('probation', self._probation), ('protected', self._protected)):
+            entry = segment.pop(key, None)
+            if entry is not None:
+                self._weights[name] -= entry[1]
+                return
+
+    def discard_if(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Removes the entries whose key satisfies ``predicate``; returns how many."""
+        with self._lock:
+            keys = [key for segment in (self._window, self._probation, self._protected) for key in segment]
+        stale = [key for key in keys if predicate(key)]
+        with self._lock:
+            for key in stale:
+                self._discard(key)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            for segment in (self._window, self._probation, self._protected):
+                segment.clear()
+            self._weights = dict.fromkeys(self._weights, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'weight': self.weight,
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+            'rejections': self.rejections,
+        }
+
+    def save(self, path: Optional[str] = None) -> str:
+        """Writes the entries, hottest last, as JSON tagged with their version."""
+        path = path or self.path
+        with self._lock:
+            entries = [[list(key), value] for segment in (self._probation, self._protected, self._window)
+                       for key, (value, _) in segment.items()]
+        payload = {'format': WORD_CACHE_FORMAT_VERSION, 'version': self.version, 'entries': entries}
+        with atomic_write(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        return path
+
+    def load(self, path: Optional[str] = None) -> int:
+        """Restores saved entries; returns how many were loaded.
+
+        Entries saved under another version than the cache already has are
+        skipped. A converter given the cache clears it when the version does
+        not match its data files and rules.
+        """
+        path = path or self.path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring word cache %s: %s", path, e)
+            return 0
+        if payload.get('format') != WORD_CACHE_FORMAT_VERSION:
+            return 0
+        if self.version is not None and payload.get('version') != self.version:
+            return 0
+        self.version = payload.get('version')
+        for key, value in payload['entries']:
+            key = freeze(key)
+            # Restored entries start with one recorded access.
+            self.sketch.increment(key)
+            self.put(key, value)
+        return len(payload['entries'])
+
+
+def word_key(word: Sequence[str], source_language: str, target_language: str, realize_allophones: bool = False) -> Tuple:
+    return (tuple(word), source_language, target_language, realize_allophones)
@@ -1,6 +1,12 @@
+import json
 import unittest
 import sys
 import os
+import tempfile
+import logging
+import asyncio
+import time
+import numpy as np
 
 # Add the project root directory to the Python path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -11,13 +17,44 @@ from src.core import (
     get_phoneme_inventory, get_phoneme_features
 )
 from src.core.utils import (
-    load_json, get_data_file_path, ipa_to_regex,
+    load_json, get_data_file_path, ipa_to_regex, DataStore, get_data_store, set_data_store, set_cache_dir,
     language_phonemes, language_allophones, prosodic_features, phoneme_features
 )
+from src.core.feature_matrix import FeatureMatrix, get_feature_matrix
+from src.core.conversion_tables import ConversionTableCache
+from src.core.binary_data import BinaryDataset, compile_binary_data
+from src.core.data_build import DataBuild, build_phoible
+from src.core.shared_data import publish_shared_datasets, attach_shared_datasets
+from src.core.batch import BatchConverter, convert_lines, convert_stream
+from src.core.tokenizer import PhonemeTrie, UnmatchedSegmentError
+from src.core.language_distance import LanguageDistanceMatrix, compute_language_distances, get_language_distances
+from src.core.segment_index import SegmentIndex, get_segment_index
+from src.core.allophones import AllophoneIndex, get_allophone_index
+from src.core.rule_processor import Rule, RuleSet, RuleSyntaxError
+from src.core.service import ConversionService
+from src.core.alignment import Aligner, get_aligner
+from src.core.inventory_statistics import InventoryStatistics
+from src.core.typology import TypologyIndex, QuerySyntaxError, get_typology_index, _load_index
+from src.core.word_cache import WordCache, FrozenDict, FrequencySketch, word_key
+from src.core.syllabifier import Syllabifier, get_syllabifier, get_sonority_table, GLIDE, LIQUID, NASAL, FRICATIVE, STOP, VOWEL
+from src.core.instrumentation import Metrics, RateLimitedLogger, get_metrics
+from src.core.glottolog import LanguoidTree, get_languoid_tree, read_languoids, resolve_language_code, _load_tree
 
-# Glottocodes for English and Spanish
+# Glottocodes for English, Spanish and German
 ENGLISH_GLOTTOCODE = 'stan1293'
 SPANISH_GLOTTOCODE = 'stan1288'
+GERMAN_GLOTTOCODE = 'stan1295'
+KOREAN_GLOTTOCODE = 'kore1280'
+
+def setUpModule():
+    # Caches built by the tests never touch (or come from) data/cache.
+    global _cache_dir, _previous_cache_dir
+    _cache_dir = tempfile.TemporaryDirectory()
+    _previous_cache_dir = set_cache_dir(_cache_dir.name)
+
+def tearDownModule():
+    set_cache_dir(_previous_cache_dir)
+    _cache_dir.cleanup()
 
 class TestUtils(unittest.TestCase):
     def test_load_json(self):
@@ -66,6 +103,37 @@ class TestUtils(unittest.TestCase):
         print(f"Output of phoneme_tokenizer: {tokens}")
         self.assertEqual(tokens, ['p', 'ɪ', 'ɡ'])
 
+    def test_phoneme_tokenizer_is_cached(self):
+        first = PhonemeTokenizer(ENGLISH_GLOTTOCODE)
+        second = PhonemeTokenizer(ENGLISH_GLOTTOCODE, unmatched='emit')
+        self.assertIs(first.trie, second.trie)
+
+    def test_phoneme_tokenizer_unmatched_policies(self):
+        input_text = 'pɪ?ɡ'
+        tokenizer = PhonemeTokenizer(ENGLISH_GLOTTOCODE)
+        print(f"\nInput for unmatched policies: {input_text}")
+        self.assertEqual(tokenizer.tokenize(input_text), ['p', 'ɪ', 'ɡ'])
+        self.assertEqual(tokenizer.tokenize(input_text, unmatched='emit'), ['p', 'ɪ', '?', 'ɡ'])
+        with self.assertRaises(UnmatchedSegmentError) as cm:
+            tokenizer.tokenize(input_text, unmatched='raise')
+        self.assertEqual((cm.exception.start, cm.exception.end), (2, 3))
+        with self.assertRaises(ValueError):
+            PhonemeTokenizer(ENGLISH_GLOTTOCODE, unmatched='ignore')
+
+    def test_phoneme_tokenizer_tokenize_many(self):
+        tokenizer = PhonemeTokenizer(ENGLISH_GLOTTOCODE)
+        texts = ['pɪɡ', 'θɪŋk']
+        self.assertEqual(tokenizer.tokenize_many(texts), [tokenizer.tokenize(t) for t in texts])
+
+    def test_phoneme_trie_longest_match(self):
+        trie = PhonemeTrie(['t', 'tʃ', 'tʃʰ', 'a', 'ã'])
+        print(f"\nTrie segments: {trie.segments}")
+        self.assertEqual(trie.tokenize('tʃʰatʃa'), ['tʃʰ', 'a', 'tʃ', 'a'])
+        self.assertEqual(trie.tokenize('tʃx', unmatched='emit'), ['tʃ', 'x'])
+        # Precomposed input matches the decomposed inventory spelling.
+        self.assertEqual(trie.tokenize('t\u00e3'), ['t', 'ã'])
+        self.assertEqual(trie.tokenize('xyz', unmatched='emit'), ['xyz'])
+
     def test_global_data_loaded(self):
         print("\nChecking global data loaded:")
         print(f"language_phonemes keys: {list(language_phonemes.keys())[:5]}...")
@@ -77,6 +145,266 @@ class TestUtils(unittest.TestCase):
         self.assertIsInstance(prosodic_features, dict)
         self.assertIsInstance(phoneme_features, dict)
 
+class TestDataStore(unittest.TestCase):
+    def test_datasets_load_lazily_and_once(self):
+        store = DataStore()
+        self.assertFalse(store.is_loaded('language_phonemes'))
+        first = store.language_phonemes
+        print(f"\nDataStore loaded {len(first)} inventories")
+        self.assertTrue(store.is_loaded('language_phonemes'))
+        self.assertFalse(store.is_loaded('phoneme_features'))
+        self.assertIs(store.language_phonemes, first)
+
+    def test_missing_dataset_is_empty(self):
+        store = DataStore({'prosodic_features': 'language_inventories/does_not_exist.json'})
+        with self.assertLogs('src.core.utils', level='WARNING'):
+            self.assertEqual(store.prosodic_features, {})
+
+    def test_derived_values_are_cached(self):
+        store = DataStore()
+        calls = []
+        factory = lambda s: calls.append(s) or len(s.language_phonemes)
+        self.assertEqual(store.derived('size', factory), store.derived('size', factory))
+        self.assertEqual(len(calls), 1)
+
+    def test_process_wide_store(self):
+        self.assertIs(get_data_store(), get_data_store())
+        self.assertEqual(get_data_store().language_phonemes[ENGLISH_GLOTTOCODE], language_phonemes[ENGLISH_GLOTTOCODE])
+
+class TestDataReload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.files = {}
+        for name in ('language_phonemes', 'phoneme_features'):
+            self.files[name] = os.path.join(self.tmp_dir.name, f'{name}.json')
+            self.write(name, load_json(get_data_file_path(DataStore().dataset_files[name])))
+        self.store = DataStore(self.files, binary_path=None)
+        self.original = get_data_store()
+        set_data_store(self.store)
+
+    def tearDown(self):
+        set_data_store(self.original)
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        with open(self.files[name], 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def edit_inventory(self, language_code, segments):
+        inventories = load_json(self.files['language_phonemes'])
+        inventories[language_code] = segments
+        self.write('language_phonemes', inventories)
+
+    def test_unchanged_files_are_not_reloaded(self):
+        inventories = self.store.language_phonemes
+        os.utime(self.files['language_phonemes'], ns=(0, 0))
+        self.assertEqual(self.store.changed_files(), [])
+        self.assertIsNone(self.store.reload())
+        self.assertIs(self.store.language_phonemes, inventories)
+        self.assertEqual(self.store.generation, 0)
+
+    def test_reload_keeps_unaffected_structures(self):
+        matrix = get_feature_matrix()
+        english_trie = PhonemeTokenizer(ENGLISH_GLOTTOCODE).trie
+        spanish_trie = PhonemeTokenizer(SPANISH_GLOTTOCODE).trie
+        self.edit_inventory(ENGLISH_GLOTTOCODE, ['p', 'a'])
+
+        change = self.store.reload()
+        print(f"\nReloaded: {change}")
+        self.assertEqual(change.datasets, {'language_phonemes'})
+        self.assertEqual(change.languages, {ENGLISH_GLOTTOCODE})
+        self.assertEqual(self.store.generation, 1)
+        self.assertEqual(get_phoneme_inventory(ENGLISH_GLOTTOCODE), ['p', 'a'])
+        self.assertIs(get_feature_matrix(), matrix)
+        self.assertIs(PhonemeTokenizer(SPANISH_GLOTTOCODE).trie, spanish_trie)
+        self.assertIsNot(PhonemeTokenizer(ENGLISH_GLOTTOCODE).trie, english_trie)
+
+        features = dict(self.store.phoneme_features)
+        features['p'] = dict(features['p'], nasal='+')
+        self.write('phoneme_features', features)
+        change = self.store.reload()
+        self.assertIsNone(change.languages)
+        self.assertIsNot(get_feature_matrix(), matrix)
+        merged = self.store.changes_since(0)
+        self.assertEqual(merged.datasets, {'language_phonemes', 'phoneme_features'})
+        self.assertIsNone(self.store.changes_since(2))
+
+    def test_converter_follows_reload(self):
+        converter = PhonemeConverter(table_cache_dir=None, word_cache=WordCache())
+        english = converter.get_conversion_table(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        korean = converter.get_conversion_table(KOREAN_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        converter.convert_word_with_prosody(['k', 'a'], KOREAN_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        self.edit_inventory(SPANISH_GLOTTOCODE, ['p', 'a'])
+        self.store.reload()
+
+        converted = converter.convert_word_with_prosody(['k', 'a'], KOREAN_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"\nAfter the reload: {converted[0]}")
+        self.assertEqual(list(converted[0]), ['p', 'a'])
+        self.assertIsNot(converter.get_conversion_table(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE), english)
+        self.assertIsNot(converter.get_conversion_table(KOREAN_GLOTTOCODE, SPANISH_GLOTTOCODE), korean)
+
+        korean = converter.get_conversion_table(KOREAN_GLOTTOCODE, ENGLISH_GLOTTOCODE)
+        self.edit_inventory(GERMAN_GLOTTOCODE, ['a'])
+        self.store.reload()
+        self.assertIs(converter.get_conversion_table(KOREAN_GLOTTOCODE, ENGLISH_GLOTTOCODE), korean)
+
+class TestBinaryData(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.path = compile_binary_data(os.path.join(cls.tmp_dir.name, 'phoible.kbin'), DataStore(binary_path=None))
+        cls.json_store = DataStore(binary_path=None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_inventories_round_trip(self):
+        dataset = BinaryDataset(self.path)
+        print(f"\nCompiled data file size: {os.path.getsize(self.path)} bytes")
+        self.assertEqual(len(dataset.datasets['language_phonemes']), len(self.json_store.language_phonemes))
+        self.assertEqual(dataset.inventory(ENGLISH_GLOTTOCODE), self.json_store.language_phonemes[ENGLISH_GLOTTOCODE])
+        self.assertEqual(dataset.allophones('kore1280'), self.json_store.language_allophones['kore1280'])
+
+    def test_feature_matrix_round_trip(self):
+        compiled = BinaryDataset(self.path).feature_matrix()
+        self.assertEqual(compiled.segments, get_feature_matrix().segments)
+        self.assertEqual(compiled.features, get_feature_matrix().features)
+        self.assertEqual(compiled.decode(compiled.row('θ')), get_feature_matrix().decode(get_feature_matrix().row('θ')))
+
+    def test_feature_entries_match_json(self):
+        compiled = DataStore(binary_path=self.path).phoneme_features
+        features = self.json_store.phoneme_features
+        sample = list(features)[::97] + ['p', 'θ', 'a']
+        for segment in sample:
+            self.assertEqual(list(compiled[segment].items()), list(features[segment].items()))
+        original = get_data_store()
+        try:
+            set_data_store(DataStore(binary_path=self.path))
+            from_binary = get_phoneme_features(['p', 'θ'], DataStore().dataset_files['phoneme_features'])
+        finally:
+            set_data_store(original)
+        self.assertEqual(from_binary, {segment: features[segment] for segment in ('p', 'θ')})
+
+    def test_sparse_feature_entries_round_trip(self):
+        features = {'p': {'ISO6393': 'tst', 'syllabic': '-', 'nasal': '-'}, 'm': {'nasal': '+'}}
+        path = os.path.join(self.tmp_dir.name, 'sparse_features.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(features, f)
+        store = DataStore({'phoneme_features': path}, binary_path=None)
+        compiled = BinaryDataset(compile_binary_data(os.path.join(self.tmp_dir.name, 'sparse.kbin'), store))
+        self.assertEqual({segment: compiled.phoneme_features(segment) for segment in features}, features)
+
+    def test_inventories_are_decoded_once(self):
+        dataset = BinaryDataset(self.path)
+        self.assertIs(dataset.inventory(ENGLISH_GLOTTOCODE), dataset.inventory(ENGLISH_GLOTTOCODE))
+        self.assertIs(dataset.allophones(KOREAN_GLOTTOCODE), dataset.allophones(KOREAN_GLOTTOCODE))
+
+    def test_data_store_reads_binary(self):
+        store = DataStore(binary_path=self.path)
+        self.assertIsInstance(store.binary, BinaryDataset)
+        self.assertNotIsInstance(store.language_phonemes, dict)
+        self.assertEqual(store.language_phonemes[SPANISH_GLOTTOCODE], self.json_store.language_phonemes[SPANISH_GLOTTOCODE])
+        self.assertEqual(store.phoneme_features['p']['SegmentClass'], 'consonant')
+        self.assertIn('p', store.phoneme_features)
+
+    def test_stale_binary_is_ignored(self):
+        store = DataStore({'phoneme_features': 'phoneme_features/other.json'}, binary_path=self.path)
+        with self.assertLogs('src.core.utils', level='WARNING'):
+            self.assertIsNone(store.binary)
+
+class TestDataBuild(unittest.TestCase):
+    HEADER = ['InventoryID', 'Glottocode', 'ISO6393', 'Phoneme', 'Allophones', 'Marginal', 'SegmentClass', 'syllabic', 'consonantal']
+    ROWS = [
+        ['1', 'test1234', 'tst', 'p', 'p pʰ', 'FALSE', 'consonant', '-', '+'],
+        ['1', 'test1234', 'tst', '\u00e9', 'NA', 'FALSE', 'vowel', '+', '-'],
+        ['2', 'test1234', 'tst', 'p', 'NA', 'FALSE', 'consonant', '-', '+'],
+        ['3', 'abcd1234', 'abc', 'a', 'a', 'FALSE', 'vowel', '+', '-'],
+        ['4', 'NA', '', 'k', 'NA', 'FALSE', 'consonant', '-', '+'],
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, 'sources', 'phoible.csv')
+        self._write_csv(self.ROWS)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write_csv(self, rows):
+        os.makedirs(os.path.dirname(self.csv_path), exist_ok=True)
+        with open(self.csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write('\n'.join(','.join(row) for row in [self.HEADER] + rows) + '\n')
+
+    def test_build_phoible(self):
+        outputs = build_phoible(self.csv_path)
+        print(f"\nBuilt inventories: {outputs['language_phonemes']}")
+        self.assertEqual(list(outputs['language_phonemes']), ['abcd1234', 'test1234'])
+        self.assertEqual(outputs['language_phonemes']['test1234'], ['p', 'e\u0301'])
+        self.assertEqual(outputs['language_allophones']['test1234'], {'p': ['p', 'pʰ']})
+        self.assertEqual(outputs['phoneme_features']['p'], {'SegmentClass': 'consonant', 'syllabic': '-', 'consonantal': '+'})
+        self.assertNotIn('k', outputs['phoneme_features'])
+
+    def test_incremental_build(self):
+        build = DataBuild(self.tmp_dir.name)
+        stages = ('phoible', 'binary')
+        self.assertEqual(build.build(stages), {'phoible': 'built', 'binary': 'built'})
+        features_path = build.path('phoneme_features/phoneme_features.json')
+        with open(features_path, 'rb') as f:
+            first = f.read()
+        self.assertEqual(DataBuild(self.tmp_dir.name).build(stages), {'phoible': 'skipped', 'binary': 'skipped'})
+
+        # Rows reordered: the JSON is rebuilt byte for byte, so the binary stage is skipped.
+        self._write_csv(self.ROWS[3:] + self.ROWS[:3])
+        self.assertEqual(DataBuild(self.tmp_dir.name).build(stages), {'phoible': 'built', 'binary': 'skipped'})
+        with open(features_path, 'rb') as f:
+            self.assertEqual(f.read(), first)
+
+        self._write_csv(self.ROWS + [['5', 'abcd1234', 'abc', 'b', 'NA', 'FALSE', 'consonant', '-', '+']])
+        self.assertEqual(DataBuild(self.tmp_dir.name).build(stages), {'phoible': 'built', 'binary': 'built'})
+        dataset = BinaryDataset(build.path('compiled/phoible.kbin'))
+        self.assertEqual(dataset.inventory('abcd1234'), ['a', 'b'])
+        with self.assertLogs('src.core.data_build', level='WARNING'):
+            self.assertEqual(DataBuild(self.tmp_dir.name).build(('glottolog',), force=True), {'glottolog': 'missing'})
+
+class TestSharedData(unittest.TestCase):
+    def test_publish_and_attach(self):
+        pair = (ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        with publish_shared_datasets([pair], store=DataStore(binary_path=None)) as published:
+            print(f"\nShared datasets: {published.size} bytes")
+            shared = attach_shared_datasets(published.name, install=False)
+            dataset = shared.dataset
+            self.assertEqual(dataset.inventory(ENGLISH_GLOTTOCODE), get_phoneme_inventory(ENGLISH_GLOTTOCODE))
+            self.assertEqual(dataset.allophones('kore1280'), get_data_store().language_allophones['kore1280'])
+            self.assertIsNone(dataset.conversion_table(SPANISH_GLOTTOCODE, ENGLISH_GLOTTOCODE))
+
+            original = get_data_store()
+            try:
+                attach_shared_datasets(published.name)
+                self.assertIs(get_data_store().binary, dataset)
+                cache = ConversionTableCache(FeatureAnalyzer())
+                self.assertEqual(cache._load_shared(*pair), dataset.conversion_table(*pair))
+                self.assertEqual(cache.get(*pair), ConversionTableCache(FeatureAnalyzer()).build(*pair))
+                self.assertEqual(get_feature_matrix().features, FeatureMatrix(original.phoneme_features).features)
+            finally:
+                set_data_store(original)
+
+    def test_tables_come_from_the_published_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inventories = dict(get_data_store().language_phonemes)
+            inventories[SPANISH_GLOTTOCODE] = ['p', 'a']
+            path = os.path.join(tmp_dir, 'language_phonemes.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(inventories, f, ensure_ascii=False)
+            store = DataStore({'language_phonemes': path}, binary_path=None)
+            pair = (ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+            with publish_shared_datasets([pair], store=store) as published:
+                table = published.dataset.conversion_table(*pair)
+                published.close()
+        print(f"\nPublished table targets: {sorted(set(table.values()))}")
+        self.assertEqual(set(table.values()), {'p', 'a'})
+        self.assertEqual(list(table), inventories[ENGLISH_GLOTTOCODE])
+
 class TestFeatureAnalyzer(unittest.TestCase):
     def setUp(self):
         self.analyzer = FeatureAnalyzer()
@@ -97,6 +425,28 @@ class TestFeatureAnalyzer(unittest.TestCase):
         self.assertIsInstance(different, list)
         self.assertTrue(len(similar) > 0)
         self.assertTrue(len(different) > 0)
+        self.assertEqual((similar, different), get_feature_matrix().compare(phoneme1, phoneme2))
+
+    def test_custom_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inventories = os.path.join(tmp_dir, 'language_phonemes.json')
+            with open(inventories, 'w', encoding='utf-8') as f:
+                json.dump({ENGLISH_GLOTTOCODE: ['p', 'a'], SPANISH_GLOTTOCODE: ['t', 'i']}, f)
+            analyzer = FeatureAnalyzer(DataStore({'language_phonemes': inventories}, binary_path=None))
+            features = analyzer.get_language_features(ENGLISH_GLOTTOCODE)
+            statistics = analyzer.analyze_language_inventories()
+            print(f"\nCustom store: features for {sorted(features)}, statistics for {statistics.languages}")
+            self.assertEqual(sorted(features), ['a', 'p'])
+            self.assertEqual(sorted(statistics.languages), sorted([ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE]))
+            self.assertEqual(analyzer.analyze_language_inventories(['eng']).languages, [ENGLISH_GLOTTOCODE])
+            # Resolved within the store's inventories: German borrows English.
+            self.assertEqual(sorted(analyzer.get_language_features(GERMAN_GLOTTOCODE)), ['a', 'p'])
+
+    def test_compare_unseen_phoneme(self):
+        similar, different = self.analyzer.compare_phonemes('ŋ̊ʰ', 'ŋ')
+        print(f"\nOutput of compare_phonemes for ŋ̊ʰ, ŋ - different: {different}")
+        self.assertIn('spreadGlottis', different)
+        self.assertEqual(len(similar) + len(different), len(get_feature_matrix().features))
 
     def test_find_similar_phonemes(self):
         target_phoneme = 'θ'
@@ -107,6 +457,36 @@ class TestFeatureAnalyzer(unittest.TestCase):
         print(f"Output of find_similar_phonemes: {similar[:5]}...")
         self.assertIsInstance(similar, list)
         self.assertTrue(all(isinstance(x, tuple) and len(x) == 2 for x in similar))
+        scores = [score for _, score in similar]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(sorted(p for p, _ in similar), sorted(get_phoneme_inventory(target_language)))
+
+    def test_find_similar_phonemes_many(self):
+        phonemes = ['θ', 'ð', 'ŋ']
+        print(f"\nInput for find_similar_phonemes_many: {phonemes}, {ENGLISH_GLOTTOCODE}, {SPANISH_GLOTTOCODE}")
+        similar = self.analyzer.find_similar_phonemes_many(phonemes, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"Output of find_similar_phonemes_many: {[(p, s[:3]) for p, s in similar.items()]}")
+        for phoneme in phonemes:
+            self.assertEqual(similar[phoneme], self.analyzer.find_similar_phonemes(phoneme, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE))
+        best = self.analyzer.best_matches(phonemes, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        self.assertEqual(best, {p: s[0][0] for p, s in similar.items()})
+
+    def test_analyze_language_inventories(self):
+        statistics = self.analyzer.analyze_language_inventories()
+        print(f"\nInventory statistics: {len(statistics)} languages, top segments {statistics.top_segments(3)}")
+        self.assertEqual(len(statistics), len(get_data_store().language_phonemes))
+        for code in [ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, 'kore1280']:
+            self.assertEqual(statistics.language(code), self.analyzer.analyze_language_inventory(code))
+        self.assertIs(self.analyzer.analyze_language_inventories(), statistics)
+
+        subset = self.analyzer.analyze_language_inventories([ENGLISH_GLOTTOCODE, 'spa'])
+        self.assertEqual(subset.languages, [ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE])
+        self.assertEqual(subset.sizes.tolist(), [len(get_phoneme_inventory(ENGLISH_GLOTTOCODE)), len(get_phoneme_inventory(SPANISH_GLOTTOCODE))])
+        record = subset.to_records()[0]
+        self.assertEqual(record['consonant'], statistics.language(ENGLISH_GLOTTOCODE)['SegmentClass']['consonant'])
+        self.assertEqual(dict(statistics.top_segments(1))['m'], sum('m' in inv for inv in get_data_store().language_phonemes.values()))
+        with self.assertRaises(ValueError):
+            self.analyzer.analyze_language_inventories(['xxxx9999'])
 
     def test_analyze_language_inventory(self):
         print(f"\nInput for analyze_language_inventory: {ENGLISH_GLOTTOCODE}")
@@ -115,9 +495,806 @@ class TestFeatureAnalyzer(unittest.TestCase):
         self.assertIsInstance(analysis, dict)
         self.assertTrue(len(analysis) > 0)
 
+class TestFeatureMatrix(unittest.TestCase):
+    def setUp(self):
+        self.matrix = get_feature_matrix()
+
+    def test_matrix_shape(self):
+        print(f"\nFeature matrix shape: {self.matrix.codes.shape}")
+        self.assertEqual(self.matrix.codes.shape, (len(phoneme_features), len(self.matrix.features)))
+        self.assertIn('SegmentClass', self.matrix.features)
+        self.assertNotIn('ISO6393', self.matrix.features)
+
+    def test_decode_round_trip(self):
+        decoded = self.matrix.decode(self.matrix.row('p'))
+        print(f"\nDecoded features for 'p': {decoded}")
+        for feature, value in decoded.items():
+            self.assertEqual(phoneme_features['p'][feature], value)
+
+    def test_similarity_matches_string_comparison(self):
+        source_rows, _ = self.matrix.rows(['θ', 'p'])
+        target_rows, targets = self.matrix.rows(['s', 'f', 't'])
+        scores = self.matrix.similarity(source_rows, target_rows)
+        print(f"\nSimilarity of θ, p against {targets}: {scores.tolist()}")
+        for i, source in enumerate(['θ', 'p']):
+            for j, target in enumerate(targets):
+                expected = sum(1 for f in self.matrix.features if phoneme_features[source][f] == phoneme_features[target][f])
+                self.assertEqual(scores[i, j], expected)
+
+    def test_small_matrix(self):
+        matrix = FeatureMatrix({
+            'a': {'ISO6393': 'xxx', 'syllabic': '+', 'high': '-'},
+            'i': {'ISO6393': 'yyy', 'syllabic': '+', 'high': '+'},
+            'ts': {'ISO6393': 'zzz', 'syllabic': '-', 'high': '-,+'},
+        })
+        self.assertEqual(matrix.features, ['syllabic', 'high'])
+        self.assertEqual(matrix.decode(matrix.row('ts')), {'syllabic': '-', 'high': '-,+'})
+        self.assertEqual(matrix.compare('a', 'i'), (['syllabic'], ['high']))
+        self.assertEqual(matrix.value_counts(matrix.rows(['a', 'i'])[0]), {'syllabic': {'+': 2}, 'high': {'+': 1, '-': 1}})
+
+class TestSegmentIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = get_segment_index()
+        self.matrix = get_feature_matrix()
+
+    def brute_force(self, codes, k, rows):
+        distances = (self.matrix.codes[rows] != codes).sum(axis=1)
+        order = sorted(range(len(rows)), key=lambda i: (distances[i], rows[i]))[:k]
+        return [(int(rows[i]), int(distances[i])) for i in order]
+
+    def test_tree_matches_brute_force(self):
+        all_rows = list(range(len(self.matrix)))
+        subset = all_rows[::3]
+        for segment in ['p', 'θ', 'ɕʰ', 'a', 'kǀ']:
+            codes = self.matrix.vector(segment)
+            self.assertEqual(self.index.query_vector(codes, 5), self.brute_force(codes, 5, all_rows))
+            self.assertEqual(self.index.query_vector(codes, 3, subset), self.brute_force(codes, 3, subset))
+
+    def test_query_known_segment(self):
+        result = self.index.query('θ', k=3)
+        print(f"\nNearest segments to θ: {result}")
+        self.assertEqual(result[0], ('θ', 0))
+        self.assertEqual(len(result), 3)
+
+    def test_query_restricted_to_inventory(self):
+        spanish = get_phoneme_inventory(SPANISH_GLOTTOCODE)
+        result = self.index.query('ʃ', k=2, candidates=spanish)
+        print(f"\nNearest Spanish segments to ʃ: {result}")
+        self.assertTrue(all(segment in spanish for segment, _ in result))
+        self.assertEqual(result[0][0], FeatureAnalyzer().find_similar_phonemes('ʃ', ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)[0][0])
+
+    def test_unknown_segment_is_estimated(self):
+        self.assertNotIn('k̚', self.matrix)
+        print(f"\nNearest segments to k̚: {self.index.query('k̚', k=2)}")
+        self.assertEqual(list(self.index.vector('k̚')), list(self.matrix.vector('k')))
+        # A learned diacritic: aspiration sets spreadGlottis.
+        estimated = self.matrix.decode_vector(self.index.vector('ŋ̊ʰ'))
+        self.assertEqual(estimated['spreadGlottis'], '+')
+        self.assertEqual(len(self.index.vector('?!')), len(self.matrix.features))
+
+    def test_estimates_are_bounded(self):
+        index = SegmentIndex(self.matrix)
+        index._estimates.max_size = 2
+        for segment in ['k̚', 'ŋ̊ʰ', 'p̚', 'k̚']:
+            index.vector(segment)
+        print(f"\nMemoized estimates: {len(index._estimates)}")
+        self.assertEqual(len(index._estimates), 2)
+        self.assertIn('k̚', index._estimates)
+        self.assertNotIn('ŋ̊ʰ', index._estimates)
+
+    def test_find_similar_phonemes_for_unknown_segment(self):
+        analyzer = FeatureAnalyzer()
+        similar = analyzer.find_similar_phonemes('t̚ʲ', ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"\nOutput of find_similar_phonemes for t̚ʲ: {similar[:3]}...")
+        self.assertEqual(len(similar), len(get_phoneme_inventory(SPANISH_GLOTTOCODE)))
+
+class TestAllophones(unittest.TestCase):
+    def test_resolve_allophones(self):
+        index = get_allophone_index(KOREAN_GLOTTOCODE)
+        print(f"\nKorean k̚ -> {index.resolve('k̚')}, ɕʰ -> {index.resolve('ɕʰ')}")
+        self.assertEqual(index.resolve('k̚'), 'k')
+        self.assertEqual(index.resolve('ɕʰ'), 's')
+        self.assertEqual(index.resolve('k'), 'k')
+        self.assertEqual(index.resolve('xyz'), 'xyz')
+        self.assertIs(get_allophone_index(KOREAN_GLOTTOCODE), index)
+
+    def test_realizations_are_bounded(self):
+        index = AllophoneIndex(['k'], {'k': ['k', 'kʰ']}, get_segment_index())
+        index._realizations.max_size = 2
+        for surface in ['k', 'kʰ', 'k̚', 'q']:
+            index.realize('k', surface)
+        self.assertEqual(len(index._realizations), 2)
+        self.assertEqual(index.realize('k', 'kʰ'), 'kʰ')
+
+    def test_ambiguous_allophone_resolves_to_closest_phoneme(self):
+        index = AllophoneIndex(['t', 'd'], {'t': ['t', 't̚'], 'd': ['d', 't̚', 'd̥']}, get_segment_index())
+        self.assertEqual(index.phonemes_by_allophone['t̚'], ('t', 'd'))
+        self.assertEqual(index.resolve('t̚'), 't')
+        self.assertEqual(index.resolve('d̥'), 'd')
+
+    def test_realize(self):
+        index = get_allophone_index(SPANISH_GLOTTOCODE)
+        self.assertEqual(index.realize('n', 'ŋ'), 'ŋ')
+        self.assertEqual(index.realize('n', 'n'), 'n')
+        self.assertEqual(index.realize('a', 'ɑ'), 'a')
+
+    def test_tokenize_allophones(self):
+        text = 'hak̚ɕʰaŋ'
+        tokens = PhonemeTokenizer(KOREAN_GLOTTOCODE, allophones=True).tokenize(text)
+        print(f"\nTokens for {text} with allophones: {tokens}")
+        self.assertEqual(tokens, ['h', 'a', 'k̚', 'ɕʰ', 'a', 'ŋ'])
+        self.assertEqual(PhonemeTokenizer(KOREAN_GLOTTOCODE).tokenize(text), ['h', 'a', 'k', 'a', 'ŋ'])
+
+    def test_convert_through_underlying_phoneme(self):
+        converter = PhonemeConverter(table_cache_dir=None)
+        surface = converter.convert_word(['h', 'a', 'k̚', 'ɕʰ', 'a'], KOREAN_GLOTTOCODE, ENGLISH_GLOTTOCODE)
+        underlying = converter.convert_word(['h', 'a', 'k', 's', 'a'], KOREAN_GLOTTOCODE, ENGLISH_GLOTTOCODE)
+        print(f"\nKorean surface form converted to English: {surface}")
+        self.assertEqual(surface, underlying)
+        realized = converter.convert_word(['ŋ', 'a'], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, realize_allophones=True)
+        self.assertEqual(len(realized), 2)
+
+class TestRuleProcessor(unittest.TestCase):
+    def test_insertion_deletion_and_substitution(self):
+        rules = RuleSet.from_text("""
+            // Spanish-style prothesis, lenition and final n deletion
+            ∅ -> e / # _ s C
+            d -> ð / V _ V
+            n -> ∅ / _ #
+        """, SPANISH_GLOTTOCODE)
+        words = [['s', 't', 'a'], ['a', 'd', 'a'], ['p', 'a', 'n'], ['s', 'a']]
+        results = rules.apply_many(words)
+        print(f"\nRules applied to {words}: {results}")
+        self.assertEqual(results, [['e', 's', 't', 'a'], ['a', 'ð', 'a'], ['p', 'a'], ['s', 'a']])
+
+    def test_feature_change(self):
+        rules = RuleSet(['[-syllabic,+continuant,-sonorant] -> [-continuant] / # _'], SPANISH_GLOTTOCODE)
+        self.assertEqual(rules.apply(['s', 'a']), ['t', 'a'])
+        self.assertEqual(rules.apply(['a', 's']), ['a', 's'])
+
+    def test_feature_change_keeps_major_class(self):
+        rule = '[+syllabic] -> [+nasal] / _ [+nasal]'
+        spanish = RuleSet([rule], SPANISH_GLOTTOCODE).apply(['a', 'n'])
+        print(f"\nNasalization in Spanish: {spanish}")
+        self.assertEqual(spanish, RuleSet([rule]).apply(['a', 'n']))
+        self.assertEqual(spanish, ['a\u0303', 'n'])
+
+    def test_rules_apply_simultaneously_in_order(self):
+        rules = RuleSet(['a -> b / _ a', 'b -> c'])
+        self.assertEqual(rules.apply(['a', 'a', 'a']), ['c', 'c', 'a'])
+
+    def test_syntax_errors(self):
+        for text in ['a b', '[+notafeature] -> b', 'a b -> c', 'a -> b / c d', '∅ -> [+voice]',
+                     's -> / _', 's -> ', ' -> e / # _ s']:
+            with self.assertRaises(RuleSyntaxError):
+                Rule(text)
+
+    def test_memos_are_bounded_and_use_the_store(self):
+        store = DataStore(binary_path=None)
+        rules = RuleSet(['[+periodicGlottalSource,-sonorant] -> [-periodicGlottalSource] / _ #'], ENGLISH_GLOTTOCODE, store=store)
+        self.assertIs(rules.matrix, get_feature_matrix(store))
+        rules._other_masks.max_size = rules._changes.max_size = 2
+        for segment in ['ʁ', 'ɣ', 'ʕ', 'ɦ']:
+            rules.apply(['a', segment])
+        print(f"\nMemoized masks: {len(rules._other_masks)}, changes: {len(rules._changes)}")
+        self.assertEqual(len(rules._other_masks), 2)
+        self.assertLessEqual(len(rules._changes), 2)
+        self.assertEqual(rules.apply(['a', 'b']), rules.apply(['a', 'b']))
+
+    def test_converter_post_pass(self):
+        converter = PhonemeConverter(table_cache_dir=None)
+        plain = converter.convert_word(['s', 't', 'ɑ'], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        converter.register_rules(SPANISH_GLOTTOCODE, ['∅ -> e / # _ s C'])
+        converted = converter.convert_word(['s', 't', 'ɑ'], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"\nEnglish stɑ in Spanish: {plain} -> {converted}")
+        self.assertEqual(converted, ['e'] + plain)
+
+    def test_convert_phoneme_skips_rules(self):
+        converter = PhonemeConverter(table_cache_dir=None)
+        mapped = converter.convert_phoneme('h', KOREAN_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        for rule in [f'{mapped} -> ∅', f'∅ -> e / # _ {mapped}']:
+            converter.register_rules(SPANISH_GLOTTOCODE, [rule])
+            converted = converter.convert_phoneme('h', KOREAN_GLOTTOCODE, SPANISH_GLOTTOCODE)
+            print(f"\nKorean h in Spanish with {rule!r}: {converted}")
+            self.assertEqual(converted, mapped)
+
+class TestGlottolog(unittest.TestCase):
+    def test_code_lookup(self):
+        tree = get_languoid_tree()
+        print(f"\nLanguoids: {len(tree)}, eng -> {tree.glottocode('eng')}")
+        self.assertEqual(tree.glottocode('eng'), ENGLISH_GLOTTOCODE)
+        self.assertEqual(tree.glottocode('SPA'), SPANISH_GLOTTOCODE)
+        self.assertEqual(tree.glottocode(GERMAN_GLOTTOCODE), GERMAN_GLOTTOCODE)
+        self.assertIsNone(tree.glottocode('not-a-code'))
+
+    def test_ancestors_and_descendants(self):
+        tree = get_languoid_tree()
+        self.assertEqual(tree.family_of(ENGLISH_GLOTTOCODE), 'indo1319')
+        self.assertEqual(tree.level_of(ENGLISH_GLOTTOCODE), 'language')
+        self.assertEqual(tree.ancestors(ENGLISH_GLOTTOCODE)[-1], 'indo1319')
+        self.assertTrue(tree.is_ancestor('indo1319', ENGLISH_GLOTTOCODE))
+        self.assertFalse(tree.is_ancestor(ENGLISH_GLOTTOCODE, 'indo1319'))
+        self.assertIn(ENGLISH_GLOTTOCODE, tree.descendants('indo1319'))
+        for dialect in tree.children(ENGLISH_GLOTTOCODE):
+            self.assertTrue(tree.is_ancestor(ENGLISH_GLOTTOCODE, dialect))
+
+    def test_corrupt_cache_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'glottolog.npz')
+            with open(path, 'wb') as f:
+                f.write(b'PK\x03\x04 truncated')
+            with self.assertLogs('src.core.glottolog', level='WARNING'):
+                tree = _load_tree(None, path)
+            print(f"\nRebuilt tree: {len(tree)} languoids")
+            self.assertEqual(tree.glottocode('eng'), ENGLISH_GLOTTOCODE)
+            self.assertEqual(LanguoidTree.load(path).version, tree.version)
+            self.assertEqual(os.listdir(tmp_dir), ['glottolog.npz'])
+
+    def test_resolve(self):
+        tree = LanguoidTree(['fam', 'lang', 'dia1', 'dia2', 'other'], [-1, 0, 1, 1, 0], [-1, 0, 0, 0, 0],
+                            [0, 1, 2, 2, 1], ['', 'lng', '', '', ''], ['F', 'L', 'D1', 'D2', 'O'])
+        tree.set_inventories(['dia2', 'other'])
+        self.assertEqual(tree.resolve('lng'), 'dia2')
+        self.assertEqual(tree.resolve('dia1'), 'dia2')
+        self.assertEqual(tree.resolve('other'), 'other')
+        self.assertIsNone(tree.resolve('missing'))
+
+    def test_inventory_fallback(self):
+        dialect = get_languoid_tree().children(ENGLISH_GLOTTOCODE)[0]
+        print(f"\nEnglish dialect {dialect} resolves to {resolve_language_code(dialect)}")
+        self.assertEqual(resolve_language_code(dialect), ENGLISH_GLOTTOCODE)
+        self.assertEqual(get_phoneme_inventory('eng'), get_phoneme_inventory(ENGLISH_GLOTTOCODE))
+        with self.assertRaises(ValueError):
+            get_phoneme_inventory('not-a-code')
+
+    def test_cache_round_trip(self):
+        tree = read_languoids()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = tree.save(os.path.join(tmp, 'glottolog.npz'))
+            size = os.path.getsize(path)
+            loaded = LanguoidTree.load(path)
+        csv_size = os.path.getsize(get_data_file_path('sources/glottolog_languoid/languoid.csv'))
+        print(f"\nLanguoid tree cache: {size} bytes (CSV: {csv_size} bytes)")
+        self.assertLess(size, csv_size)
+        self.assertEqual(loaded.glottocodes, tree.glottocodes)
+        self.assertEqual((loaded.iso_codes, loaded.names), (tree.iso_codes, tree.names))
+        self.assertEqual(loaded.descendants('indo1319'), tree.descendants('indo1319'))
+
+async def _http_request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+class TestService(unittest.TestCase):
+    def run_with_service(self, client, **options):
+        async def run():
+            service = ConversionService(PhonemeConverter(table_cache_dir=None), **options)
+            server = await service.start('127.0.0.1', 0)
+            try:
+                return await client(server.sockets[0].getsockname()[1])
+            finally:
+                await service.close()
+        return asyncio.run(run())
+
+    def test_endpoints(self):
+        async def client(port):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            results = [
+                await _http_request(reader, writer, 'GET', '/health'),
+                await _http_request(reader, writer, 'POST', '/tokenize', {'language': ENGLISH_GLOTTOCODE, 'text': 'kæt dɒɡ'}),
+                await _http_request(reader, writer, 'POST', '/convert', {'source': ENGLISH_GLOTTOCODE, 'target': SPANISH_GLOTTOCODE, 'text': 'kæt'}),
+                await _http_request(reader, writer, 'POST', '/convert', {'source': ENGLISH_GLOTTOCODE, 'target': 'not-a-code', 'text': 'kæt'}),
+                await _http_request(reader, writer, 'POST', '/convert', {'source': ENGLISH_GLOTTOCODE}),
+                await _http_request(reader, writer, 'GET', '/missing'),
+            ]
+            writer.close()
+            return results
+
+        health, tokenized, converted, unknown, missing, not_found = self.run_with_service(client)
+        print(f"\nService responses: {tokenized}, {converted}")
+        self.assertEqual(health, (200, health[1]))
+        self.assertEqual(health[1]['status'], 'ok')
+        self.assertEqual(tokenized[1]['words'], [['k', 'æ', 't'], ['d', 'ɒ', 'ɡ']])
+        expected = BatchConverter(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, PhonemeConverter(table_cache_dir=None)).convert_line('kæt')
+        self.assertEqual(converted, (200, expected))
+        self.assertEqual(unknown[0], 400)
+        self.assertEqual(missing[0], 400)
+        self.assertEqual(not_found[0], 404)
+
+    def test_concurrent_requests_are_batched(self):
+        async def client(port):
+            connections = [await asyncio.open_connection('127.0.0.1', port) for _ in range(16)]
+            words = ['kæt', 'dɒɡ', 'sɪt', 'mæp'] * 4
+            responses = await asyncio.gather(*[
+                _http_request(reader, writer, 'POST', '/convert', {'source': ENGLISH_GLOTTOCODE, 'target': SPANISH_GLOTTOCODE, 'text': word})
+                for (reader, writer), word in zip(connections, words)
+            ])
+            latencies = []
+            reader, writer = connections[0]
+            for _ in range(100):
+                start = time.perf_counter()
+                await _http_request(reader, writer, 'POST', '/convert', {'source': ENGLISH_GLOTTOCODE, 'target': SPANISH_GLOTTOCODE, 'text': 'kæt'})
+                latencies.append(time.perf_counter() - start)
+            for _, writer in connections:
+                writer.close()
+            return words, responses, sorted(latencies)
+
+        metrics = get_metrics()
+        metrics.reset()
+        metrics.enable()
+        try:
+            words, responses, latencies = self.run_with_service(client, batch_delay=0.01)
+            batch_sizes = metrics.snapshot()['timers']['service_batch_size']['']
+        finally:
+            metrics.disable()
+            metrics.reset()
+        print(f"\nLargest batch {batch_sizes['max']:g} of {batch_sizes['count']} batches; "
+              f"single-word latency p50 {latencies[50] * 1000:.2f} ms, p99 {latencies[98] * 1000:.2f} ms")
+        self.assertEqual([status for status, _ in responses], [200] * len(words))
+        self.assertEqual([response['text'] for _, response in responses], words)
+        self.assertGreater(batch_sizes['max'], 1)
+        self.assertLess(batch_sizes['count'], len(words) + len(latencies))
+        self.assertLess(latencies[-1], 1.0)
+
+    def test_requests_are_validated_before_batching(self):
+        async def client(port):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            results = [
+                await _http_request(reader, writer, 'POST', '/tokenize', {'language': 'not-a-code', 'text': 'kæt'}),
+                await _http_request(reader, writer, 'POST', '/tokenize', {'language': ENGLISH_GLOTTOCODE, 'text': 'kæt', 'unmatched': 'drop'}),
+                await _http_request(reader, writer, 'POST', '/tokenize', {'language': 'eng', 'text': 'kæt'}),
+                await _http_request(reader, writer, 'POST', '/tokenize', {'language': ENGLISH_GLOTTOCODE, 'text': 5}),
+                await _http_request(reader, writer, 'POST', '/convert', {'source': ENGLISH_GLOTTOCODE, 'target': SPANISH_GLOTTOCODE, 'text': 5}),
+            ]
+            for language in (ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, KOREAN_GLOTTOCODE):
+                results.append(await _http_request(reader, writer, 'POST', '/tokenize', {'language': language, 'text': 'a'}))
+            writer.close()
+            return results
+
+        service = ConversionService(PhonemeConverter(table_cache_dir=None), max_batchers=2)
+        async def run():
+            server = await service.start('127.0.0.1', 0)
+            try:
+                return await client(server.sockets[0].getsockname()[1]), list(service.batchers)
+            finally:
+                await service.close()
+        (unknown, policy, iso, tokenize_number, convert_number, *others), batchers = asyncio.run(run())
+        print(f"\nBatchers kept: {batchers}, non-string text: {convert_number}")
+        self.assertEqual((unknown[0], policy[0], iso[0]), (400, 400, 200))
+        self.assertEqual((tokenize_number[0], convert_number[0]), (400, 400))
+        self.assertEqual([status for status, _ in others], [200] * 3)
+        self.assertEqual(batchers, [('tokenize', SPANISH_GLOTTOCODE, 'skip'), ('tokenize', KOREAN_GLOTTOCODE, 'skip')])
+
+    def test_warm_resolves_codes(self):
+        service = ConversionService(PhonemeConverter(table_cache_dir=None))
+        service.warm([('kor', 'eng')])
+        print(f"\nWarmed pairs: {list(service.batch_converters)}")
+        self.assertEqual(list(service.batch_converters), [(KOREAN_GLOTTOCODE, ENGLISH_GLOTTOCODE)])
+        with self.assertRaises(ValueError):
+            service.warm([('kor', 'not-a-code')])
+        service.executor.shutdown()
+
+    def test_backpressure(self):
+        async def client(port):
+            connections = [await asyncio.open_connection('127.0.0.1', port) for _ in range(8)]
+            responses = await asyncio.gather(*[
+                _http_request(reader, writer, 'POST', '/tokenize', {'language': ENGLISH_GLOTTOCODE, 'text': 'kæt'})
+                for reader, writer in connections
+            ])
+            for _, writer in connections:
+                writer.close()
+            return responses
+
+        statuses = sorted(status for status, _ in self.run_with_service(client, max_pending=2, batch_delay=0.2))
+        print(f"\nStatuses with max_pending=2: {statuses}")
+        self.assertEqual(statuses, [200, 200] + [503] * 6)
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.metrics = get_metrics()
+        self.metrics.reset()
+        self.metrics.enable()
+
+    def tearDown(self):
+        self.metrics.disable()
+        self.metrics.reset()
+
+    def test_pipeline_stages(self):
+        tokens = PhonemeTokenizer(ENGLISH_GLOTTOCODE).tokenize('θɪŋk')
+        converter = PhonemeConverter(table_cache_dir=None)
+        converter.convert_word_with_prosody(tokens + ['ǂ'], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        FeatureAnalyzer().find_similar_phonemes('θ', ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        snapshot = self.metrics.snapshot()
+        print(f"\nMetrics snapshot: {snapshot}")
+        for stage in ('tokenize', 'convert_word', 'similarity_search', 'prosody'):
+            self.assertIn(stage, snapshot['timers'])
+        self.assertEqual(snapshot['counters']['tokenized_texts'], {f'language={ENGLISH_GLOTTOCODE}': 1})
+        self.assertEqual(snapshot['counters']['conversion_table_requests'], {'result=built': 1})
+        self.assertEqual(snapshot['counters']['unmapped_phonemes'],
+                         {f'source={ENGLISH_GLOTTOCODE},target={SPANISH_GLOTTOCODE}': 1})
+
+    def test_missing_segments_are_counted_and_rate_limited(self):
+        with self.assertLogs('src.core.utils', level='WARNING') as logs:
+            for _ in range(3):
+                get_phoneme_features(['p', 'xyz'], 'phoneme_features/phoneme_features.json', 'test0001')
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].missing_segments, ['xyz'])
+        self.assertEqual(self.metrics.snapshot()['counters']['missing_segments'], {'language=test0001': 3})
+
+    def test_prometheus_export(self):
+        metrics = Metrics(enabled=True)
+        metrics.increment('data_loads', file='a.json', source='json')
+        with metrics.stage('tokenize', language='stan1293'):
+            pass
+        text = metrics.to_prometheus()
+        print(f"\n{text}")
+        self.assertIn('# TYPE kunai_data_loads_total counter', text)
+        self.assertIn('kunai_data_loads_total{file="a.json",source="json"} 1', text)
+        self.assertIn('kunai_tokenize_seconds_count{language="stan1293"} 1', text)
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics = Metrics()
+        metrics.increment('data_loads')
+        with metrics.stage('tokenize'):
+            pass
+        self.assertEqual(metrics.snapshot(), {'enabled': False, 'counters': {}, 'timers': {}})
+        self.assertEqual(metrics.to_prometheus(), '')
+
+    def test_rate_limited_logger(self):
+        logger = RateLimitedLogger(logging.getLogger('kunai.test'), interval=3600)
+        with self.assertLogs('kunai.test', level='WARNING') as logs:
+            self.assertTrue(logger.warning('a', "first"))
+            self.assertFalse(logger.warning('a', "again"))
+            self.assertTrue(logger.warning('b', "other key"))
+        self.assertEqual([record.getMessage() for record in logs.records], ['first', 'other key'])
+
+class TestSyllabifier(unittest.TestCase):
+    def test_sonority_from_features(self):
+        syllabifier = Syllabifier()
+        sonority = {segment: syllabifier.sonority(segment) for segment in ['t', 's', 'm', 'l', 'j', 'a', 't̠ʃ']}
+        print(f"\nSonority classes: {sonority}")
+        self.assertEqual(sonority, {'t': STOP, 's': FRICATIVE, 'm': NASAL, 'l': LIQUID, 'j': GLIDE, 'a': VOWEL, 't̠ʃ': STOP})
+        self.assertTrue(syllabifier.is_syllabic('n̩'))
+        self.assertEqual(len(get_sonority_table()[0]), len(get_feature_matrix()))
+
+    def test_onset_maximization(self):
+        syllabifier = get_syllabifier(SPANISH_GLOTTOCODE)
+        words = [['p', 'a', 's', 't', 'a'], ['e', 's', 't', 'r', 'a', 'ɲ', 'o'], ['k', 'a', 'm', 'p', 'o']]
+        results = [[''.join(s['onset'] + s['nucleus'] + s['coda']) for s in syllables]
+                   for syllables in syllabifier.syllabify_many(words)]
+        print(f"\nSpanish syllables: {results}")
+        self.assertEqual(results, [['pas', 'ta'], ['es', 'tra', 'ɲo'], ['kam', 'po']])
+
+    def test_word_edges_and_constraints(self):
+        syllabifier = Syllabifier(max_onset=1, max_coda=1)
+        self.assertEqual(syllabifier.syllabify(['s', 't', 'r', 'a', 'n', 'k', 's']),
+                         [{'onset': ['s', 't', 'r'], 'nucleus': ['a'], 'coda': ['n', 'k', 's']}])
+        self.assertEqual([s['onset'] for s in syllabifier.syllabify(['a', 'b', 'l', 'a'])], [[], ['l']])
+        self.assertEqual(syllabifier.syllabify(['p', 's', 't']), [{'onset': ['p'], 'nucleus': ['s'], 'coda': ['t']}])
+        self.assertEqual(syllabifier.syllabify_many([[], ['a']]), [[], [{'onset': [], 'nucleus': ['a'], 'coda': []}]])
+
+    def test_stress_on_real_syllables(self):
+        converter = PhonemeConverter(table_cache_dir=None)
+        syllables = converter.analyze_syllable_structure(['b', 'a', 'n', 'a', 'n', 'a'], {}, SPANISH_GLOTTOCODE)
+        stressed = converter.apply_stress_pattern(syllables, {'stress_system': 'dynamic'})
+        print(f"\nStressed syllables: {stressed}")
+        self.assertEqual([s['stress'] for s in stressed], ['primary', 'secondary', 'primary'])
+
+class TestAlignment(unittest.TestCase):
+    def setUp(self):
+        self.aligner = get_aligner(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+
+    def _reference(self, source, target):
+        gap = self.aligner.gap_cost
+        table = [[gap * j for j in range(len(target) + 1)]]
+        for i in range(1, len(source) + 1):
+            row = [gap * i]
+            for j in range(1, len(target) + 1):
+                row.append(min(table[i - 1][j] + gap, row[j - 1] + gap,
+                               table[i - 1][j - 1] + self.aligner.substitution_cost(source[i - 1], target[j - 1])))
+            table.append(row)
+        return table[-1][-1]
+
+    def test_substitution_costs(self):
+        close = self.aligner.substitution_cost('p', 'b')
+        far = self.aligner.substitution_cost('p', 'a')
+        print(f"\nCosts p/b: {close:.3f}, p/a: {far:.3f}")
+        self.assertEqual(self.aligner.substitution_cost('t', 't'), 0)
+        self.assertLess(close, far)
+        weighted = Aligner(weights={'periodicGlottalSource': 100})
+        self.assertGreater(weighted.substitution_cost('p', 'b'), close)
+        with self.assertRaises(ValueError):
+            Aligner(weights={'voice': 1})
+
+    def test_alignment(self):
+        distance, alignment = self.aligner.align(['k', 'a', 't'], ['ɡ', 'a', 't', 'o'])
+        print(f"\nAlignment: {alignment} ({distance:.3f})")
+        self.assertEqual(alignment, [('k', 'ɡ'), ('a', 'a'), ('t', 't'), (None, 'o')])
+        self.assertAlmostEqual(distance, self.aligner.substitution_cost('k', 'ɡ') + self.aligner.gap_cost, places=5)
+        self.assertEqual(self.aligner.align([], ['a']), (self.aligner.gap_cost, [(None, 'a')]))
+
+    def test_batch_matches_reference(self):
+        words = [['p', 'a', 't', 'a'], ['b', 'e', 'l', 'o'], ['s', 't', 'r', 'i', 'ŋ'], ['m', 'a'], [], ['x', 'ɛ', 'θ']]
+        pairs = [(source, target) for source in words for target in words]
+        distances = Aligner(batch_size=7).distances(pairs)
+        expected = [self._reference(source, target) for source, target in pairs]
+        np.testing.assert_allclose(distances, expected, atol=1e-5)
+        for (source, target), (distance, alignment) in zip(pairs, self.aligner.align_many(pairs)):
+            self.assertEqual([s for s, _ in alignment if s is not None], source)
+            self.assertEqual([t for _, t in alignment if t is not None], target)
+            self.assertAlmostEqual(distance, self._reference(source, target), places=5)
+        normalized = self.aligner.distances([(['p', 'a'], ['p', 'a', 't', 'a'])], normalize=True)
+        self.assertAlmostEqual(float(normalized[0]), self.aligner.gap_cost / 2, places=5)
+
+class TestTypology(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.index = get_typology_index()
+        cls.inventories = get_data_store().language_phonemes
+
+    def test_corrupt_cache_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'typology.npz')
+            with open(path, 'wb') as f:
+                f.write(b'PK\x03\x04 truncated')
+            with self.assertLogs('src.core.typology', level='WARNING'):
+                index = _load_index(get_data_store(), path)
+            self.assertEqual(index.count('θ'), self.index.count('θ'))
+            self.assertEqual(TypologyIndex.load(path).version, index.version)
+
+    def test_custom_store_has_its_own_version(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inventories = os.path.join(tmp_dir, 'language_phonemes.json')
+            with open(inventories, 'w', encoding='utf-8') as f:
+                json.dump({ENGLISH_GLOTTOCODE: self.inventories[ENGLISH_GLOTTOCODE]}, f, ensure_ascii=False)
+            store = DataStore({'language_phonemes': inventories}, binary_path=None)
+            custom = _load_index(store)
+            print(f"\nCustom store index: {len(custom.languages)} language(s), version {custom.version[:16]}")
+            self.assertEqual(custom.languages, [ENGLISH_GLOTTOCODE])
+            self.assertNotEqual(custom.version, self.index.version)
+
+            path = custom.save(os.path.join(tmp_dir, 'typology.npz'))
+            self.assertEqual(len(_load_index(get_data_store(), path).languages), len(self.inventories))
+
+    def test_boolean_queries(self):
+        result = self.index.query('θ & ð & !s')
+        print(f"\nLanguages with θ and ð but no s: {len(result)}")
+        expected = sorted(code for code, inventory in self.inventories.items()
+                          if 'θ' in inventory and 'ð' in inventory and 's' not in inventory)
+        self.assertEqual(result, expected)
+        self.assertEqual(self.index.query('/θ/ and (ð or not s)'), self.index.query('θ & (ð | ~s)'))
+        self.assertEqual(self.index.count('p | !p'), len(self.inventories))
+        self.assertEqual(self.index.count('p & !p'), 0)
+        self.assertEqual(self.index.count('ʘʘʘ'), 0)
+
+    def test_feature_queries(self):
+        ejectives = self.index.count('raisedLarynxEjective=+')
+        print(f"\nLanguages with ejectives: {ejectives}")
+        self.assertGreater(ejectives, 0)
+        self.assertEqual(self.index.count('[+raisedLarynxEjective]'), ejectives)
+        self.assertIn('kore1280', self.index.query('[-sonorant,+spreadGlottis]'))
+        self.assertEqual(self.index.feature_counts()['raisedLarynxEjective']['+'], ejectives)
+        top = dict(self.index.segment_counts('raisedLarynxEjective=+', 10))
+        self.assertEqual(top.get('m'), self.index.count('raisedLarynxEjective=+ & m'))
+        for query in ['voice=+', 'θ &', '(θ', 'θ ð', '[+]']:
+            with self.assertRaises(QuerySyntaxError):
+                self.index.count(query)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = self.index.save(os.path.join(tmp_dir, 'typology.npz'))
+            print(f"\nTypology index size: {os.path.getsize(path)} bytes")
+            loaded = TypologyIndex.load(path)
+        self.assertEqual(loaded.version, self.index.version)
+        self.assertEqual(loaded.query('θ & !ð'), self.index.query('θ & !ð'))
+
+class TestWordCache(unittest.TestCase):
+    def test_frequent_entries_survive_a_scan(self):
+        cache = WordCache(max_entries=100)
+        hot = [('hot', i) for i in range(50)]
+        for _ in range(5):
+            for key in hot:
+                if cache.get(key) is None:
+                    cache.put(key, key[1])
+        for i in range(1000):
+            key = ('scan', i)
+            if cache.get(key) is None:
+                cache.put(key, i)
+        survivors = sum(key in cache for key in hot)
+        print(f"\nHot entries surviving a one-off scan: {survivors}/50, stats {cache.stats()}")
+        # Only the entry still in the admission window can be lost.
+        self.assertGreaterEqual(survivors, 49)
+        self.assertLessEqual(len(cache), 100)
+
+    def test_zipfian_hit_rate(self):
+        import random
+        rng = random.Random(0)
+        words = [f'w{i}' for i in range(5000)]
+        weights = [1 / (rank + 1) for rank in range(len(words))]
+        cache = WordCache(max_entries=500)
+        for word in rng.choices(words, weights, k=50000):
+            if cache.get(word) is None:
+                cache.put(word, word)
+        print(f"\nZipfian hit rate: {cache.stats()['hit_rate']:.3f}")
+        self.assertGreater(cache.stats()['hit_rate'], 0.55)
+
+    def test_results_are_immutable(self):
+        cache = WordCache()
+        value = cache.put('k', (['a'], [{'onset': [], 'nucleus': ['a'], 'coda': []}]))
+        self.assertEqual(value, (('a',), (FrozenDict(onset=(), nucleus=('a',), coda=()),)))
+        with self.assertRaises(TypeError):
+            value[1][0]['stress'] = 'primary'
+        self.assertEqual(json.loads(json.dumps(value)), [['a'], [{'onset': [], 'nucleus': ['a'], 'coda': []}]])
+
+    def test_memory_limit(self):
+        cache = WordCache(max_bytes=20000)
+        for i in range(1000):
+            cache.put(('word', i), ['x' * 50] * 4)
+        print(f"\nCache within byte limit: {cache.stats()}")
+        self.assertLessEqual(cache.weight, 20000)
+        self.assertGreater(len(cache), 0)
+
+    def test_sketch_ages(self):
+        sketch = FrequencySketch(16)
+        for _ in range(20):
+            sketch.increment('a')
+        self.assertEqual(sketch.frequency('a'), 15)
+        for i in range(sketch.sample_size):
+            sketch.increment(i)
+        self.assertLess(sketch.frequency('a'), 15)
+
+    def test_converter_cache_and_persistence(self):
+        cache = WordCache()
+        converter = PhonemeConverter(table_cache_dir=None, word_cache=cache)
+        words = [['θ', 'ɪ', 'ŋ', 'k'], ['p', 'ɪ', 'ɡ'], ['θ', 'ɪ', 'ŋ', 'k']]
+        plain = PhonemeConverter(table_cache_dir=None)
+        expected = [plain.convert_word_with_prosody(w, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE) for w in words]
+        results = list(converter.convert_words_with_prosody(words, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE))
+        self.assertEqual(json.dumps(results), json.dumps(expected))
+        self.assertIs(converter.convert_word_with_prosody(words[0], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE), results[0])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = cache.save(os.path.join(tmp, 'words.json'))
+            restored = WordCache(path=path)
+            self.assertEqual(len(restored), 2)
+            self.assertEqual(restored.get(word_key(words[1], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)), results[1])
+            PhonemeConverter(table_cache_dir=None, word_cache=restored)
+            self.assertEqual(len(restored), 2)
+
+            converter.register_rules(SPANISH_GLOTTOCODE, ['∅ -> e / # _ p'])
+            self.assertEqual(len(cache), 0)
+            converter.convert_word_with_prosody(words[1], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+            cache.save(path)
+            # Saved with rules registered: not reused by a converter without them.
+            without_rules = WordCache(path=path)
+            self.assertEqual(len(without_rules), 1)
+            PhonemeConverter(table_cache_dir=None, word_cache=without_rules)
+            print(f"\nWord cache versions: {cache.version[:16]} (rules), {without_rules.version[:16]} (none)")
+            self.assertEqual(len(without_rules), 0)
+
+class TestConversionTables(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = FeatureAnalyzer()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def test_table_covers_source_inventory(self):
+        tables = ConversionTableCache(self.analyzer, cache_dir=None)
+        table = tables.get(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"\nConversion table {ENGLISH_GLOTTOCODE} -> {SPANISH_GLOTTOCODE}: {table}")
+        self.assertEqual(set(table), set(get_phoneme_inventory(ENGLISH_GLOTTOCODE)))
+        spanish = set(get_phoneme_inventory(SPANISH_GLOTTOCODE))
+        self.assertTrue(all(target in spanish for target in table.values()))
+        self.assertEqual(table['θ'], self.analyzer.find_similar_phonemes('θ', ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)[0][0])
+
+    def test_tables_persist_to_disk(self):
+        tables = ConversionTableCache(self.analyzer, cache_dir=self.cache_dir.name)
+        table = tables.get(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        path = tables._table_path(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        self.assertTrue(os.path.exists(path))
+
+        reloaded = ConversionTableCache(self.analyzer, cache_dir=self.cache_dir.name)
+        reloaded.build = lambda *args: self.fail("table should come from the on-disk cache")
+        self.assertEqual(reloaded.get(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE), table)
+
+    def test_table_version_follows_the_store_files(self):
+        features = os.path.join(self.cache_dir.name, 'phoneme_features.json')
+        with open(features, 'w', encoding='utf-8') as f:
+            json.dump(get_data_store().phoneme_features, f, ensure_ascii=False)
+        store = DataStore({'phoneme_features': features}, binary_path=None)
+        tables = ConversionTableCache(self.analyzer, cache_dir=self.cache_dir.name)
+        other = ConversionTableCache(FeatureAnalyzer(store), cache_dir=self.cache_dir.name)
+        path = tables._table_path(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        other_path = other._table_path(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"\nDefault store: {path}\nCustom store: {other_path}")
+        self.assertNotEqual(path, other_path)
+
+        store.get('phoneme_features')
+        with open(features, 'w', encoding='utf-8') as f:
+            json.dump({}, f)
+        self.assertIsNotNone(store.reload())
+        self.assertNotEqual(other._table_path(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE), other_path)
+
+    def test_lru_bound(self):
+        tables = ConversionTableCache(self.analyzer, max_tables=2, cache_dir=None)
+        tables.get(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        tables.get(ENGLISH_GLOTTOCODE, GERMAN_GLOTTOCODE)
+        tables.get(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        tables.get(SPANISH_GLOTTOCODE, GERMAN_GLOTTOCODE)
+        self.assertEqual(len(tables), 2)
+        self.assertIn((ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE), tables)
+        self.assertNotIn((ENGLISH_GLOTTOCODE, GERMAN_GLOTTOCODE), tables)
+
+class TestLanguageDistances(unittest.TestCase):
+    LANGUAGES = [ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, GERMAN_GLOTTOCODE, 'kore1280', 'ital1282']
+
+    @classmethod
+    def setUpClass(cls):
+        cls.distances = compute_language_distances(cls.LANGUAGES)
+
+    def test_matrix_is_symmetric_with_zero_diagonal(self):
+        print(f"\nDistances for {self.LANGUAGES}:\n{self.distances.distances}")
+        d = self.distances.distances
+        self.assertEqual(d.shape, (5, 5))
+        self.assertTrue((d.diagonal() == 0).all())
+        self.assertTrue((abs(d - d.T) < 1e-6).all())
+        self.assertTrue(((d >= 0) & (d <= 1)).all())
+
+    def test_matches_direct_computation(self):
+        matrix = get_feature_matrix()
+        a, _ = matrix.rows(get_phoneme_inventory(ENGLISH_GLOTTOCODE))
+        b, _ = matrix.rows(get_phoneme_inventory(SPANISH_GLOTTOCODE))
+        segment_distances = matrix.distances(a, b)
+        expected = (segment_distances.min(axis=1).mean() + segment_distances.min(axis=0).mean()) / 2 / len(matrix.features)
+        self.assertAlmostEqual(self.distances.distance(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE), expected, places=5)
+
+    def test_nearest(self):
+        nearest = self.distances.nearest(SPANISH_GLOTTOCODE, k=2)
+        print(f"\nNearest languages to {SPANISH_GLOTTOCODE}: {nearest}")
+        self.assertEqual(len(nearest), 2)
+        self.assertNotIn(SPANISH_GLOTTOCODE, [language for language, _ in nearest])
+        self.assertEqual(nearest[0][0], 'ital1282')
+        self.assertLessEqual(nearest[0][1], nearest[1][1])
+        self.assertEqual(self.distances.nearest(SPANISH_GLOTTOCODE, candidates=['kore1280']), [('kore1280', self.distances.distance(SPANISH_GLOTTOCODE, 'kore1280'))])
+
+    def test_custom_store_has_its_own_version(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inventories = os.path.join(tmp_dir, 'language_phonemes.json')
+            with open(inventories, 'w', encoding='utf-8') as f:
+                json.dump({code: get_phoneme_inventory(code) for code in self.LANGUAGES[:2]}, f, ensure_ascii=False)
+            store = DataStore({'language_phonemes': inventories}, binary_path=None)
+            distances = get_language_distances(store=store)
+        print(f"\nCustom store distances: {distances.languages}, version {distances.version[:16]}")
+        self.assertEqual(distances.languages, self.LANGUAGES[:2])
+        self.assertNotEqual(distances.version, self.distances.version)
+        self.assertEqual(self.distances.version, get_data_store().data_version(('language_phonemes', 'phoneme_features')))
+
+    def test_subset_targets_and_workers(self):
+        distances = compute_language_distances(self.LANGUAGES[:2], self.LANGUAGES, workers=2, chunk_size=1)
+        self.assertEqual(distances.distances.shape, (2, 5))
+        self.assertTrue((abs(distances.distances - self.distances.distances[:2]) < 1e-6).all())
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = self.distances.save(os.path.join(tmp_dir, 'distances.npz'))
+            loaded = LanguageDistanceMatrix.load(path)
+        self.assertEqual(loaded.languages, self.LANGUAGES)
+        self.assertEqual(loaded.version, self.distances.version)
+        self.assertTrue((loaded.distances == self.distances.distances).all())
+
 class TestPhonemeConverter(unittest.TestCase):
     def setUp(self):
-        self.converter = PhonemeConverter()
+        self.converter = PhonemeConverter(table_cache_dir=None)
 
     def test_convert_phoneme(self):
         phoneme = 'θ'
@@ -134,6 +1311,26 @@ class TestPhonemeConverter(unittest.TestCase):
         print(f"Output of convert_word: {converted}")
         self.assertIsInstance(converted, list)
         self.assertEqual(len(converted), len(word))
+        expected = [self.converter.feature_analyzer.find_similar_phonemes(p, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)[0][0] for p in word]
+        self.assertEqual(converted, expected)
+
+    def test_convert_word_outside_source_inventory(self):
+        word = ['ʁ', 'a']
+        converted = self.converter.convert_word(word, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"\nOutput of convert_word for {word}: {converted}")
+        self.assertEqual(len(converted), len(word))
+        self.assertIn(converted[0], get_phoneme_inventory(SPANISH_GLOTTOCODE))
+        table = self.converter.get_conversion_table(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        self.assertNotIn('ʁ', table)
+        self.assertEqual(self.converter.convert_word(word, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE), converted)
+
+    def test_fallback_matches_are_bounded(self):
+        self.converter._fallback_matches.max_size = 2
+        for segment in ['ʁ', 'ǂ', 'ɬ']:
+            self.converter.convert_phoneme(segment, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        print(f"\nFallback matches kept: {len(self.converter._fallback_matches)}")
+        self.assertEqual(len(self.converter._fallback_matches), 2)
+        self.assertNotIn((ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, 'ʁ'), self.converter._fallback_matches)
 
     def test_apply_prosody(self):
         phonemes = ['θ', 'ɪ', 'ŋ', 'k']
@@ -141,7 +1338,7 @@ class TestPhonemeConverter(unittest.TestCase):
         prosody = self.converter.apply_prosody(phonemes, ENGLISH_GLOTTOCODE)
         print(f"Output of apply_prosody: {prosody}")
         self.assertIsInstance(prosody, list)
-        self.assertEqual(len(prosody), len(phonemes))
+        self.assertEqual(prosody, [{'onset': ['θ'], 'nucleus': ['ɪ'], 'coda': ['ŋ', 'k']}])
 
     def test_analyze_syllable_structure(self):
         phonemes = ['θ', 'ɪ', 'ŋ', 'k']
@@ -150,7 +1347,7 @@ class TestPhonemeConverter(unittest.TestCase):
         syllables = self.converter.analyze_syllable_structure(phonemes, language_prosody)
         print(f"Output of analyze_syllable_structure: {syllables}")
         self.assertIsInstance(syllables, list)
-        self.assertEqual(len(syllables), len(phonemes))
+        self.assertEqual(syllables, [{'onset': ['θ'], 'nucleus': ['ɪ'], 'coda': ['ŋ', 'k']}])
 
     def test_apply_stress_pattern(self):
         syllables = [{'onset': [], 'nucleus': ['a'], 'coda': []}]
@@ -176,7 +1373,46 @@ class TestPhonemeConverter(unittest.TestCase):
         self.assertIsInstance(converted, list)
         self.assertIsInstance(prosody, list)
         self.assertEqual(len(converted), len(word))
-        self.assertEqual(len(prosody), len(word))
+        self.assertEqual(len(prosody), 1)
+        self.assertEqual([p for syllable in prosody for part in ('onset', 'nucleus', 'coda') for p in syllable[part]], converted)
+
+    def test_convert_words_with_prosody(self):
+        words = [['θ', 'ɪ', 'ŋ', 'k'], ['p', 'ɪ', 'ɡ']]
+        results = self.converter.convert_words_with_prosody(iter(words), ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        self.assertNotIsInstance(results, list)
+        results = list(results)
+        print(f"\nOutput of convert_words_with_prosody: {results}")
+        self.assertEqual(results, [self.converter.convert_word_with_prosody(w, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE) for w in words])
+
+class TestBatch(unittest.TestCase):
+    LINES = ['θɪŋk pɪɡ', 'ðə', '', 'sɪŋ']
+
+    def test_convert_lines(self):
+        results = list(convert_lines(self.LINES, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE))
+        print(f"\nOutput of convert_lines: {results[0]}")
+        self.assertEqual([r['text'] for r in results], self.LINES)
+        self.assertEqual([len(r['words']) for r in results], [2, 1, 0, 1])
+        self.assertEqual(results[0]['words'][1]['source'], ['p', 'ɪ', 'ɡ'])
+
+    def test_process_pool_keeps_order(self):
+        lines = self.LINES * 5
+        expected = list(convert_lines(lines, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE))
+        results = list(convert_lines(lines, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, workers=2, chunk_size=3))
+        self.assertEqual(results, expected)
+
+    def test_convert_stream_jsonl(self):
+        lines = ['{"id": 7, "text": "θɪŋk"}\n', '\n', '{"id": 8, "text": "ðə"}\n']
+        outputs = [json.loads(o) for o in convert_stream(lines, ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE, 'jsonl', 'jsonl')]
+        print(f"\nOutput of convert_stream: {outputs}")
+        self.assertEqual([o['id'] for o in outputs], [7, 8])
+        self.assertEqual(outputs[0]['words'][0]['source'], ['θ', 'ɪ', 'ŋ', 'k'])
+
+    def test_convert_stream_text(self):
+        converter = BatchConverter(ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE)
+        outputs = list(convert_stream(['θɪŋk pɪɡ\n'], ENGLISH_GLOTTOCODE, SPANISH_GLOTTOCODE))
+        words = converter.convert_line('θɪŋk pɪɡ')['words']
+        self.assertEqual(outputs, [' '.join(''.join(w['converted']) for w in words)])
+
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()